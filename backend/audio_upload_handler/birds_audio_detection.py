@@ -1,56 +1,248 @@
 # Import libraries
+import io
 import logging
 import os
+import shutil
+import tempfile
+import time
 from collections import Counter
+from contextlib import contextmanager
 from urllib.parse import unquote_plus
 
-import boto3
-from birdnetlib import Recording
-from birdnetlib.analyzer import Analyzer
 from botocore.exceptions import ClientError
 
+from detection_cache import DetectionCache, record_hash
+from media_index import write_media
+from metrics import Metrics
+
 # Set up writable directory for Numba cache
 os.environ["NUMBA_CACHE_DIR"] = "/tmp/numba_cache"
 os.makedirs("/tmp/numba_cache", exist_ok=True)
 
-# Initialize AWS service clients
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('BirdTagMediaIndex')
+# AWS service clients, created on first use
+s3 = None
+table = None
+# Detection results keyed by content hash and model version
+detection_cache = DetectionCache()
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# S3 objects larger than this are streamed to a temporary file, not memory
+SPILL_THRESHOLD_BYTES = int(os.environ.get("SPILL_THRESHOLD_BYTES", str(64 * 1024 * 1024)))
+# Chunk size used when streaming an object to a temporary file
+SPILL_CHUNK_BYTES = 1024 * 1024
+
+# Path to TFLite model
+MODEL_PATH = "./BirdNET_GLOBAL_6K_V2.4_Model_FP32.tflite"
+# Path to label list
+LABEL_PATH = "./BirdNET_GLOBAL_6K_V2.4_Labels.txt"
+# Minimum confidence score for stored predictions
+MIN_CONFIDENCE = 0.5
+# BirdNET input: 3-second windows at 48 kHz, used for the warm-up pass
+SAMPLE_RATE = 48000
+WARMUP_SECONDS = 3.0
+# Inference engine: 'birdnetlib' (Recording.analyze), 'batched' (birdnet_engine)
+# or 'parallel' (batched, spread over AUDIO_WORKERS processes). birdnetlib stays
+# the default until compare_engines.py shows parity on real uploads.
+AUDIO_ENGINE = os.environ.get("AUDIO_ENGINE", "birdnetlib")
+
+# BirdNET analyzer shared by every record and warm invocation
+_analyzer = None
+
+
+# Function: Get the shared BirdNET analyzer, creating it on first use
+def get_analyzer():
+    """
+    Return the BirdNET analyzer of this container, loading it on first use.
+
+    With AUDIO_ENGINE 'batched' this is a BirdNetEngine, with 'parallel' a
+    ParallelEngine whose workers each load the model, otherwise a
+    birdnetlib Analyzer. Either way the TFLite model is loaded, its tensors
+    allocated and the label file parsed once per container. The first call
+    also analyzes a few seconds of silence so interpreter delegates and
+    buffers are set up outside the first real prediction.
+
+    Returns:
+        BirdNetEngine, ParallelEngine or Analyzer: The loaded analyzer.
+    """
+    global _analyzer
+    if _analyzer is not None:
+        return _analyzer
+
+    # BirdNET pulls in the TFLite runtime and NumPy; import on first use
+    import numpy as np
+
+    # Load model and labels
+    start = time.perf_counter()
+    if AUDIO_ENGINE == "batched":
+        from birdnet_engine import BirdNetEngine
+        analyzer = BirdNetEngine(MODEL_PATH, LABEL_PATH)
+    elif AUDIO_ENGINE == "parallel":
+        from birdnet_engine import ParallelEngine
+        analyzer = ParallelEngine(MODEL_PATH, LABEL_PATH)
+    else:
+        from birdnetlib.analyzer import Analyzer
+        analyzer = Analyzer(classifier_model_path=MODEL_PATH,
+                            classifier_labels_path=LABEL_PATH)
+    load_time = time.perf_counter() - start
+
+    # Warm up on silence
+    start = time.perf_counter()
+    silence = np.zeros(int(SAMPLE_RATE * WARMUP_SECONDS), dtype=np.float32)
+    if AUDIO_ENGINE != "birdnetlib":
+        analyzer.analyze(silence, MIN_CONFIDENCE)
+    else:
+        from birdnetlib import RecordingBuffer
+        RecordingBuffer(analyzer, silence, SAMPLE_RATE, min_conf=MIN_CONFIDENCE).analyze()
+    warmup_time = time.perf_counter() - start
+
+    _analyzer = analyzer
+    logger.info(f"Loaded BirdNET ({AUDIO_ENGINE}) in {load_time:.3f}s, "
+                f"warm-up {warmup_time:.3f}s")
+    return _analyzer
+
+
+# Function: Decode an audio file to BirdNET's input format
+def decode_audio(source):
+    """
+    Decode and resample audio to mono float32 at SAMPLE_RATE, as birdnetlib
+    does before analysis.
+
+    Args:
+        source (str or bytes): Local path to the audio file, or its encoded
+            bytes.
+
+    Returns:
+        ndarray: Mono samples.
+    """
+    import librosa
+
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    signal, _ = librosa.load(source, sr=SAMPLE_RATE, mono=True, res_type="kaiser_fast")
+    return signal.astype("float32", copy=False)
+
+
+# Function: Run the batched engine over an audio file
+def _run_engine(analyzer, source, min_conf):
+    """
+    Stream an audio file through the batched engine.
+
+    Windows are decoded and resampled block by block (stream_windows), so
+    memory stays bounded by a block plus a batch of windows whatever the
+    recording length, and detections accumulate as batches are scored.
+    Formats libsndfile cannot read are decoded whole with librosa instead.
+    Windows then go through the activity gate (AUDIO_GATE), which skips
+    silent or steady-noise windows, or in validate mode reports detections
+    it would have missed.
+
+    Args:
+        analyzer (BirdNetEngine or ParallelEngine): The shared engine.
+        source (str or bytes): Local path to the audio file, or its bytes.
+        min_conf (float): Minimum confidence score for prediction.
+
+    Returns:
+        tuple: (list of detections, dict of counts and stage timings).
+    """
+    from birdnet_engine import (GATE_MODE, WINDOW_SECONDS, gate_windows,
+                                split_windows, stream_windows)
+
+    start = time.perf_counter()
+    engine_stats = {}
+    detections = []
+    try:
+        stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        windows = gate_windows(stream_windows(stream, stats=engine_stats), stats=engine_stats)
+        for detection in analyzer.iter_detections(windows, min_conf, engine_stats):
+            if not detections:
+                engine_stats["first_detection_time"] = time.perf_counter() - start
+            detections.append(detection)
+    except Exception as e:
+        # Only fall back if nothing was analyzed yet
+        if engine_stats.get("windows"):
+            raise
+        logger.info(f"Streaming decode unavailable ({e}), decoding whole file")
+        engine_stats = {}
+        decode_start = time.perf_counter()
+        signal = decode_audio(source)
+        engine_stats["decode_time"] = time.perf_counter() - decode_start
+        windows = gate_windows(split_windows(signal), stats=engine_stats)
+        detections = analyzer.analyze_windows(windows, min_conf, stats=engine_stats)
+
+    # Validate mode: detections in windows the gate marked inactive
+    inactive = engine_stats.get("inactive_windows", set())
+    missed = [det for det in detections
+              if int(det["start_time"] // WINDOW_SECONDS) in inactive]
+    if missed and GATE_MODE == "validate":
+        logger.warning(f"Activity gate would have missed {len(missed)} detections: "
+                       f"{sorted({det['common_name'] for det in missed})}")
+
+    # Stage times are disjoint: decode time is measured inside the generator
+    run_stats = {
+        "segments": engine_stats["windows"],
+        "decode_time": engine_stats.get("decode_time", 0.0),
+        "inference_time": engine_stats["inference_time"],
+        "gate_time": engine_stats.get("gate_time", 0.0),
+        "windows_skipped": engine_stats.get("windows_skipped", 0),
+        "gate_missed": len(missed),
+    }
+    if "first_detection_time" in engine_stats:
+        run_stats["first_detection_time"] = engine_stats["first_detection_time"]
+    return detections, run_stats
+
+
 # Define function to analyze a local audio file and predict bird species
-def audio_prediction(audio_path, min_conf=0.5):
+def audio_prediction(audio_path, min_conf=MIN_CONFIDENCE, stats=None):
     """
     Analyze an audio file using BirdNET to detect bird species.
 
     Args:
-        audio_path (str): Local path to the audio file.
+        audio_path (str or bytes): Local path to the audio file, or its
+            encoded bytes.
         min_conf (float): Minimum confidence score for prediction.
+        stats (dict): Optional dict filled with analysis counts and timings
+            on success.
 
     Returns:
         list: A list of predicted bird species (common names).
     """
     try:
-        # Path to TFLite model
-        model_path = "./BirdNET_GLOBAL_6K_V2.4_Model_FP32.tflite"
-        # Path to label list
-        label_path = "./BirdNET_GLOBAL_6K_V2.4_Labels.txt"
+        # Get the shared BirdNET analyzer (slow only on a cold container)
+        start = time.perf_counter()
+        analyzer = get_analyzer()
+        model_load_time = time.perf_counter() - start
 
-        # Initialize BirdNET analyzer
-        analyzer = Analyzer(classifier_model_path=model_path,
-                            classifier_labels_path=label_path)
+        if AUDIO_ENGINE != "birdnetlib":
+            # Decode block by block while earlier windows are being scored
+            detections, run_stats = _run_engine(analyzer, audio_path, min_conf)
+        else:
+            from birdnetlib import Recording, RecordingFileObject
 
-        # Create recording object
-        recording = Recording(analyzer, audio_path, min_conf=min_conf)
-        # Run the model
-        recording.analyze()
+            # Create recording object, decoding in-memory audio from a buffer
+            if isinstance(audio_path, (bytes, bytearray)):
+                recording = RecordingFileObject(analyzer, io.BytesIO(audio_path),
+                                                min_conf=min_conf)
+            else:
+                recording = Recording(analyzer, audio_path, min_conf=min_conf)
+            # Run the model (decodes the audio, then runs inference on it)
+            start = time.perf_counter()
+            recording.analyze()
+            detections = recording.detections
+            run_stats = {
+                "segments": len(getattr(recording, "chunks", [])),
+                "analysis_time": time.perf_counter() - start,
+            }
 
         # Extract bird names
-        labels = [det["common_name"] for det in recording.detections]
+        labels = [det["common_name"] for det in detections]
+        if stats is not None:
+            stats.update({
+                "detections": len(labels),
+                "model_load_time": model_load_time,
+                **run_stats,
+            })
         # Return label list
         return labels
 
@@ -61,65 +253,189 @@ def audio_prediction(audio_path, min_conf=0.5):
         return []
 
 
+# Function: Get the S3 client, creating it on first use
+def _get_s3():
+    global s3
+    if s3 is None:
+        import boto3
+        s3 = boto3.client('s3')
+    return s3
+
+
+# Function: Get the media index table, creating it on first use
+def _get_table():
+    global table
+    if table is None:
+        import boto3
+        table = boto3.resource('dynamodb').Table('BirdTagMediaIndex')
+    return table
+
+
+# Function: Download an S3 object into memory or a temporary file
+@contextmanager
+def _fetch_object(bucket_name, object_key, spill=False, metrics=None):
+    """
+    Read an S3 object without going through a fixed /tmp path.
+
+    Objects up to SPILL_THRESHOLD_BYTES are read into memory. Larger ones,
+    or any object when `spill` is set, are streamed to a uniquely named
+    temporary file that is removed when the context exits.
+
+    Args:
+        bucket_name (str): S3 bucket name.
+        object_key (str): S3 object key.
+        spill (bool): Always write the object to a temporary file.
+        metrics (Metrics): Optional metrics the download time and size are
+            added to.
+
+    Yields:
+        bytes or str: Object content, or the path of the temporary file.
+    """
+    start = time.perf_counter()
+    response = _get_s3().get_object(Bucket=bucket_name, Key=object_key)
+    body = response['Body']
+    if metrics is not None:
+        metrics.add("object_bytes", response['ContentLength'], "Bytes")
+    try:
+        if not spill and response['ContentLength'] <= SPILL_THRESHOLD_BYTES:
+            data = body.read()
+            if metrics is not None:
+                metrics.add_time("s3_download", time.perf_counter() - start)
+            yield data
+            return
+
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(object_key)[-1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(body, f, SPILL_CHUNK_BYTES)
+            if metrics is not None:
+                metrics.add_time("s3_download", time.perf_counter() - start)
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+    finally:
+        body.close()
+
+
+# Function: Version label of detection results for the cache
+def _cache_version():
+    """
+    Identify the model and settings that produced a result, so cached
+    results are never reused across model changes.
+
+    Returns:
+        str: Version label.
+    """
+    version = f"audio:{os.path.basename(MODEL_PATH)}:{MIN_CONFIDENCE}"
+    # The batched engines resample differently from birdnetlib, so their
+    # results are kept apart
+    if AUDIO_ENGINE != "birdnetlib":
+        version += ":batched"
+    # Skipping windows can change results; validate mode scores them all
+    if AUDIO_ENGINE != "birdnetlib" and os.environ.get("AUDIO_GATE") == "on":
+        from birdnet_engine import GATE_ENERGY_DB, GATE_FLUX
+        version += f":gate:{GATE_ENERGY_DB}:{GATE_FLUX}"
+    return version
+
+
+# Function: Copy audio_prediction stats into the record's metrics
+def _add_audio_metrics(metrics, audio_stats):
+    """
+    Args:
+        metrics (Metrics): Metrics of the record.
+        audio_stats (dict): Stats filled in by audio_prediction, empty if it
+            failed.
+    """
+    if not audio_stats:
+        metrics.add("errors", 1)
+    metrics.add("segments", audio_stats.get("segments", 0))
+    metrics.add("detections", audio_stats.get("detections", 0))
+    metrics.add("windows_skipped", audio_stats.get("windows_skipped", 0))
+    metrics.add("gate_missed", audio_stats.get("gate_missed", 0))
+    for stage in ("model_load", "decode", "gate", "inference", "analysis", "first_detection"):
+        if f"{stage}_time" in audio_stats:
+            metrics.add_time(stage, audio_stats[f"{stage}_time"])
+
+
 # Define AWS Lambda entry point function
 def handler(event, context):
     """
     AWS Lambda handler to process audio files uploaded to S3.
     Downloads the audio, predicts bird species, and logs results in DynamoDB.
+    Stage timings of every record are emitted as one EMF metric line.
     """
     # Loop over S3 records
     for record in event.get("Records", []):
         bucket_name = record['s3']['bucket']['name']
         object_key = unquote_plus(record['s3']['object']['key'])
 
+        # Content hash reported by S3
+        digest = record_hash(record)
+
         # Log received event
         logger.info(f"Received new S3 object: {bucket_name}/{object_key}")
-
-        # Define local file path in /tmp
-        local_path = f"/tmp/{os.path.basename(object_key)}"
-
-        try:
-            # Download audio file from S3
-            s3.download_file(bucket_name, object_key, local_path)
-            # Log success
-            logger.info(f"Downloaded audio to {local_path}")
-        except ClientError as e:
-            # Log S3 error
-            logger.error(f"Failed to download file: {e}")
-            continue
+        metrics = Metrics("birds_audio_detection", object_key=object_key)
 
         # Initialize list of predictions
         predictions = []
         # File type
         file_type = ""
+        # Result reused from the detection cache
+        cached = None
+        # Filled in by audio_prediction only when it completes
+        audio_stats = {}
 
         # Check if file is an audio file
         if object_key.startswith("Audios/"):
             # Set file type
             file_type = "audio"
-            try:
-                # Run BirdNET prediction
-                predictions = audio_prediction(local_path)
-            except Exception as e:
-                # Log error if prediction fails
-                logger.warning(f"Audio analysis failed: {e}")
-                # Fallback to empty result
-                predictions = []
+            metrics.set_property("file_type", file_type)
+            # Identical content seen before skips download and analysis
+            with metrics.timer("dynamodb_read"):
+                cached = detection_cache.get(digest, _cache_version())
+            if cached is not None:
+                logger.info(f"Detection cache hit for {object_key}")
+                metrics.add("cache_hit", 1)
+            else:
+                try:
+                    # Read audio into memory (or a temporary file if large)
+                    with _fetch_object(bucket_name, object_key, metrics=metrics) as source:
+                        try:
+                            # Run BirdNET prediction
+                            predictions = audio_prediction(source, stats=audio_stats)
+                        except Exception as e:
+                            # Log error if prediction fails
+                            logger.warning(f"Audio analysis failed: {e}")
+                            # Fallback to empty result
+                            predictions = []
+                except ClientError as e:
+                    # Log S3 error
+                    logger.error(f"Failed to download file: {e}")
+                    metrics.add("errors", 1)
+                    metrics.flush()
+                    continue
+                _add_audio_metrics(metrics, audio_stats)
 
         # Count each species frequency
-        tag_summary = dict(Counter(predictions))
+        tag_summary = cached["tags"] if cached else dict(Counter(predictions))
+        if audio_stats:
+            with metrics.timer("dynamodb_write"):
+                detection_cache.put(digest, _cache_version(),
+                                    {"file_type": file_type, "tags": tag_summary})
         # Build public S3 URL
         file_url = f"https://{bucket_name}.s3.amazonaws.com/{object_key}"
 
         try:
             # Save result to DynamoDB
-            table.put_item(Item={
-                'file_id': file_url,
-                'file_type': file_type,
-                'tags': tag_summary
-            })
+            with metrics.timer("dynamodb_write"):
+                synced = write_media(_get_table(), file_url, file_type, tag_summary)
             # Log success
             logger.info(f"Stored result in DynamoDB for: {object_key}")
+            if not synced:
+                metrics.add("stats_sync_failed", 1)
         except ClientError as e:
             # Log write failure
             logger.error(f"Failed to write to DynamoDB: {e}")
+            metrics.add("errors", 1)
+        # Emit stage timings of this record
+        metrics.flush()
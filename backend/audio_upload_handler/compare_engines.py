@@ -0,0 +1,90 @@
+# Import libraries
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+import numpy as np
+from birdnetlib import RecordingBuffer
+from birdnetlib.analyzer import Analyzer
+
+from birdnet_engine import SAMPLE_RATE, BirdNetEngine, ParallelEngine
+from birds_audio_detection import LABEL_PATH, MIN_CONFIDENCE, MODEL_PATH, decode_audio
+
+# Audio extensions evaluated
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".flac")
+
+
+# Function: Reduce detections to comparable (window, species) pairs
+def detection_keys(detections):
+    return Counter((det["start_time"], det["common_name"]) for det in detections)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compare the batched BirdNET engine against birdnetlib.")
+    parser.add_argument("audio", help="Folder of evaluation recordings")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Also check a ParallelEngine with this many workers")
+    parser.add_argument("--confidence", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument("--output", default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    analyzer = Analyzer(classifier_model_path=MODEL_PATH, classifier_labels_path=LABEL_PATH)
+    engine = BirdNetEngine(MODEL_PATH, LABEL_PATH, threads=args.threads,
+                           batch_size=args.batch_size)
+    parallel = None
+    if args.workers > 1:
+        parallel = ParallelEngine(MODEL_PATH, LABEL_PATH, workers=args.workers,
+                                  batch_size=args.batch_size)
+
+    report = []
+    for name in sorted(os.listdir(args.audio)):
+        if not name.lower().endswith(AUDIO_EXTENSIONS):
+            continue
+        # Both engines see the same decoded signal
+        signal = decode_audio(os.path.join(args.audio, name))
+
+        start = time.perf_counter()
+        recording = RecordingBuffer(analyzer, signal, SAMPLE_RATE, min_conf=args.confidence)
+        recording.analyze()
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        detections = engine.analyze(signal, args.confidence)
+        engine_time = time.perf_counter() - start
+
+        reference, candidate = detection_keys(recording.detections), detection_keys(detections)
+        max_diff = max((abs(a["confidence"] - b["confidence"])
+                        for a, b in zip(recording.detections, detections)), default=0.0)
+        report.append({
+            "file": name,
+            "seconds": len(signal) / SAMPLE_RATE,
+            "identical": reference == candidate,
+            "missing": sum((reference - candidate).values()),
+            "extra": sum((candidate - reference).values()),
+            "max_confidence_diff": float(max_diff),
+            "birdnetlib_s": reference_time,
+            "batched_s": engine_time,
+            "speedup": reference_time / engine_time if engine_time else float(np.inf),
+        })
+        if parallel is not None:
+            start = time.perf_counter()
+            parallel_detections = parallel.analyze(signal, args.confidence)
+            parallel_time = time.perf_counter() - start
+            report[-1].update({
+                # Shards are the serial batches, so results must match exactly
+                "parallel_identical": parallel_detections == detections,
+                "parallel_s": parallel_time,
+                "parallel_speedup": engine_time / parallel_time if parallel_time else float(np.inf),
+            })
+        print(json.dumps(report[-1]))
+
+    if parallel is not None:
+        parallel.close()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
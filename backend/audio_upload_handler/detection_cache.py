@@ -0,0 +1,183 @@
+# Import libraries
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from decimal import Decimal
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Set up the logger
+logger = logging.getLogger()
+
+# DynamoDB table of the persistent tier (empty keeps the cache in-process only)
+CACHE_TABLE = os.environ.get("DETECTION_CACHE_TABLE", "BirdTagDetectionCache")
+# Number of entries kept in the in-process LRU tier
+CACHE_MAX_ENTRIES = int(os.environ.get("DETECTION_CACHE_SIZE", "1024"))
+
+
+# Function: Hash file content
+def content_hash(data):
+    """
+    Hash file content the same way S3 computes the ETag of a single-part
+    upload, so query-by-file requests can hit entries written at ingest.
+
+    Args:
+        data (bytes): File content.
+
+    Returns:
+        str: Hex MD5 digest.
+    """
+    return hashlib.md5(data, usedforsecurity=False).hexdigest()
+
+
+# Content hashes of files read from disk, by (path, mtime, size)
+_file_hashes = {}
+
+
+# Function: Hash a file on disk
+def file_hash(path):
+    """
+    Hash a file's content in chunks, once per version of the file, so
+    separately built images that ship the same model agree on its version.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+# Function: Get the content hash S3 reported for an event record
+def record_hash(record):
+    """
+    Args:
+        record (dict): S3 event record.
+
+    Returns:
+        str: Object ETag without quotes, or None if absent.
+    """
+    etag = record['s3']['object'].get('eTag')
+    return etag.strip('"') if etag else None
+
+
+# Function: Convert DynamoDB numbers back to plain Python numbers
+def _from_dynamo(value):
+    """
+    Recursively turn Decimal values read from DynamoDB into int/float.
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: _from_dynamo(v) for k, v in value.items()}
+    return value
+
+
+# Two-tier cache of detection results keyed by content hash and model version
+class DetectionCache:
+    """
+    Cache of tag summaries keyed by content hash and model version.
+
+    Lookups go to an in-process LRU first and then to a DynamoDB table, so
+    results survive cold starts and are shared by the ingest and
+    query-by-file handlers.
+    """
+
+    def __init__(self, table_name=CACHE_TABLE, max_entries=CACHE_MAX_ENTRIES):
+        """
+        Args:
+            table_name (str): DynamoDB table name, empty to disable it.
+            max_entries (int): Capacity of the in-process tier.
+        """
+        self.max_entries = max_entries
+        self.table_name = table_name
+        self._entries = OrderedDict()
+        self._table = None
+
+    @property
+    def table(self):
+        """
+        DynamoDB table of the persistent tier, created on first use so that
+        constructing the cache does not import boto3. None when disabled.
+        """
+        if self._table is None and self.table_name:
+            import boto3
+            self._table = boto3.resource('dynamodb').Table(self.table_name)
+        return self._table
+
+    @staticmethod
+    def _key(digest, model_version):
+        return f"{digest}#{model_version}"
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, digest, model_version):
+        """
+        Look up a cached result.
+
+        Args:
+            digest (str): Content hash of the file.
+            model_version (str): Version of the model and settings used.
+
+        Returns:
+            dict: Cached entry ('file_type', 'tags', ...), or None on a miss.
+        """
+        if not digest:
+            return None
+        key = self._key(digest, model_version)
+
+        # In-process tier
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+
+        # Persistent tier; any AWS failure is treated as a miss
+        try:
+            if self.table is None:
+                return None
+            item = self.table.get_item(Key={'content_key': key}).get('Item')
+        except (ClientError, BotoCoreError) as e:
+            logger.warning(f"Detection cache read failed: {e}")
+            return None
+        if item is None:
+            return None
+
+        entry = {k: _from_dynamo(v) for k, v in item.items() if k != 'content_key'}
+        self._remember(key, entry)
+        return entry
+
+    def put(self, digest, model_version, entry):
+        """
+        Store a result in both tiers.
+
+        Args:
+            digest (str): Content hash of the file.
+            model_version (str): Version of the model and settings used.
+            entry (dict): Result with at least 'file_type' and 'tags'.
+        """
+        if not digest:
+            return
+        key = self._key(digest, model_version)
+        self._remember(key, entry)
+
+        try:
+            if self.table is None:
+                return
+            self.table.put_item(Item={'content_key': key, **entry})
+        except (ClientError, BotoCoreError) as e:
+            logger.warning(f"Detection cache write failed: {e}")
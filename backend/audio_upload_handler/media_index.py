@@ -0,0 +1,469 @@
+# Import libraries
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from species_names import canonical_species, display_species
+
+# Set up the logger
+logger = logging.getLogger()
+
+# Inverted index of species -> file postings (empty disables it)
+SPECIES_INDEX_TABLE = os.environ.get("SPECIES_INDEX_TABLE", "BirdTagSpeciesIndex")
+# Species x file type aggregates: files and birds (empty disables it)
+SPECIES_STATS_TABLE = os.environ.get("SPECIES_STATS_TABLE", "BirdTagSpeciesStats")
+# Table holding the version counter every index write bumps (empty disables it)
+INDEX_VERSION_TABLE = os.environ.get("INDEX_VERSION_TABLE", "BirdTagIndexVersion")
+VERSION_KEY = {'counter': 'media_index'}
+# Media index attribute holding the file type and tags the species index and
+# statistics still reflect, set on items whose sync failed after the write
+PENDING_ATTRIBUTE = 'index_pending'
+
+# Postings read per Query page
+POSTING_PAGE_SIZE = int(os.environ.get("POSTING_PAGE_SIZE", "500"))
+# Keys per BatchGetItem request (DynamoDB maximum)
+BATCH_GET_SIZE = 100
+# BatchGetItem attempts per chunk while DynamoDB leaves keys unprocessed
+MAX_ATTEMPTS = int(os.environ.get("POSTING_MAX_ATTEMPTS", "6"))
+
+# DynamoDB resource and index tables, created on first use in each thread.
+# boto3 resources and the default session must not be shared between
+# threads, so each thread builds its resource from a session of its own.
+_local = threading.local()
+
+
+# Function: Get the DynamoDB resource, creating it on first use
+def _resource():
+    if getattr(_local, 'dynamodb', None) is None:
+        import boto3
+        _local.dynamodb = boto3.session.Session().resource('dynamodb')
+    return _local.dynamodb
+
+
+# Function: Get the species index table, creating it on first use
+def species_table():
+    """
+    Returns:
+        DynamoDB.Table: Species index, reused for the life of the container,
+        or None when SPECIES_INDEX_TABLE is empty.
+    """
+    if getattr(_local, 'species_table', None) is None and SPECIES_INDEX_TABLE:
+        _local.species_table = _resource().Table(SPECIES_INDEX_TABLE)
+    return getattr(_local, 'species_table', None)
+
+
+# Function: Get the species statistics table, creating it on first use
+def stats_table():
+    """
+    Returns:
+        DynamoDB.Table: Species statistics, reused for the life of the
+        container, or None when SPECIES_STATS_TABLE is empty.
+    """
+    if getattr(_local, 'stats_table', None) is None and SPECIES_STATS_TABLE:
+        _local.stats_table = _resource().Table(SPECIES_STATS_TABLE)
+    return getattr(_local, 'stats_table', None)
+
+
+# Function: Bump the table-wide version counter
+def bump_version():
+    """
+    Mark the media index as changed, so query caches drop their results.
+    A failed bump is logged and leaves cached results to expire by TTL.
+    """
+    if not INDEX_VERSION_TABLE:
+        return
+    try:
+        _resource().Table(INDEX_VERSION_TABLE).update_item(
+            Key=VERSION_KEY,
+            UpdateExpression='ADD #version :one',
+            ExpressionAttributeNames={'#version': 'version'},
+            ExpressionAttributeValues={':one': 1}
+        )
+    except ClientError as e:
+        logger.warning(f"Index version bump failed: {e}")
+
+
+# Function: Read the table-wide version counter
+def read_version():
+    """
+    Returns:
+        int: Current version (0 before the first write), or None when
+        INDEX_VERSION_TABLE is empty.
+    """
+    if not INDEX_VERSION_TABLE:
+        return None
+    item = _resource().Table(INDEX_VERSION_TABLE).get_item(Key=VERSION_KEY).get('Item')
+    return int(item['version']) if item else 0
+
+
+# Function: Normalize a species name into an index key
+def normalize_species(name):
+    """
+    Map a species name to its canonical key, so 'Crow', 'crow ' and 'CROW'
+    share one index key, as do the common and scientific names of species
+    in the vocabulary (see species_names.py).
+
+    Args:
+        name (str): Species name as tagged.
+
+    Returns:
+        str: Index key, empty if the name is blank.
+    """
+    return canonical_species(name)
+
+
+# Function: Merge tags naming the same species
+def canonical_tags(tags):
+    """
+    Args:
+        tags (dict): Species name -> count, as detected or entered.
+
+    Returns:
+        dict: Display name -> count, one entry per species.
+    """
+    merged = {}
+    for name, count in (tags or {}).items():
+        species = normalize_species(name)
+        if species:
+            display, total = merged.get(species, (display_species(name), 0))
+            merged[species] = (display, total + int(count))
+    return dict(merged.values())
+
+
+# Function: Count tags per normalized species
+def species_counts(tags):
+    """
+    Args:
+        tags (dict): Species name -> count, as stored in the media index.
+
+    Returns:
+        dict: Normalized species -> count; names that normalize to the same
+        key have their counts summed.
+    """
+    counts = {}
+    for name, count in (tags or {}).items():
+        species = normalize_species(name)
+        if species:
+            counts[species] = counts.get(species, 0) + int(count)
+    return counts
+
+
+# Function: Bring the postings of one file in line with its tags
+def update_postings(file_id, file_type, tags, stale=(), batch=None):
+    """
+    Write one posting per species in `tags` and delete the postings of the
+    species in `stale` that are no longer tagged.
+
+    Postings are rewritten rather than diffed, so repeating an update (e.g.
+    a redelivered S3 event) also repairs postings a failed write left out.
+
+    Args:
+        file_id (str): File URL, the media index key.
+        file_type (str): 'image', 'video', 'audio' or empty.
+        tags (dict): Current species name -> count of the file.
+        stale (iterable): Species names the file may have had postings for.
+        batch (BatchWriter): Optional open batch writer of the species index
+            to add the writes to, e.g. when backfilling many files.
+    """
+    if batch is None:
+        table = species_table()
+        if table is not None:
+            with table.batch_writer() as batch:
+                update_postings(file_id, file_type, tags, stale, batch)
+        return
+
+    counts = species_counts(tags)
+    removed = {normalize_species(name) for name in stale} - set(counts) - {""}
+    for species, count in counts.items():
+        batch.put_item(Item={
+            'species': species,
+            'file_id': file_id,
+            'file_type': file_type,
+            'count': count
+        })
+    for species in removed:
+        batch.delete_item(Key={'species': species, 'file_id': file_id})
+
+
+# Function: Stats key of a file type
+def stats_type(file_type):
+    # Key attributes cannot be empty strings
+    return file_type or 'unknown'
+
+
+# Function: Apply file changes to the species statistics
+def update_stats(changes):
+    """
+    Add the difference between the old and new tags of files to the
+    species statistics with atomic ADD updates, one per species and file
+    type touched.
+
+    Deltas come from the item the write itself replaced (ReturnValues), so
+    a repeated write adds nothing and concurrent writers do not lose counts.
+
+    Args:
+        changes (iterable): (item before, item after) pairs of media index
+            items, either of which may be None.
+    """
+    table = stats_table()
+    if table is None:
+        return
+
+    # (species, file type) -> [files delta, birds delta]
+    deltas = {}
+    for old_item, new_item in changes:
+        for item, sign in ((old_item or {}, -1), (new_item or {}, 1)):
+            file_type = stats_type(item.get('file_type'))
+            for species, count in species_counts(item.get('tags')).items():
+                delta = deltas.setdefault((species, file_type), [0, 0])
+                delta[0] += sign
+                delta[1] += sign * count
+
+    for (species, file_type), (files, birds) in deltas.items():
+        if files or birds:
+            table.update_item(
+                Key={'species': species, 'file_type': file_type},
+                UpdateExpression='ADD files :files, birds :birds',
+                ExpressionAttributeValues={':files': files, ':birds': birds}
+            )
+
+
+# Function: Bring the derived tables in line with a media index write
+def record_change(file_id, old_item, new_item, bump=True):
+    """
+    Update the species index and statistics after a media index item was
+    written or deleted, then bump the index version.
+
+    Args:
+        file_id (str): File URL.
+        old_item (dict): Item before the write, or None if it was new.
+        new_item (dict): Item after the write, or None if it was deleted.
+        bump (bool): Bump the version; bulk callers bump once at the end.
+    """
+    old_item, new_item = old_item or {}, new_item or {}
+    update_postings(file_id, new_item.get('file_type'), new_item.get('tags', {}),
+                    stale=old_item.get('tags', {}))
+    update_stats([(old_item, new_item)])
+    if bump:
+        bump_version()
+
+
+# Function: Write a media index item and its postings
+def write_media(table, file_id, file_type, tags):
+    """
+    Put the tag summary of a file in the media index, with tags stored
+    under their display names, then update the species index and
+    statistics against the item it replaced.
+
+    If that update fails after the put, the item keeps what the derived
+    tables still reflect in PENDING_ATTRIBUTE. The next write of the file,
+    such as a redelivered event, then applies the whole delta instead of
+    seeing an unchanged item.
+
+    Args:
+        table (DynamoDB.Table): Media index table.
+        file_id (str): File URL.
+        file_type (str): 'image', 'video', 'audio' or empty.
+        tags (dict): Species name -> count.
+
+    Returns:
+        bool: True if the species index and statistics were updated.
+    """
+    item = {'file_id': file_id, 'file_type': file_type, 'tags': canonical_tags(tags)}
+    response = table.put_item(Item=item, ReturnValues='ALL_OLD')
+    old_item = response.get('Attributes') or {}
+    # A sync left pending by an earlier write starts from what it reflects
+    base = old_item.get(PENDING_ATTRIBUTE, old_item)
+    try:
+        record_change(file_id, base, item)
+        return True
+    except (ClientError, BotoCoreError) as e:
+        logger.error(f"Species index and statistics not updated for {file_id}: {e}")
+
+    try:
+        table.update_item(
+            Key={'file_id': file_id},
+            UpdateExpression='SET #pending = :base',
+            ConditionExpression='attribute_exists(file_id)',
+            ExpressionAttributeNames={'#pending': PENDING_ATTRIBUTE},
+            ExpressionAttributeValues={':base': {'file_type': base.get('file_type'),
+                                                 'tags': base.get('tags', {})}},
+        )
+    except (ClientError, BotoCoreError) as e:
+        logger.error(f"Pending sync of {file_id} not recorded; run "
+                     f"reconcile_species_stats.py: {e}")
+    return False
+
+
+# Function: Delete a media index item and its postings
+def delete_media(table, file_id):
+    """
+    Args:
+        table (DynamoDB.Table): Media index table.
+        file_id (str): File URL.
+    """
+    response = table.delete_item(Key={'file_id': file_id}, ReturnValues='ALL_OLD')
+    record_change(file_id, response.get('Attributes'), None)
+
+
+# Function: Bring the derived tables in line with deleted media index items
+def record_deletes(old_items):
+    """
+    Remove the postings and statistics of deleted files in bulk: postings
+    through one batch writer, statistics with one update per species and
+    file type, then a single version bump.
+
+    Args:
+        old_items (list): Media index items as they were before deletion.
+    """
+    table = species_table()
+    if table is not None:
+        with table.batch_writer() as batch:
+            for item in old_items:
+                update_postings(item['file_id'], None, {}, stale=item.get('tags', {}),
+                                batch=batch)
+    update_stats((item, None) for item in old_items)
+    bump_version()
+
+
+# Function: Build the filter of posting reads
+def _posting_filter(min_count, file_type):
+    from boto3.dynamodb.conditions import Attr
+
+    condition = Attr('count').gte(min_count) if min_count > 0 else None
+    if file_type:
+        type_condition = Attr('file_type').eq(file_type)
+        condition = type_condition if condition is None else condition & type_condition
+    return condition
+
+
+# Posting list of one species, read page by page in file_id order
+class PostingList:
+    """
+    Postings of one species, read lazily with key-condition Queries.
+
+    Postings are sorted by file_id, so once a page has been read every
+    file_id up to `bound` is known to be either in `postings` or not in
+    the list at all.
+    """
+
+    def __init__(self, species, min_count=0, file_type=None, after=None):
+        """
+        Args:
+            species (str): Species name, normalized before the lookup.
+            min_count (int): Only keep postings with at least this count.
+            file_type (str): Only keep postings of this file type.
+            after (str): Only read file_ids sorting after this one.
+        """
+        from boto3.dynamodb.conditions import Key
+
+        self.species = normalize_species(species)
+        self.postings = {}
+        self.bound = after
+        self.done = False
+        self._kwargs = {
+            'KeyConditionExpression': Key('species').eq(self.species),
+            'ProjectionExpression': 'file_id, file_type, #count',
+            'ExpressionAttributeNames': {'#count': 'count'},
+            'Limit': POSTING_PAGE_SIZE,
+        }
+        condition = _posting_filter(min_count, file_type)
+        if condition is not None:
+            self._kwargs['FilterExpression'] = condition
+        if after is not None:
+            self._kwargs['ExclusiveStartKey'] = {'species': self.species, 'file_id': after}
+
+    def fetch(self):
+        """
+        Read the next page.
+
+        Returns:
+            list: Postings of the page that passed the filter.
+        """
+        response = species_table().query(**self._kwargs)
+        items = response.get('Items', [])
+        for item in items:
+            self.postings[item['file_id']] = item
+        last_key = response.get('LastEvaluatedKey')
+        if last_key is None:
+            self.done = True
+        else:
+            self._kwargs['ExclusiveStartKey'] = last_key
+            self.bound = last_key['file_id']
+        return items
+
+    def covers(self, file_id):
+        """
+        Returns:
+            bool: True if the pages read so far settle whether `file_id`
+            is in the list.
+        """
+        return self.done or (self.bound is not None and file_id <= self.bound)
+
+    def __iter__(self):
+        """
+        Yield postings in file_id order, reading pages as needed.
+        """
+        yield from list(self.postings.values())
+        while not self.done:
+            yield from self.fetch()
+
+
+# Function: Read postings by key
+def get_postings(keys):
+    """
+    Look up (species, file_id) postings with BatchGetItem, retrying keys
+    DynamoDB leaves unprocessed with jittered backoff.
+
+    Args:
+        keys (iterable): (species, file_id) pairs, species already normalized.
+
+    Returns:
+        dict: (species, file_id) -> posting, for the postings that exist.
+
+    Raises:
+        RuntimeError: If keys are still unprocessed after MAX_ATTEMPTS, as a
+        partial answer would silently change query results.
+    """
+    keys = [{'species': species, 'file_id': file_id} for species, file_id in keys]
+    found = {}
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request = {SPECIES_INDEX_TABLE: {
+            'Keys': keys[start:start + BATCH_GET_SIZE],
+            'ProjectionExpression': 'species, file_id, file_type, #count',
+            'ExpressionAttributeNames': {'#count': 'count'},
+        }}
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                # Back off before retrying throttled keys
+                time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 1.0)))
+            response = _resource().batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(SPECIES_INDEX_TABLE, []):
+                found[(item['species'], item['file_id'])] = item
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+        else:
+            unprocessed = len(request[SPECIES_INDEX_TABLE]['Keys'])
+            raise RuntimeError(f"{unprocessed} postings still unprocessed after "
+                               f"{MAX_ATTEMPTS} attempts")
+    return found
+
+
+# Function: List the files tagged with a species
+def query_species(species):
+    """
+    Read every posting of a species with a key-condition Query, paging
+    through the results.
+
+    Args:
+        species (str): Species name, normalized before the lookup.
+
+    Returns:
+        list: Posting items ('file_id', 'file_type', 'count').
+    """
+    return list(PostingList(species))
@@ -0,0 +1,131 @@
+# Import-time budget check for the Lambda handler modules.
+#
+# Cold starts pay for every module a handler imports at load time. This
+# script imports each handler in a fresh interpreter with `python -X
+# importtime`, takes the best of a few runs and fails when a handler exceeds
+# its budget in import_budget.json by more than the tolerance (a fraction
+# of the budget plus a few milliseconds of timer jitter):
+#
+#     python check_import_time.py
+#     python check_import_time.py --update        # re-baseline the budgets
+#
+# Run it in the handler's container image (or an environment with the same
+# requirements installed); handlers whose dependencies are missing are
+# reported as skipped.
+
+# Import libraries
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+# Handler folders, relative to this script
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_budget.json")
+
+# (folder, module) of every handler deployed as a Lambda function
+HANDLERS = [
+    ("image_upload_handler", "birds_detection"),
+    ("query_image_upload_handler", "query_birds_detection"),
+    ("audio_upload_handler", "birds_audio_detection"),
+    ("query_audio_upload_handler", "query_birds_audio_detection"),
+    ("other_query", "getFullImageByThumb"),
+    ("other_query", "lambda_delete_by_tags"),
+    ("other_query", "lambda_delete_files"),
+    ("other_query", "lambda_query_species"),
+    ("other_query", "lambda_query_tags"),
+    ("other_query", "lambda_species_autocomplete"),
+    ("other_query", "lambda_species_stats"),
+    ("other_query", "query_full_data_list"),
+]
+
+# One line of `-X importtime` output: self us | cumulative us | module
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+# Function: Measure the import time of one handler module
+def import_time_ms(folder, module):
+    """
+    Import a module in a fresh interpreter and read its cumulative import
+    time from `-X importtime`.
+
+    Args:
+        folder (str): Handler folder, used as the working directory.
+        module (str): Module name.
+
+    Returns:
+        float: Cumulative import time in milliseconds, or None if the import
+        failed (e.g. missing dependencies).
+    """
+    env = dict(os.environ)
+    # boto3 clients need a region when they are created at import time
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.join(BACKEND_DIR, folder), env=env,
+        capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # The top-level module has no indentation before its name
+        if match and match.group(4) == module and match.group(3) == " ":
+            return int(match.group(2)) / 1000
+    return None
+
+
+# Function: Measure every handler
+def measure_all(runs):
+    """
+    Returns:
+        dict: "folder/module" -> best import time in ms (None if skipped).
+    """
+    timings = {}
+    for folder, module in HANDLERS:
+        samples = [import_time_ms(folder, module) for _ in range(runs)]
+        samples = [ms for ms in samples if ms is not None]
+        timings[f"{folder}/{module}"] = min(samples) if samples else None
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check handler import times against a budget.")
+    parser.add_argument("--runs", type=int, default=3, help="Imports per handler, best is kept")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed fraction over budget before failing")
+    parser.add_argument("--slack-ms", type=float, default=10.0,
+                        help="Allowed milliseconds over budget on top of the tolerance")
+    parser.add_argument("--update", action="store_true",
+                        help="Write the measured times as the new budgets")
+    args = parser.parse_args()
+
+    timings = measure_all(args.runs)
+
+    if args.update:
+        budgets = {name: round(ms, 1) for name, ms in timings.items() if ms is not None}
+        with open(BUDGET_PATH, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {len(budgets)} budgets to {BUDGET_PATH}")
+        sys.exit(0)
+
+    with open(BUDGET_PATH) as f:
+        budgets = json.load(f)
+
+    failures = 0
+    for name, ms in timings.items():
+        budget = budgets.get(name)
+        if ms is None:
+            print(f"{name:60s} skipped (import failed)")
+        elif budget is None:
+            print(f"{name:60s} {ms:8.1f} ms  (no budget)")
+        else:
+            over = ms > budget * (1 + args.tolerance) + args.slack_ms
+            failures += over
+            print(f"{name:60s} {ms:8.1f} ms  budget {budget:8.1f} ms"
+                  f"{'  OVER BUDGET' if over else ''}")
+
+    sys.exit(1 if failures else 0)
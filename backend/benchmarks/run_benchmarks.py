@@ -0,0 +1,427 @@
+# Offline micro-benchmarks for the BirdTag prediction hot paths.
+#
+# Runs image_prediction, create_thumbnail, video_prediction, the image ingest
+# handler and audio_prediction against a fixture corpus, with S3 and DynamoDB
+# replaced by in-memory stubs, and writes a JSON report that can be compared
+# across commits:
+#
+#     python run_benchmarks.py --output before.json
+#     python run_benchmarks.py --output after.json --compare before.json
+#
+# The corpus is either a folder with images/, videos/ and audio/ subfolders
+# (--corpus) or synthetic fixtures generated on first use (--fixtures).
+# Models are read from the handler folders (model.pt, BirdNET tflite/labels);
+# suites whose model or libraries are missing are reported as skipped.
+# Peak RSS is the process high-water mark after each case.
+
+# Import libraries
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Handler folders, relative to this script
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_HANDLER_DIR = os.path.join(BACKEND_DIR, "image_upload_handler")
+AUDIO_HANDLER_DIR = os.path.join(BACKEND_DIR, "audio_upload_handler")
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# File extensions of each media kind
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".flac")
+
+# Synthetic fixtures: image sizes, (size, seconds, fourcc, ext) videos and
+# (seconds, sample rate, format) audio clips
+SYNTHETIC_IMAGES = [(640, 480), (1920, 1080), (4000, 3000), (6000, 4000)]
+SYNTHETIC_VIDEOS = [((640, 360), 5, "mp4v", ".mp4"), ((1280, 720), 5, "MJPG", ".avi")]
+SYNTHETIC_AUDIO = [(15, 48000, "WAV"), (60, 44100, "FLAC"), (60, 22050, "WAV")]
+VIDEO_FPS = 30
+
+
+# In-memory stand-in for the S3 client
+class FakeS3:
+    """Serves objects from a dict and records uploads."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+
+    def get_object(self, Bucket, Key):
+        data = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.objects[(Bucket, Key)] = self.objects[(CopySource["Bucket"], CopySource["Key"])]
+        return {}
+
+
+# In-memory stand-in for a DynamoDB table
+class FakeTable:
+    """Stores items by their first key attribute."""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item, **kwargs):
+        self.items[next(iter(Item.values()))] = Item
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(next(iter(Key.values())))
+        return {"Item": item} if item is not None else {}
+
+
+# Function: Import a handler module from its folder
+def load_handler(folder, filename, name):
+    """
+    Import a handler script with its folder on sys.path and as the working
+    directory, so relative model paths resolve as they do in Lambda.
+
+    Returns:
+        module: The imported module.
+    """
+    # boto3 clients need a region when they are created
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    # Keep the detection cache in-process only
+    os.environ.setdefault("DETECTION_CACHE_TABLE", "")
+    # Leave the species index, its statistics and version counter untouched
+    os.environ.setdefault("SPECIES_INDEX_TABLE", "")
+    os.environ.setdefault("SPECIES_STATS_TABLE", "")
+    os.environ.setdefault("INDEX_VERSION_TABLE", "")
+    sys.path.insert(0, folder)
+    os.chdir(folder)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(folder, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Function: Replace AWS resources of a handler with stubs
+def stub_aws(module):
+    """
+    Point a handler module at in-memory S3/DynamoDB stubs, disable its
+    detection cache so every call does real work, and collect its metric
+    lines in memory instead of printing them.
+
+    Returns:
+        tuple: (FakeS3, FakeTable, ListSink).
+    """
+    fake_s3, fake_table = FakeS3(), FakeTable()
+    module.s3 = fake_s3
+    module.table = fake_table
+    if hasattr(module, "detection_cache"):
+        module.detection_cache = module.DetectionCache(table_name="", max_entries=0)
+    metrics = sys.modules["metrics"]
+    sink = metrics.ListSink()
+    metrics.set_sink(sink)
+    return fake_s3, fake_table, sink
+
+
+# Function: Average the stage timings of emitted metric records
+def stage_breakdown(sink):
+    """
+    Returns:
+        dict: Stage name -> mean milliseconds per record, over every record
+        the sink has collected.
+    """
+    records = sink.records()
+    stages = {}
+    for record in records:
+        for name, value in record.items():
+            if name.endswith("_ms"):
+                stages[name[:-3]] = stages.get(name[:-3], 0.0) + value
+    return {stage: round(total / len(records), 3) for stage, total in sorted(stages.items())}
+
+
+# Function: Drop per-container caches so the next call is cold
+def reset_caches(module):
+    """
+    Clear the model caches a handler keeps between invocations.
+    """
+    registry = getattr(module, "_model_registry", None)
+    if registry is not None:
+        registry.clear()
+    if hasattr(module, "_analyzer"):
+        module._analyzer = None
+
+
+# Function: Generate synthetic fixtures
+def generate_fixtures(folder):
+    """
+    Write synthetic images, videos and audio clips to `folder` (skipping
+    files that already exist).
+
+    Returns:
+        str: The fixture folder.
+    """
+    import cv2 as cv
+
+    rng = np.random.default_rng(0)
+    for sub in ("images", "videos", "audio"):
+        os.makedirs(os.path.join(folder, sub), exist_ok=True)
+
+    # Images: smooth noise with shapes, as JPEG and PNG
+    for width, height in SYNTHETIC_IMAGES:
+        for ext in (".jpg", ".png"):
+            path = os.path.join(folder, "images", f"synthetic_{width}x{height}{ext}")
+            if os.path.exists(path):
+                continue
+            image = cv.resize(rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8),
+                              (width, height), interpolation=cv.INTER_CUBIC)
+            cv.circle(image, (width // 2, height // 2), min(width, height) // 6, (40, 40, 40), -1)
+            cv.imwrite(path, image)
+
+    # Videos: a moving dark blob over a static background
+    for (width, height), seconds, fourcc, ext in SYNTHETIC_VIDEOS:
+        path = os.path.join(folder, "videos", f"synthetic_{width}x{height}_{seconds}s{ext}")
+        if os.path.exists(path):
+            continue
+        writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*fourcc), VIDEO_FPS, (width, height))
+        background = cv.resize(rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8),
+                               (width, height), interpolation=cv.INTER_CUBIC)
+        for i in range(seconds * VIDEO_FPS):
+            frame = background.copy()
+            x = int((i / (seconds * VIDEO_FPS)) * width)
+            cv.circle(frame, (x, height // 2), height // 8, (30, 30, 30), -1)
+            writer.write(frame)
+        writer.release()
+
+    # Audio: noise with periodic chirps in the bird band
+    try:
+        import soundfile as sf
+    except ImportError:
+        print("soundfile not installed, skipping synthetic audio")
+        return folder
+    for seconds, rate, fmt in SYNTHETIC_AUDIO:
+        path = os.path.join(folder, "audio", f"synthetic_{seconds}s_{rate}.{fmt.lower()}")
+        if os.path.exists(path):
+            continue
+        t = np.arange(seconds * rate) / rate
+        chirp = np.sin(2 * np.pi * (3000 + 2000 * (t % 1.0)) * t) * (t % 4.0 < 0.5)
+        signal = 0.3 * chirp + 0.02 * rng.standard_normal(len(t))
+        sf.write(path, signal.astype(np.float32), rate, format=fmt)
+
+    return folder
+
+
+# Function: List corpus files of one kind
+def corpus_files(folder, sub, extensions):
+    """
+    Returns:
+        list: Sorted paths under folder/sub with the given extensions.
+    """
+    path = os.path.join(folder, sub)
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.lower().endswith(extensions))
+
+
+# Function: Peak resident set size of this process
+def peak_rss_mb():
+    """
+    Returns:
+        float: Peak RSS in MB so far (Linux reports ru_maxrss in KB).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Function: Time a callable cold and warm
+def measure(func, repeats, reset=None):
+    """
+    Run `func` once cold (after `reset`) and `repeats` times warm.
+
+    Returns:
+        tuple: (summary dict, value returned by the last call).
+    """
+    if reset is not None:
+        reset()
+    start = time.perf_counter()
+    value = func()
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = func()
+        warm.append(time.perf_counter() - start)
+
+    summary = {"cold_s": cold, "repeats": repeats}
+    if warm:
+        summary.update({
+            "mean_s": float(np.mean(warm)),
+            "p50_s": float(np.percentile(warm, 50)),
+            "p95_s": float(np.percentile(warm, 95)),
+            "p99_s": float(np.percentile(warm, 99)),
+        })
+    summary["peak_rss_mb"] = peak_rss_mb()
+    return summary, value
+
+
+# Function: Benchmark the image and video paths
+def bench_images_and_videos(corpus, repeats, video_repeats):
+    """
+    Returns:
+        list: Result dicts for image_prediction, create_thumbnail,
+            the image handler and video_prediction.
+    """
+    module = load_handler(IMAGE_HANDLER_DIR, "birds_detection.py", "bench_birds_detection")
+    fake_s3, _, sink = stub_aws(module)
+    results = []
+
+    images = corpus_files(corpus, "images", IMAGE_EXTENSIONS)
+    for path in images:
+        name = os.path.basename(path)
+        summary, _ = measure(lambda: module.image_prediction(path), repeats,
+                             reset=lambda: reset_caches(module))
+        results.append({"name": f"image_prediction/{name}", **summary,
+                        "bytes": os.path.getsize(path)})
+
+        image = module.decode_image(path)
+        summary, _ = measure(lambda: module.create_thumbnail(image, ext=".jpg"), repeats)
+        results.append({"name": f"create_thumbnail/{name}", **summary})
+
+    # End-to-end handler over one event holding every image
+    if images:
+        records = []
+        for path in images:
+            key = f"Images/{os.path.basename(path)}"
+            with open(path, "rb") as f:
+                fake_s3.objects[("bench-bucket", key)] = f.read()
+            records.append({"s3": {"bucket": {"name": "bench-bucket"},
+                                   "object": {"key": key}}})
+        sink.lines.clear()
+        summary, _ = measure(lambda: module.handler({"Records": records}, None), repeats)
+        summary["images_per_s"] = len(records) / summary.get("p50_s", summary["cold_s"])
+        summary["stages_ms"] = stage_breakdown(sink)
+        results.append({"name": f"handler/images_x{len(records)}", **summary})
+
+    for path in corpus_files(corpus, "videos", VIDEO_EXTENSIONS):
+        stats = {}
+        summary, _ = measure(lambda: module.video_prediction(path, stats=stats), video_repeats)
+        seconds = summary.get("p50_s", summary["cold_s"])
+        summary.update({
+            "frames_total": stats.get("frames_total"),
+            "frames_inferred": stats.get("frames_inferred"),
+            "fps": stats.get("frames_total", 0) / seconds,
+        })
+        results.append({"name": f"video_prediction/{os.path.basename(path)}", **summary})
+
+    results.append({"name": "model_load", "models": module.model_load_stats()})
+    return results
+
+
+# Function: Benchmark the audio path
+def bench_audio(corpus, repeats):
+    """
+    Returns:
+        list: Result dicts for audio_prediction.
+    """
+    import soundfile as sf
+
+    module = load_handler(AUDIO_HANDLER_DIR, "birds_audio_detection.py", "bench_birds_audio_detection")
+    stub_aws(module)
+    results = []
+
+    for path in corpus_files(corpus, "audio", AUDIO_EXTENSIONS):
+        duration = sf.info(path).duration
+        summary, _ = measure(lambda: module.audio_prediction(path), repeats,
+                             reset=lambda: reset_caches(module))
+        summary["audio_seconds"] = duration
+        summary["realtime_factor"] = duration / summary.get("p50_s", summary["cold_s"])
+        results.append({"name": f"audio_prediction/{os.path.basename(path)}", **summary})
+    return results
+
+
+# Function: Describe the environment of a run
+def run_metadata():
+    """
+    Returns:
+        dict: Commit, interpreter and machine details.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# Function: Print p50 changes against an earlier report
+def compare(report, baseline_path):
+    """
+    Print the relative change of each case's p50 (or cold) latency.
+    """
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\n{'case':60} {'before':>10} {'after':>10} {'change':>8}")
+    for result in report["results"]:
+        before = baseline.get(result["name"])
+        if before is None or "cold_s" not in result:
+            continue
+        key = "p50_s" if "p50_s" in result and "p50_s" in before else "cold_s"
+        change = (result[key] - before[key]) / before[key] * 100
+        print(f"{result['name'][:60]:60} {before[key]:10.4f} {result[key]:10.4f} {change:+7.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark BirdTag prediction paths offline.")
+    parser.add_argument("--corpus", default=None,
+                        help="Folder with images/, videos/ and audio/ (default: synthetic)")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURE_DIR,
+                        help="Where synthetic fixtures are generated")
+    parser.add_argument("--repeats", type=int, default=10, help="Warm runs per image/audio case")
+    parser.add_argument("--video-repeats", type=int, default=2, help="Warm runs per video case")
+    parser.add_argument("--suites", nargs="+", default=["image", "audio"],
+                        choices=["image", "audio"])
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", default=None, help="Earlier JSON report to compare with")
+    args = parser.parse_args()
+
+    corpus = os.path.abspath(args.corpus or generate_fixtures(os.path.abspath(args.fixtures)))
+    # Handlers are imported from their own folders, so resolve paths first
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    report = {"meta": run_metadata(), "results": [], "skipped": {}}
+
+    suites = {
+        "image": lambda: bench_images_and_videos(corpus, args.repeats, args.video_repeats),
+        "audio": lambda: bench_audio(corpus, args.repeats),
+    }
+    for suite in args.suites:
+        try:
+            report["results"] += suites[suite]()
+        except (ImportError, FileNotFoundError, OSError) as e:
+            print(f"Skipping {suite} suite: {e}")
+            report["skipped"][suite] = str(e)
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Wrote {output}")
+
+    for result in report["results"]:
+        if "cold_s" in result:
+            print(f"{result['name'][:60]:60} cold {result['cold_s']:.4f}s "
+                  f"p50 {result.get('p50_s', float('nan')):.4f}s "
+                  f"rss {result['peak_rss_mb']:.0f}MB")
+    if baseline:
+        compare(report, baseline)
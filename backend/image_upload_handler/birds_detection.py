@@ -1,44 +1,324 @@
 # Import libraries
+import json
 import logging
 import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
 from collections import Counter
+from contextlib import contextmanager
 from urllib.parse import unquote_plus
 
-import boto3
-import cv2 as cv
-import supervision as sv
 from botocore.exceptions import ClientError
-from ultralytics import YOLO
 
-# Initialize S3 and DynamoDB clients
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('BirdTagMediaIndex')
+from detection_cache import DetectionCache, content_hash, file_hash, record_hash
+from media_index import write_media
+from metrics import Metrics
+
+# S3 client and DynamoDB table, created on first use
+s3 = None
+table = None
+# Detection results keyed by content hash and model version
+detection_cache = DetectionCache()
+
+# Heavy libraries, imported on first use by _import_libraries()
+cv = None
+np = None
+sv = None
 
 # Set up the logger to log at the INFO level
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Inference backend: 'torch' (ultralytics) or 'onnx' (onnxruntime)
+DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "torch")
+# Default model path and optional version label
+MODEL_PATH = os.environ.get(
+    "MODEL_PATH", "./model.onnx" if DETECTOR_BACKEND == "onnx" else "./model.pt")
+MODEL_VERSION = os.environ.get("MODEL_VERSION", "")
+# Intra-op threads for onnxruntime (0 lets onnxruntime decide)
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", "0"))
+# Input size used for the warm-up inference
+WARMUP_IMAGE_SIZE = 640
+# Images are decoded at reduced scale down to this longest side (model input)
+DECODE_MIN_SIDE = 640
+# Bytes read to find the JPEG frame header (EXIF blocks may precede it)
+JPEG_HEADER_BYTES = 256 * 1024
+# Number of images sent to YOLO in one forward pass by the handler
+IMAGE_BATCH_SIZE = int(os.environ.get("IMAGE_BATCH_SIZE", "8"))
+# S3 objects larger than this are streamed to a temporary file, not memory
+SPILL_THRESHOLD_BYTES = int(os.environ.get("SPILL_THRESHOLD_BYTES", str(64 * 1024 * 1024)))
+# Chunk size used when streaming an object to a temporary file
+SPILL_CHUNK_BYTES = 1024 * 1024
+
+# Video frame sampling mode: 'all', 'stride' or 'adaptive'
+VIDEO_SAMPLE_MODE = os.environ.get("VIDEO_SAMPLE_MODE", "all")
+# Infer every Nth frame in 'stride' and 'adaptive' modes
+VIDEO_FRAME_STRIDE = int(os.environ.get("VIDEO_FRAME_STRIDE", "1"))
+# Mean grey-level difference (0-255) that counts as a scene change
+VIDEO_SCENE_THRESHOLD = float(os.environ.get("VIDEO_SCENE_THRESHOLD", "6.0"))
+# Side length of the greyscale signature used for scene-change scoring
+SCENE_SIGNATURE_SIZE = 64
+# Decoded frames buffered between the decoder thread and inference
+VIDEO_QUEUE_DEPTH = int(os.environ.get("VIDEO_QUEUE_DEPTH", "8"))
+# Frames per YOLO forward pass for video
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", "4"))
+# Longest side frames are downscaled to before queueing (0 keeps full size)
+VIDEO_RESIZE_MAX_SIDE = int(os.environ.get("VIDEO_RESIZE_MAX_SIDE", "0"))
+
+# Loaded models keyed by (path, version), reused across warm invocations
+_model_registry = {}
+
+
+# Function: Import the image processing libraries on first use
+def _import_libraries():
+    """
+    Import OpenCV, NumPy and supervision into the module globals.
+
+    Deferred so that loading the handler stays cheap and requests served
+    from the detection cache never pay for these imports.
+    """
+    global cv, np, sv
+    if sv is None:
+        import cv2 as cv
+        import numpy as np
+        import supervision as sv
+
+
+# Function: Resolve the version label of a model file
+def _model_version(model_path):
+    """
+    Get the version label used to key a model in the registry.
+
+    Args:
+        model_path (str): Path to the model file.
+
+    Returns:
+        str: MODEL_VERSION if set, otherwise a hash of the file's content,
+        so the ingest and query images share cache entries for one model.
+    """
+    if MODEL_VERSION:
+        return MODEL_VERSION
+    return file_hash(model_path)[:16]
+
+
+# Function: Get a loaded and warmed-up detector
+def get_model(model_path=MODEL_PATH):
+    """
+    Return the detector for a path, loading it on first use.
+
+    `.onnx` files run through onnxruntime (OnnxDetector), anything else
+    through ultralytics YOLO. The first call for a given path/version loads
+    the weights and runs a warm-up inference on a blank image so that layer
+    fusion and memory allocation happen outside the first real prediction.
+
+    Args:
+        model_path (str): Path to the model file.
+
+    Returns:
+        YOLO or OnnxDetector: The loaded model.
+    """
+    _import_libraries()
+    key = (os.path.abspath(model_path), _model_version(model_path))
+    entry = _model_registry.get(key)
+    if entry is not None:
+        return entry["model"]
+
+    # Load model weights
+    start = time.perf_counter()
+    if model_path.endswith(".onnx"):
+        from onnx_detector import OnnxDetector
+        model = OnnxDetector(model_path, threads=ONNX_THREADS)
+    else:
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+    load_time = time.perf_counter() - start
+
+    # Warm up on a blank frame
+    start = time.perf_counter()
+    blank = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+    _detect(model, [blank])
+    warmup_time = time.perf_counter() - start
+
+    _model_registry[key] = {
+        "model": model,
+        "path": key[0],
+        "version": key[1],
+        "load_time": load_time,
+        "warmup_time": warmup_time,
+    }
+    logger.info(f"Loaded model {key[0]} (version {key[1]}) "
+                f"in {load_time:.3f}s, warm-up {warmup_time:.3f}s")
+    return model
+
+
+# Function: Report load statistics of the models in the registry
+def model_load_stats():
+    """
+    Get load and warm-up timings of every model loaded in this container.
+
+    Returns:
+        list: One dict per model with path, version, load_time and warmup_time.
+    """
+    return [
+        {k: v for k, v in entry.items() if k != "model"}
+        for entry in _model_registry.values()
+    ]
+
+
+# Function: Run a detector on a list of images
+def _detect(model, images):
+    """
+    Run either backend on decoded images.
+
+    Args:
+        model (YOLO or OnnxDetector): Model returned by get_model.
+        images (list): Decoded BGR images.
+
+    Returns:
+        list: One sv.Detections per image.
+    """
+    if hasattr(model, "detect"):
+        return model.detect(images)
+    return [sv.Detections.from_ultralytics(r) for r in model(images, verbose=False)]
+
+
+# Function: Read the pixel size of a JPEG from its header
+def _jpeg_size(header):
+    """
+    Parse the frame header of a JPEG without decoding it.
+
+    Args:
+        header (bytes): Leading bytes of the file.
+
+    Returns:
+        tuple: (width, height), or None if not a JPEG or not found.
+    """
+    if header[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(header):
+        if header[i] != 0xFF:
+            return None
+        marker = header[i + 1]
+        # Fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        # Start-of-frame markers (excluding DHT, JPG and DAC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(header[i + 5:i + 7], "big")
+            width = int.from_bytes(header[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(header[i + 2:i + 4], "big")
+    return None
+
+
+# Function: Pick the OpenCV decode flag for an image
+def _decode_flag(header, min_side=DECODE_MIN_SIDE):
+    """
+    Choose the largest JPEG reduction whose longest side still covers
+    `min_side`; other formats decode at full size.
+
+    Args:
+        header (bytes): Leading bytes of the file.
+        min_side (int): Smallest acceptable longest side after decoding.
+
+    Returns:
+        int: cv.IMREAD_* flag.
+    """
+    size = _jpeg_size(header)
+    if size is not None:
+        longest = max(size)
+        for factor, flag in ((8, cv.IMREAD_REDUCED_COLOR_8),
+                             (4, cv.IMREAD_REDUCED_COLOR_4),
+                             (2, cv.IMREAD_REDUCED_COLOR_2)):
+            if longest // factor >= min_side:
+                return flag
+    return cv.IMREAD_COLOR
+
+
+# Function: Decode an image once for every consumer
+def decode_image(source, min_side=DECODE_MIN_SIDE):
+    """
+    Decode an image at the smallest scale that still covers the model input.
+
+    Large JPEGs use OpenCV's reduced-scale decoding, so a 20 MP photo is
+    never held at full resolution. EXIF orientation is applied by OpenCV.
+
+    Args:
+        source (str or bytes): Path to the image file, or its encoded bytes.
+        min_side (int): Smallest acceptable longest side after decoding.
+
+    Returns:
+        ndarray: Decoded BGR image, or None if decoding failed.
+    """
+    _import_libraries()
+    # Decode straight from memory
+    if isinstance(source, (bytes, bytearray)):
+        flag = _decode_flag(source[:JPEG_HEADER_BYTES], min_side)
+        return cv.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+
+    with open(source, "rb") as f:
+        header = f.read(JPEG_HEADER_BYTES)
+    return cv.imread(source, _decode_flag(header, min_side))
+
+
+# Function: Convert detections of one image into bird names
+def _detection_labels(detections, class_dict, confidence):
+    """
+    Map the confident detections of one image to bird class names.
+
+    Args:
+        detections (sv.Detections): Detections of a single image.
+        class_dict (dict): Class ID to bird name mapping.
+        confidence (float): Minimum confidence threshold for detection.
+
+    Returns:
+        list: List of detected bird class names.
+    """
+    # If any detections exist
+    if detections.class_id is not None:
+        # Filter by confidence
+        detections = detections[(detections.confidence > confidence)]
+        # Map IDs to names
+        return [f"{class_dict[cls_id]}" for cls_id in detections.class_id]
+    # Return empty if no detections
+    return []
+
 
 # Function: Predict bird species in an image
-def image_prediction(image_path, confidence=0.5, model="./model.pt"):
+def image_prediction(image_path, confidence=0.5, model=MODEL_PATH, stats=None):
     """
     Run bird detection on an image using a YOLO model.
 
     Args:
-        image_path (str): Path to the image file.
+        image_path (str or ndarray): Path to the image file, or an image
+            already decoded with decode_image.
         confidence (float): Minimum confidence threshold for detection.
         model (str): Path to the model file.
+        stats (dict): Optional dict filled with model load and inference times.
 
     Returns:
         list: List of detected bird class names.
     """
-    # Load the YOLO model
-    model = YOLO(model)
+    _import_libraries()
+    # Get the cached detector
+    start = time.perf_counter()
+    model = get_model(model)
+    model_load_time = time.perf_counter() - start
     # Dictionary of class ID to bird names
     class_dict = model.names
-    # Load the image from local path
-    img = cv.imread(image_path)
+    # Decode the image unless the caller already did
+    if isinstance(image_path, np.ndarray):
+        img = image_path
+    else:
+        img = decode_image(image_path)
 
     # If image loading failed
     if img is None:
@@ -46,44 +326,279 @@ def image_prediction(image_path, confidence=0.5, model="./model.pt"):
         return []
 
     # Run prediction, get first output
-    result = model(img)[0]
-    # Convert to supervision format
-    detections = sv.Detections.from_ultralytics(result)
+    start = time.perf_counter()
+    detections = _detect(model, [img])[0]
+    inference_time = time.perf_counter() - start
+    logger.info(f"Image inference took {inference_time:.3f}s")
+    if stats is not None:
+        stats.update({"model_load_time": model_load_time,
+                      "inference_time": inference_time})
+    # Return list of bird names
+    return _detection_labels(detections, class_dict, confidence)
+
+
+# Function: Predict bird species in several images at once
+def image_prediction_batch(images, confidence=0.5, model=MODEL_PATH,
+                           batch_size=IMAGE_BATCH_SIZE, stats=None):
+    """
+    Run bird detection on decoded images, batching them into forward passes.
+
+    Args:
+        images (list): Decoded BGR images.
+        confidence (float): Minimum confidence threshold for detection.
+        model (str): Path to the model file.
+        batch_size (int): Maximum number of images per forward pass.
+        stats (dict): Optional dict filled with model load and total
+            inference times.
+
+    Returns:
+        list: One list of detected bird class names per input image.
+    """
+    _import_libraries()
+    # Get the cached detector
+    start = time.perf_counter()
+    model = get_model(model)
+    model_load_time = time.perf_counter() - start
+    # Dictionary of class ID to bird names
+    class_dict = model.names
+
+    labels = []
+    inference_time = 0.0
+    for i in range(0, len(images), batch_size):
+        batch = images[i:i + batch_size]
+        # Run one forward pass over the mini-batch
+        start = time.perf_counter()
+        batch_detections = _detect(model, batch)
+        elapsed = time.perf_counter() - start
+        inference_time += elapsed
+        logger.info(f"Batch inference of {len(batch)} images took {elapsed:.3f}s")
+        labels += [_detection_labels(d, class_dict, confidence)
+                   for d in batch_detections]
+    if stats is not None:
+        stats.update({"model_load_time": model_load_time,
+                      "inference_time": inference_time})
+    return labels
+
+
+# Function: Reduce a frame to a small greyscale signature
+def _scene_signature(frame):
+    """
+    Downscale a frame to a small greyscale image for scene-change scoring.
+
+    Args:
+        frame (ndarray): Decoded BGR frame.
+
+    Returns:
+        ndarray: SCENE_SIGNATURE_SIZE x SCENE_SIGNATURE_SIZE greyscale image.
+    """
+    small = cv.resize(frame, (SCENE_SIGNATURE_SIZE, SCENE_SIGNATURE_SIZE),
+                      interpolation=cv.INTER_AREA)
+    return cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+
+
+# Streaming per-track summary of tracked detections
+class TrackAggregator:
+    """
+    Aggregate tracked detections per ByteTrack tracker_id.
+
+    Each track keeps a vote counter over class IDs and its peak confidence,
+    so memory is bounded by the number of tracks rather than video length.
+    """
+
+    def __init__(self, class_dict):
+        """
+        Args:
+            class_dict (dict): Class ID to bird name mapping.
+        """
+        self.class_dict = class_dict
+        # tracker_id -> {"votes": Counter of class IDs, "peak_confidence": float}
+        self._tracks = {}
+
+    def update(self, detections):
+        """
+        Add the tracked detections of one frame.
+
+        Args:
+            detections (sv.Detections): Detections with tracker IDs.
+        """
+        for tracker_id, class_id, score in zip(detections.tracker_id,
+                                               detections.class_id,
+                                               detections.confidence):
+            track = self._tracks.setdefault(
+                int(tracker_id), {"votes": Counter(), "peak_confidence": 0.0})
+            track["votes"][int(class_id)] += 1
+            track["peak_confidence"] = max(track["peak_confidence"], float(score))
+
+    def tracks(self):
+        """
+        Summarise every track.
+
+        Returns:
+            dict: tracker_id -> species (majority class), peak_confidence
+                and number of frames it was detected in.
+        """
+        return {
+            tracker_id: {
+                "species": self.class_dict[track["votes"].most_common(1)[0][0]],
+                "peak_confidence": track["peak_confidence"],
+                "frames": sum(track["votes"].values()),
+            }
+            for tracker_id, track in self._tracks.items()
+        }
+
+    def labels(self):
+        """
+        Get one species name per distinct tracked bird.
+
+        Returns:
+            list: Majority species of each track.
+        """
+        return [track["species"] for track in self.tracks().values()]
 
-    # If any detections exist
-    if detections.class_id is not None:
-        # Filter by confidence
-        detections = detections[(detections.confidence > confidence)]
-        # Map IDs to names
-        labels = [f"{class_dict[cls_id]}" for cls_id in detections.class_id]
-        # Return list of bird names
-        return labels
-    # Return empty if no detections
-    return []
+
+# Function: Put an item on a bounded queue unless the pipeline is stopping
+def _put_frame(frame_queue, item, stop_event):
+    """
+    Block until the item is queued or the pipeline is stopped.
+
+    Returns:
+        bool: True if the item was queued.
+    """
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+# Function: Decoder thread of the video pipeline
+def _decode_frames(cap, frame_queue, stop_event, counters, stride,
+                   sample_mode, scene_threshold, resize_max_side):
+    """
+    Decode and sample frames from a video and push them onto a bounded queue.
+
+    Frames between samples are skipped with `cap.grab()`. In adaptive mode
+    a sampled frame is dropped unless it differs enough from the last
+    queued frame. A None sentinel marks the end of the stream.
+
+    Args:
+        cap (VideoCapture): Opened video capture.
+        frame_queue (Queue): Bounded queue feeding the inference stage.
+        stop_event (Event): Set by the consumer to abort decoding.
+        counters (dict): Frame counters and decode time, updated in place.
+        stride (int): Frame step between samples.
+        sample_mode (str): 'all', 'stride' or 'adaptive'.
+        scene_threshold (float): Scene-change score (0-255) for 'adaptive'.
+        resize_max_side (int): Downscale frames to this longest side, 0 to keep.
+    """
+    # Signature of the last queued frame (adaptive mode)
+    last_signature = None
+    try:
+        while not stop_event.is_set():
+            # Skip frames between samples without decoding them
+            start = time.perf_counter()
+            if counters["frames_total"] % stride:
+                grabbed = cap.grab()
+                counters["decode_time"] += time.perf_counter() - start
+                if not grabbed:
+                    break
+                counters["frames_total"] += 1
+                continue
+
+            ret, frame = cap.read()
+            counters["decode_time"] += time.perf_counter() - start
+            if not ret:
+                break
+            counters["frames_total"] += 1
+            counters["frames_decoded"] += 1
+
+            # Only queue frames where the scene has changed enough
+            if sample_mode == "adaptive":
+                signature = _scene_signature(frame)
+                if last_signature is not None:
+                    score = float(cv.absdiff(signature, last_signature).mean())
+                    if score < scene_threshold:
+                        continue
+                last_signature = signature
+
+            # Shrink large frames before they are queued
+            height, width = frame.shape[:2]
+            if resize_max_side and max(height, width) > resize_max_side:
+                scale = resize_max_side / max(height, width)
+                frame = cv.resize(frame, (round(width * scale), round(height * scale)),
+                                  interpolation=cv.INTER_AREA)
+
+            if not _put_frame(frame_queue, frame, stop_event):
+                break
+    except Exception as e:
+        counters["error"] = e
+    finally:
+        # Signal end of stream
+        _put_frame(frame_queue, None, stop_event)
 
 
 # Function: Predict bird species in a video
-def video_prediction(video_path, confidence=0.5, model="./model.pt"):
+def video_prediction(video_path, confidence=0.5, model=MODEL_PATH,
+                     sample_mode=VIDEO_SAMPLE_MODE,
+                     frame_stride=VIDEO_FRAME_STRIDE,
+                     scene_threshold=VIDEO_SCENE_THRESHOLD,
+                     queue_depth=VIDEO_QUEUE_DEPTH,
+                     batch_size=VIDEO_BATCH_SIZE,
+                     resize_max_side=VIDEO_RESIZE_MAX_SIDE,
+                     stats=None):
     """
     Run bird detection on a video using YOLO and ByteTrack.
 
+    Decoding runs on a separate thread that fills a queue of at most
+    `queue_depth` frames; the calling thread drains it in batches of up to
+    `batch_size` frames for YOLO and updates the tracker in frame order.
+
+    Sampling modes:
+        all:      run inference on every frame.
+        stride:   run inference on every `frame_stride`-th frame; frames in
+                  between are skipped with `cap.grab()` and never decoded.
+        adaptive: as stride, but a sampled frame is only inferred when its
+                  mean absolute difference from the last inferred frame
+                  (on a small greyscale signature) reaches `scene_threshold`.
+
     Args:
         video_path (str): Path to the video file.
         confidence (float): Confidence threshold for predictions.
         model (str): Path to the YOLO model.
+        sample_mode (str): 'all', 'stride' or 'adaptive'.
+        frame_stride (int): Frame step used by 'stride' and 'adaptive'.
+        scene_threshold (float): Scene-change score (0-255) for 'adaptive'.
+        queue_depth (int): Maximum number of decoded frames held in memory.
+        batch_size (int): Maximum number of frames per forward pass.
+        resize_max_side (int): Downscale frames to this longest side, 0 to keep.
+        stats (dict): Optional dict filled with frame counts, stage timings
+            and per-track summaries.
 
     Returns:
-        list: List of bird species detected across video frames.
+        list: One bird species name per distinct tracked bird.
     """
+    _import_libraries()
+    if sample_mode not in ("all", "stride", "adaptive"):
+        raise ValueError(f"Unknown video sample mode: {sample_mode}")
+    # Every frame is sampled in 'all' mode
+    stride = 1 if sample_mode == "all" else max(1, int(frame_stride))
+
+    cap = None
+    decoder = None
+    stop_event = threading.Event()
     try:
         # Extract video info
         video_info = sv.VideoInfo.from_video_path(video_path=video_path)
         # Extract frames per second
         fps = int(video_info.fps)
-        # Load YOLO model
-        model = YOLO(model)
-        # Initialize tracker for object tracking
-        tracker = sv.ByteTrack(frame_rate=fps)
+        # Get the cached detector (slow only on a cold container)
+        start = time.perf_counter()
+        model = get_model(model)
+        model_load_time = time.perf_counter() - start
+        # Initialize tracker at the rate frames are actually sampled
+        tracker = sv.ByteTrack(frame_rate=max(1, round(fps / stride)))
         # Get bird name dictionary
         class_dict = model.names
 
@@ -93,63 +608,128 @@ def video_prediction(video_path, confidence=0.5, model="./model.pt"):
         if not cap.isOpened():
             raise Exception("Failed to open video.")
 
-        # List to collect detected labels
-        labels = []
-        # Process the video frame by frame
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret: 
+        # Start the decoder thread
+        frame_queue = queue.Queue(maxsize=max(1, int(queue_depth)))
+        counters = {"frames_total": 0, "frames_decoded": 0, "decode_time": 0.0}
+        decoder = threading.Thread(
+            target=_decode_frames,
+            args=(cap, frame_queue, stop_event, counters, stride,
+                  sample_mode, scene_threshold, resize_max_side),
+            daemon=True)
+        decoder.start()
+
+        # Per-track aggregation of detections
+        aggregator = TrackAggregator(class_dict)
+        # Total time spent in model inference and tracking
+        inference_time = 0.0
+        tracking_time = 0.0
+        frames_inferred = 0
+        # Drain the queue in batches until the end-of-stream sentinel
+        finished = False
+        while not finished:
+            frame = frame_queue.get()
+            if frame is None:
                 break
+            batch = [frame]
+            while len(batch) < batch_size:
+                try:
+                    frame = frame_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is None:
+                    finished = True
+                    break
+                batch.append(frame)
 
-            # Run YOLO on current frame
-            result = model(frame)[0]
-            # Parse results
-            detections = sv.Detections.from_ultralytics(result)
-            # Apply tracking
-            detections = tracker.update_with_detections(detections)
+            # Run the detector on the batch of frames
+            start = time.perf_counter()
+            batch_detections = _detect(model, batch)
+            inference_time += time.perf_counter() - start
+            frames_inferred += len(batch)
 
-            # Filter detections based on confidence
-            if detections.tracker_id is not None:
-                detections = detections[detections.confidence > confidence]
-                labels += [
-                    class_dict[cls_id] for cls_id in detections.class_id
-                ]
+            start = time.perf_counter()
+            for detections in batch_detections:
+                # Apply tracking
+                detections = tracker.update_with_detections(detections)
 
-        # Return all detected bird names
-        return labels
+                # Filter detections based on confidence
+                if detections.tracker_id is not None:
+                    detections = detections[detections.confidence > confidence]
+                    aggregator.update(detections)
+            tracking_time += time.perf_counter() - start
+
+        decoder.join()
+        if "error" in counters:
+            raise counters["error"]
+
+        logger.info(f"Video ({sample_mode}, stride {stride}): "
+                    f"{counters['frames_total']} frames, "
+                    f"{counters['frames_decoded']} decoded, "
+                    f"{frames_inferred} inferred in {inference_time:.3f}s")
+        if stats is not None:
+            stats.update({
+                "frames_total": counters["frames_total"],
+                "frames_decoded": counters["frames_decoded"],
+                "frames_inferred": frames_inferred,
+                "decode_time": counters["decode_time"],
+                "model_load_time": model_load_time,
+                "inference_time": inference_time,
+                "tracking_time": tracking_time,
+                "tracks": aggregator.tracks(),
+            })
+        # Return one bird name per tracked bird
+        return aggregator.labels()
 
     except Exception as e:
         print(f"Video prediction failed: {e}")  # Log failure
         return []
 
     finally:
-        cap.release()
+        # Stop the decoder before releasing the capture it reads from
+        stop_event.set()
+        if decoder is not None:
+            decoder.join()
+        if cap is not None:
+            cap.release()
         print("Released video resources.")
 
 
 # Function: Generate a thumbnail from an image
-def create_thumbnail(image_path, size=(150, 150)):
+def create_thumbnail(image_path, size=(150, 150), ext=None):
     """
     Create a thumbnail image from the original image.
 
+    The image is shrunk to fit within `size` keeping its aspect ratio.
+
     Args:
-        image_path (str): Path to the source image.
-        size (tuple): Thumbnail dimensions (width, height).
+        image_path (str or ndarray): Path to the source image, or an image
+            already decoded with decode_image.
+        size (tuple): Maximum thumbnail dimensions (width, height).
+        ext (str): Encoding extension; defaults to the path's extension.
 
     Returns:
         bytes: Encoded thumbnail image in bytes, or None if failed.
     """
+    _import_libraries()
     try:
-        # Get file extension
-        ext = os.path.splitext(image_path)[-1]
-        # Load image
-        image = cv.imread(image_path)
+        if isinstance(image_path, np.ndarray):
+            image = image_path
+            ext = ext or ".jpg"
+        else:
+            # Get file extension
+            ext = ext or os.path.splitext(image_path)[-1]
+            # Load image, reduced to no more than the thumbnail needs
+            image = decode_image(image_path, min_side=max(size))
         if image is None:
             logger.warning("Failed to load image for thumbnail.")
             return None
 
-        # Resize image to thumbnail size
-        resized = cv.resize(image, size)
+        # Shrink image to fit the thumbnail size, keeping aspect ratio
+        height, width = image.shape[:2]
+        scale = min(size[0] / width, size[1] / height, 1.0)
+        resized = cv.resize(image, (max(1, round(width * scale)),
+                                    max(1, round(height * scale))),
+                            interpolation=cv.INTER_AREA)
         # Encode image as binary
         success, encoded = cv.imencode(ext, resized)
 
@@ -164,82 +744,385 @@ def create_thumbnail(image_path, size=(150, 150)):
         return None
 
 
+# Function: Get the S3 client, creating it on first use
+def _get_s3():
+    """
+    Returns:
+        S3.Client: Client reused for the life of the container.
+    """
+    global s3
+    if s3 is None:
+        import boto3
+        s3 = boto3.client('s3')
+    return s3
+
+
+# Function: Get the media index table, creating it on first use
+def _get_table():
+    """
+    Returns:
+        DynamoDB.Table: BirdTagMediaIndex, reused for the life of the container.
+    """
+    global table
+    if table is None:
+        import boto3
+        table = boto3.resource('dynamodb').Table('BirdTagMediaIndex')
+    return table
+
+
+# Function: Flatten S3 records from S3 and SQS events
+def _iter_s3_records(event):
+    """
+    Yield S3 event records from a direct S3 trigger or an SQS batch whose
+    message bodies are S3 event notifications.
+
+    Args:
+        event (dict): Lambda event.
+
+    Yields:
+        dict: S3 event record.
+    """
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            # S3 notification delivered through SQS
+            body = json.loads(record['body'])
+            yield from body.get('Records', [])
+        else:
+            yield record
+
+
+# Function: Download an S3 object into memory or a temporary file
+@contextmanager
+def _fetch_object(bucket_name, object_key, spill=False, metrics=None):
+    """
+    Read an S3 object without going through a fixed /tmp path.
+
+    Objects up to SPILL_THRESHOLD_BYTES are read into memory. Larger ones,
+    or any object when `spill` is set (e.g. videos that need random
+    access), are streamed to a uniquely named temporary file that is
+    removed when the context exits.
+
+    Args:
+        bucket_name (str): S3 bucket name.
+        object_key (str): S3 object key.
+        spill (bool): Always write the object to a temporary file.
+        metrics (Metrics): Optional metrics the download time and size are
+            added to.
+
+    Yields:
+        bytes or str: Object content, or the path of the temporary file.
+    """
+    start = time.perf_counter()
+    response = _get_s3().get_object(Bucket=bucket_name, Key=object_key)
+    body = response['Body']
+    if metrics is not None:
+        metrics.add("object_bytes", response['ContentLength'], "Bytes")
+    try:
+        if not spill and response['ContentLength'] <= SPILL_THRESHOLD_BYTES:
+            data = body.read()
+            if metrics is not None:
+                metrics.add_time("s3_download", time.perf_counter() - start)
+            yield data
+            return
+
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(object_key)[-1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(body, f, SPILL_CHUNK_BYTES)
+            if metrics is not None:
+                metrics.add_time("s3_download", time.perf_counter() - start)
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+    finally:
+        body.close()
+
+
+# Function: Version label of detection results for the cache
+def _cache_version(file_type):
+    """
+    Identify the model and settings that produced a result, so cached
+    results are never reused across model or sampling changes.
+
+    Args:
+        file_type (str): 'image' or 'video'.
+
+    Returns:
+        str: Version label.
+    """
+    version = f"{file_type}:{os.path.basename(MODEL_PATH)}:{_model_version(MODEL_PATH)}"
+    if file_type == "video":
+        version += f":{VIDEO_SAMPLE_MODE}:{VIDEO_FRAME_STRIDE}:{VIDEO_SCENE_THRESHOLD}"
+    return version
+
+
+# Function: Store the detection result of one file
+def _store_result(bucket_name, object_key, file_type, tag_summary, metrics):
+    """
+    Write the tag summary of a processed file to DynamoDB and update the
+    species index.
+
+    Args:
+        bucket_name (str): S3 bucket name.
+        object_key (str): S3 object key.
+        file_type (str): 'image', 'video' or empty.
+        tag_summary (dict): Bird name -> count.
+        metrics (Metrics): Metrics of the record.
+    """
+    # Construct public file URL
+    file_url = f"https://{bucket_name}.s3.amazonaws.com/{object_key}"
+
+    # Insert metadata into DynamoDB
+    try:
+        with metrics.timer("dynamodb_write"):
+            synced = write_media(_get_table(), file_url, file_type, tag_summary)
+        logger.info(f"DynamoDB record inserted for {object_key}")
+        if not synced:
+            metrics.add("stats_sync_failed", 1)
+    except ClientError as e:
+        logger.error(f"Failed to write to DynamoDB: {e}")
+
+
+# Function: Reuse the thumbnail of a cached image
+def _reuse_thumbnail(bucket_name, object_key, cached, metrics):
+    """
+    Make sure a thumbnail exists for an image whose result came from the
+    cache, copying it server-side from the file the result was computed on.
+
+    Args:
+        bucket_name (str): S3 bucket name.
+        object_key (str): S3 object key of the image.
+        cached (dict): Cache entry, with the 'thumbnail' location if any.
+        metrics (Metrics): Metrics of the record.
+
+    Returns:
+        bool: True if the thumbnail is in place.
+    """
+    thumb_key = object_key.replace("Images/", "Thumbnails/")
+    source = cached.get("thumbnail")
+    if not source:
+        return False
+    if source == f"{bucket_name}/{thumb_key}":
+        return True
+
+    source_bucket, source_key = source.split("/", 1)
+    try:
+        with metrics.timer("thumbnail_upload"):
+            _get_s3().copy_object(Bucket=bucket_name, Key=thumb_key,
+                                  CopySource={"Bucket": source_bucket, "Key": source_key})
+        logger.info(f"Thumbnail copied from cache: {thumb_key}")
+        return True
+    except ClientError as e:
+        logger.warning(f"Cached thumbnail copy failed: {e}")
+        return False
+
+
+# Function: Detect, thumbnail and store a batch of decoded images
+def _process_image_batch(pending):
+    """
+    Run batched detection over decoded images, then upload a thumbnail,
+    store the tags and cache the result of each one.
+
+    Model load and inference time of the batch are split evenly between its
+    images; each image's metrics are emitted once it is stored.
+
+    Args:
+        pending (list): (bucket_name, object_key, image, digest, metrics)
+            tuples, where image is None if decoding failed.
+    """
+    if not pending:
+        return
+
+    images = [image for _, _, image, _, _ in pending]
+    valid = [i for i, img in enumerate(images) if img is not None]
+
+    # Batched prediction, falling back to one image at a time on failure;
+    # None marks images without a usable result
+    tags_by_index = {i: None for i in range(len(pending))}
+    try:
+        batch_stats = {}
+        batch_tags = image_prediction_batch([images[i] for i in valid], stats=batch_stats)
+        tags_by_index.update(zip(valid, batch_tags))
+        for i in valid:
+            metrics = pending[i][4]
+            metrics.add("batch_size", len(valid))
+            metrics.add_time("model_load", batch_stats["model_load_time"] / len(valid))
+            metrics.add_time("inference", batch_stats["inference_time"] / len(valid))
+    except Exception as e:
+        logger.warning(f"Batch prediction failed, retrying per image: {e}")
+        for i in valid:
+            image_stats = {}
+            try:
+                tags_by_index[i] = image_prediction(images[i], stats=image_stats)
+            except Exception as e:
+                logger.warning(f"Image processing failed: {e}")
+            metrics = pending[i][4]
+            metrics.add_time("model_load", image_stats.get("model_load_time", 0.0))
+            metrics.add_time("inference", image_stats.get("inference_time", 0.0))
+
+    for i, (bucket_name, object_key, _, digest, metrics) in enumerate(pending):
+        thumb_location = None
+        try:
+            # Create thumbnail from the already decoded image
+            thumbnail_bytes = None
+            if images[i] is not None:
+                with metrics.timer("thumbnail_encode"):
+                    thumbnail_bytes = create_thumbnail(
+                        images[i], ext=os.path.splitext(object_key)[-1])
+
+            if thumbnail_bytes:
+                # Define thumbnail key
+                thumb_key = object_key.replace("Images/", "Thumbnails/")
+                # Upload thumbnail to S3
+                with metrics.timer("thumbnail_upload"):
+                    _get_s3().put_object(Bucket=bucket_name,
+                                         Key=thumb_key,
+                                         Body=thumbnail_bytes,
+                                         ContentType="image/jpeg")
+                metrics.add("thumbnail_bytes", len(thumbnail_bytes), "Bytes")
+                logger.info(f"Thumbnail uploaded: {thumb_key}")
+                thumb_location = f"{bucket_name}/{thumb_key}"
+        except Exception as e:
+            logger.warning(f"Thumbnail processing failed: {e}")
+
+        # Count each bird species
+        tag_summary = dict(Counter(tags_by_index[i] or []))
+        _store_result(bucket_name, object_key, "image", tag_summary, metrics)
+
+        # Only cache complete results
+        if tags_by_index[i] is not None and thumb_location:
+            with metrics.timer("dynamodb_write"):
+                detection_cache.put(digest, _cache_version("image"), {
+                    "file_type": "image",
+                    "tags": tag_summary,
+                    "thumbnail": thumb_location,
+                })
+        metrics.add("detections", sum(tag_summary.values()))
+        metrics.flush()
+
+
+# Function: Copy video_prediction stats into the record's metrics
+def _add_video_metrics(metrics, video_stats):
+    """
+    Args:
+        metrics (Metrics): Metrics of the record.
+        video_stats (dict): Stats filled in by video_prediction, empty if it
+            failed.
+    """
+    for name in ("frames_total", "frames_decoded", "frames_inferred"):
+        metrics.add(name, video_stats.get(name, 0))
+    metrics.add("tracks", len(video_stats.get("tracks", [])))
+    for stage in ("decode", "model_load", "inference", "tracking"):
+        metrics.add_time(stage, video_stats.get(f"{stage}_time", 0.0))
+
+
 # Lambda handler function
 def handler(event, context):
     """
     Lambda function handler to process uploaded media files (images/videos),
     perform detection, optionally generate thumbnails, and store metadata in DynamoDB.
+
+    Images from all records of an S3 event (or SQS batch) are gathered and
+    run through YOLO in mini-batches of IMAGE_BATCH_SIZE. Files whose content
+    hash (S3 ETag) is already in the detection cache skip download, decoding
+    and inference, which also makes duplicate S3 events idempotent.
+
+    Stage timings, sizes and counts of every record are emitted as one
+    CloudWatch Embedded Metric Format line (see metrics.py).
     """
+    # Decoded images waiting for batched inference
+    pending_images = []
+
     # Loop over S3 trigger records
-    for record in event.get('Records', []):
+    for record in _iter_s3_records(event):
         # Extract bucket name
         bucket_name = record['s3']['bucket']['name']
         # Decode key
         object_key = unquote_plus(record['s3']['object']['key'])
+        # Content hash reported by S3
+        digest = record_hash(record)
 
         logger.info(f"Processing file from S3: {bucket_name}/{object_key}")
-        # Temporary download path
-        local_path = f"/tmp/{os.path.basename(object_key)}"
-
-        try:
-            # Download file from S3
-            s3.download_file(bucket_name, object_key, local_path)
-            logger.info(f"Downloaded file to: {local_path}")
-        except ClientError as e:
-            logger.error(f"Download failed: {e}")
-            continue
+        metrics = Metrics("birds_detection", object_key=object_key)
 
-        # List of detected tags
-        tags = []
-        # 'image' or 'video'
-        file_type = ""
-
-        # Handle image files
+        # Handle image files: decode straight from the object body
         if object_key.startswith("Images/"):
-            file_type = "image"
+            metrics.set_property("file_type", "image")
+            with metrics.timer("dynamodb_read"):
+                cached = detection_cache.get(digest, _cache_version("image"))
+            if cached is not None and _reuse_thumbnail(bucket_name, object_key, cached, metrics):
+                logger.info(f"Detection cache hit for {object_key}")
+                metrics.add("cache_hit", 1)
+                _store_result(bucket_name, object_key, "image", cached["tags"], metrics)
+                metrics.flush()
+                continue
+
             try:
-                # Predict bird species
-                tags = image_prediction(local_path)
-                # Create thumbnail
-                thumbnail_bytes = create_thumbnail(local_path)
-
-                if thumbnail_bytes:
-                    # Define thumbnail key
-                    thumb_key = object_key.replace("Images/", "Thumbnails/")
-                    # Upload thumbnail to S3
-                    s3.put_object(Bucket=bucket_name,
-                                  Key=thumb_key,
-                                  Body=thumbnail_bytes,
-                                  ContentType="image/jpeg")
-                    logger.info(f"Thumbnail uploaded: {thumb_key}")
-            except Exception as e:
-                logger.warning(f"Image processing failed: {e}")
-                tags = []
-        # Handle video files
+                with _fetch_object(bucket_name, object_key, metrics=metrics) as source:
+                    if digest is None and isinstance(source, bytes):
+                        digest = content_hash(source)
+                    with metrics.timer("decode"):
+                        image = decode_image(source)
+            except ClientError as e:
+                logger.error(f"Download failed: {e}")
+                metrics.add("errors", 1)
+                metrics.flush()
+                continue
+            if image is None:
+                logger.warning(f"Failed to load image: {object_key}")
+                metrics.add("errors", 1)
+
+            pending_images.append((bucket_name, object_key, image, digest, metrics))
+            if len(pending_images) >= IMAGE_BATCH_SIZE:
+                _process_image_batch(pending_images)
+                pending_images = []
+        # Handle video files: OpenCV needs a file for random access
         elif object_key.startswith("Videos/"):
-            file_type = "video"
+            metrics.set_property("file_type", "video")
+            with metrics.timer("dynamodb_read"):
+                cached = detection_cache.get(digest, _cache_version("video"))
+            if cached is not None:
+                logger.info(f"Detection cache hit for {object_key}")
+                metrics.add("cache_hit", 1)
+                _store_result(bucket_name, object_key, "video", cached["tags"], metrics)
+                metrics.flush()
+                continue
+
+            tags = []
+            # Filled in by video_prediction only when it completes
+            video_stats = {}
             try:
-                # Predict from video
-                tags = video_prediction(local_path)
-            except Exception as e:
-                logger.warning(f"Video processing failed: {e}")
-                tags = []
+                with _fetch_object(bucket_name, object_key, spill=True,
+                                   metrics=metrics) as video_path:
+                    try:
+                        # Predict from video
+                        tags = video_prediction(video_path, stats=video_stats)
+                    except Exception as e:
+                        logger.warning(f"Video processing failed: {e}")
+            except ClientError as e:
+                logger.error(f"Download failed: {e}")
+                metrics.add("errors", 1)
+                metrics.flush()
+                continue
+            _add_video_metrics(metrics, video_stats)
 
-        # Count each bird species
-        tag_summary = dict(Counter(tags))
-        # Construct public file URL
-        file_url = f"https://{bucket_name}.s3.amazonaws.com/{object_key}"
+            # Count each bird species
+            tag_summary = dict(Counter(tags))
+            _store_result(bucket_name, object_key, "video", tag_summary, metrics)
+            if video_stats:
+                with metrics.timer("dynamodb_write"):
+                    detection_cache.put(digest, _cache_version("video"),
+                                        {"file_type": "video", "tags": tag_summary})
+            else:
+                metrics.add("errors", 1)
+            metrics.add("detections", sum(tag_summary.values()))
+            metrics.flush()
+        else:
+            _store_result(bucket_name, object_key, "", {}, metrics)
+            metrics.flush()
 
-        # Insert metadata into DynamoDB
-        try:
-            table.put_item(Item={
-                'file_id': file_url,
-                'file_type': file_type,
-                'tags': tag_summary
-            })
-            logger.info(f"DynamoDB record inserted for {object_key}")
-        except ClientError as e:
-            logger.error(f"Failed to write to DynamoDB: {e}")
+    # Process any remaining images
+    _process_image_batch(pending_images)
 
 
 # Local test block
@@ -0,0 +1,133 @@
+# Import libraries
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+import cv2 as cv
+import numpy as np
+import supervision as sv
+from ultralytics import YOLO
+
+from export_onnx import IMAGE_EXTENSIONS
+from onnx_detector import OnnxDetector
+
+
+# Function: Count confident detections per bird name
+def count_labels(detections, class_dict, confidence):
+    """
+    Build the tag summary stored for an image.
+
+    Returns:
+        Counter: Bird name -> number of detections above `confidence`.
+    """
+    if detections.class_id is None:
+        return Counter()
+    detections = detections[detections.confidence > confidence]
+    return Counter(class_dict[cls_id] for cls_id in detections.class_id)
+
+
+# Function: Time a detector over a list of images
+def run_backend(detect, images, class_dict, confidence, warmup=3):
+    """
+    Run a detector on every image, one at a time.
+
+    Args:
+        detect (callable): Image -> sv.Detections.
+        images (list): Decoded BGR images.
+        class_dict (dict): Class ID to bird name mapping.
+        confidence (float): Confidence threshold for tags.
+        warmup (int): Untimed runs before measuring.
+
+    Returns:
+        tuple: (list of tag Counters, list of latencies in seconds).
+    """
+    for image in images[:warmup]:
+        detect(image)
+
+    summaries, latencies = [], []
+    for image in images:
+        start = time.perf_counter()
+        detections = detect(image)
+        latencies.append(time.perf_counter() - start)
+        summaries.append(count_labels(detections, class_dict, confidence))
+    return summaries, latencies
+
+
+# Function: Compare tag summaries against the reference backend
+def agreement(reference, candidate):
+    """
+    Score how closely candidate tag summaries match the reference.
+
+    Returns:
+        dict: Exact-match rate and multiset precision/recall of bird tags.
+    """
+    exact = sum(ref == cand for ref, cand in zip(reference, candidate))
+    matched = sum(sum((ref & cand).values()) for ref, cand in zip(reference, candidate))
+    ref_total = sum(sum(ref.values()) for ref in reference)
+    cand_total = sum(sum(cand.values()) for cand in candidate)
+    return {
+        "exact_match": exact / len(reference),
+        "precision": matched / cand_total if cand_total else 1.0,
+        "recall": matched / ref_total if ref_total else 1.0,
+    }
+
+
+# Function: Summarise a list of latencies
+def latency_summary(latencies):
+    """
+    Returns:
+        dict: Mean, p50 and p95 latency in milliseconds.
+    """
+    values = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compare accuracy and latency of the PyTorch and ONNX detectors.")
+    parser.add_argument("images", help="Folder of evaluation images")
+    parser.add_argument("--weights", default="./model.pt")
+    parser.add_argument("--onnx", nargs="+", default=["./model.onnx"],
+                        help="ONNX models to compare (e.g. FP32 and INT8)")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--confidence", type=float, default=0.5)
+    parser.add_argument("--output", default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    images = [img for img in (cv.imread(path) for path in paths) if img is not None]
+    print(f"Evaluating on {len(images)} images")
+
+    # PyTorch reference
+    yolo = YOLO(args.weights)
+    reference, latencies = run_backend(
+        lambda img: sv.Detections.from_ultralytics(yolo(img, verbose=False)[0]),
+        images, yolo.names, args.confidence)
+    report = {"torch": {"model": args.weights, **latency_summary(latencies)}}
+
+    for onnx_path in args.onnx:
+        detector = OnnxDetector(onnx_path, threads=args.threads)
+        if detector.names != yolo.names:
+            print(f"Warning: class mapping of {onnx_path} differs from {args.weights}")
+        summaries, latencies = run_backend(
+            lambda img: detector.detect([img])[0],
+            images, detector.names, args.confidence)
+        report[os.path.basename(onnx_path)] = {
+            "model": onnx_path,
+            **latency_summary(latencies),
+            **agreement(reference, summaries),
+        }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,131 @@
+# Import libraries
+import argparse
+import os
+
+import cv2 as cv
+import onnx
+from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+                                      QuantType, quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from ultralytics import YOLO
+
+from onnx_detector import DEFAULT_INPUT_SIZE, letterbox
+
+# Image extensions accepted for calibration
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+# Calibration data for static INT8 quantization
+class ImageFolderReader(CalibrationDataReader):
+    """
+    Feed letterboxed images from a local folder to the quantization
+    calibrator, one at a time.
+    """
+
+    def __init__(self, folder, input_name, input_size, limit):
+        """
+        Args:
+            folder (str): Folder of calibration images.
+            input_name (str): Name of the model input.
+            input_size (int): Model input side length.
+            limit (int): Maximum number of images to use.
+        """
+        paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )[:limit]
+        if not paths:
+            raise ValueError(f"No calibration images found in {folder}")
+        self.input_name = input_name
+        self.input_size = (input_size, input_size)
+        self._paths = iter(paths)
+
+    def get_next(self):
+        for path in self._paths:
+            image = cv.imread(path)
+            if image is None:
+                print(f"Skipping unreadable calibration image: {path}")
+                continue
+            blob, _, _ = letterbox(image, self.input_size)
+            return {self.input_name: blob[None]}
+        return None
+
+
+# Function: Copy ultralytics metadata (class names etc.) between models
+def copy_metadata(source_path, target_path):
+    """
+    Copy the metadata properties of one ONNX model onto another.
+
+    Args:
+        source_path (str): Model holding the metadata.
+        target_path (str): Model to update in place.
+    """
+    source = onnx.load(source_path, load_external_data=False)
+    target = onnx.load(target_path)
+    existing = {prop.key for prop in target.metadata_props}
+    for prop in source.metadata_props:
+        if prop.key not in existing:
+            target.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(target, target_path)
+
+
+# Function: Export model.pt to ONNX and optionally quantize it
+def export(weights, output, imgsz=DEFAULT_INPUT_SIZE, calib_dir=None,
+           calib_count=200, int8_output=None):
+    """
+    Export a YOLO checkpoint to ONNX, and to INT8 when a calibration folder
+    is given.
+
+    Args:
+        weights (str): Path to model.pt.
+        output (str): Path of the FP32 ONNX model to write.
+        imgsz (int): Model input size.
+        calib_dir (str): Folder of calibration images, None to skip INT8.
+        calib_count (int): Maximum number of calibration images.
+        int8_output (str): Path of the INT8 model, defaults to <output>.int8.onnx.
+
+    Returns:
+        list: Paths of the models written.
+    """
+    # ultralytics writes the ONNX file next to the weights
+    exported = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True,
+                                    simplify=True)
+    if os.path.abspath(exported) != os.path.abspath(output):
+        os.replace(exported, output)
+    written = [output]
+    print(f"Exported FP32 model: {output}")
+
+    if calib_dir:
+        int8_output = int8_output or os.path.splitext(output)[0] + ".int8.onnx"
+        prepared = os.path.splitext(output)[0] + ".prep.onnx"
+        quant_pre_process(output, prepared)
+
+        input_name = onnx.load(prepared, load_external_data=False).graph.input[0].name
+        reader = ImageFolderReader(calib_dir, input_name, imgsz, calib_count)
+        quantize_static(prepared, int8_output, reader,
+                        quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8,
+                        per_channel=True)
+        os.remove(prepared)
+        # Keep the class names readable by OnnxDetector
+        copy_metadata(output, int8_output)
+        written.append(int8_output)
+        print(f"Exported INT8 model: {int8_output}")
+
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the bird detector to ONNX.")
+    parser.add_argument("--weights", default="./model.pt")
+    parser.add_argument("--output", default="./model.onnx")
+    parser.add_argument("--imgsz", type=int, default=DEFAULT_INPUT_SIZE)
+    parser.add_argument("--calib-dir", default=None,
+                        help="Folder of images for INT8 static quantization")
+    parser.add_argument("--calib-count", type=int, default=200)
+    parser.add_argument("--int8-output", default=None)
+    args = parser.parse_args()
+
+    export(args.weights, args.output, args.imgsz, args.calib_dir,
+           args.calib_count, args.int8_output)
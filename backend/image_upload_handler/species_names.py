@@ -0,0 +1,220 @@
+# Import libraries
+import argparse
+import ast
+import json
+import os
+import string
+from bisect import bisect_left
+from difflib import get_close_matches
+
+# BirdNET labels ('<scientific name>_<common name>' per line) and the YOLO
+# class map (JSON list or {id: name}); missing files are skipped
+SPECIES_LABELS_PATH = os.environ.get("SPECIES_LABELS_PATH", "./BirdNET_GLOBAL_6K_V2.4_Labels.txt")
+YOLO_CLASSES_PATH = os.environ.get("YOLO_CLASSES_PATH", "./yolo_classes.json")
+# Entries looked at per prefix lookup before ranking
+COMPLETE_SCAN_LIMIT = 200
+
+
+# Function: Fold a name for comparison
+def fold(name):
+    """
+    Lowercase a name and collapse its whitespace.
+
+    Args:
+        name (str): Species name as written.
+
+    Returns:
+        str: Folded name, empty if the name is blank.
+    """
+    return " ".join(str(name).split()).lower()
+
+
+# Function: Display form of a name outside the BirdNET labels
+def title(name):
+    """
+    Capitalize each word of a folded name ('rock dove' -> 'Rock Dove'), so
+    names entered in any case are stored the same way.
+    """
+    return string.capwords(fold(name))
+
+
+# Vocabulary of known species names
+class SpeciesNames:
+    """
+    Known species with their aliases, for normalization and autocomplete.
+
+    Each species has a canonical key (its folded common name) and a display
+    name. Common names, scientific names and case variants all map to the
+    canonical key. Prefix lookups go through a sorted array of every
+    word-start suffix of every alias ('american crow', 'crow', ...), so
+    typing any word of a name finds it with one bisect.
+    """
+
+    def __init__(self, entries=()):
+        """
+        Args:
+            entries (iterable): (display name, aliases) pairs; earlier
+                entries win when an alias is claimed twice.
+        """
+        self.display = {}
+        self.aliases = {}
+        keys = set()
+        for display, aliases in entries:
+            canonical = fold(display)
+            if not canonical:
+                continue
+            self.display.setdefault(canonical, display)
+            for alias in (display, *aliases):
+                folded = fold(alias)
+                if not folded:
+                    continue
+                self.aliases.setdefault(folded, canonical)
+                words = folded.split()
+                for start in range(len(words)):
+                    keys.add((" ".join(words[start:]), canonical))
+        self._entries = sorted(keys)
+        self._keys = [key for key, _ in self._entries]
+        self._unique_keys = list(dict.fromkeys(self._keys))
+
+    @classmethod
+    def load(cls, labels_path=SPECIES_LABELS_PATH, classes_path=YOLO_CLASSES_PATH, species=()):
+        """
+        Build the vocabulary from the BirdNET labels and the YOLO class map.
+
+        Args:
+            species (iterable): Further species names, e.g. the keys of
+                species already in the media index.
+
+        Returns:
+            SpeciesNames: Vocabulary, empty if no file exists and no
+            species are given.
+        """
+        entries = []
+        if labels_path and os.path.exists(labels_path):
+            with open(labels_path, encoding="utf-8") as f:
+                for line in f:
+                    scientific, _, common = line.strip().partition("_")
+                    if common:
+                        entries.append((common, (scientific,)))
+        if classes_path and os.path.exists(classes_path):
+            with open(classes_path, encoding="utf-8") as f:
+                classes = json.load(f)
+            names = classes.values() if isinstance(classes, dict) else classes
+            entries.extend((title(name), ()) for name in names)
+        entries.extend((title(name), ()) for name in species)
+        return cls(entries)
+
+    def canonical(self, name):
+        """
+        Args:
+            name (str): Species name in any known form.
+
+        Returns:
+            str: Canonical key, or the folded name if the species is unknown.
+        """
+        folded = fold(name)
+        return self.aliases.get(folded, folded)
+
+    def display_name(self, name):
+        """
+        Args:
+            name (str): Species name in any known form.
+
+        Returns:
+            str: Display name of the species, title-cased if unknown.
+        """
+        canonical = self.canonical(name)
+        return self.display.get(canonical) or title(canonical)
+
+    def complete(self, text, limit=10):
+        """
+        Suggest species for what has been typed so far.
+
+        Names with a word starting with `text` match; the name itself ranks
+        first, then names ending in it as whole words, then names starting
+        with it. With no prefix match, names with a closely spelled word are
+        suggested.
+
+        Args:
+            text (str): Partial species name.
+            limit (int): Most suggestions returned.
+
+        Returns:
+            list: {'key': canonical key, 'name': display name} dicts.
+        """
+        folded = fold(text)
+        if not folded:
+            return []
+
+        # Rank: the name itself (0), whole trailing words match (1), name
+        # starts with the text (2), some later word starts with it (3)
+        ranks = {}
+        start = bisect_left(self._keys, folded)
+        end = min(start + COMPLETE_SCAN_LIMIT, len(self._keys))
+        for index in range(start, end):
+            if not self._keys[index].startswith(folded):
+                break
+            key, canonical = self._entries[index]
+            if canonical == folded:
+                rank = 0
+            else:
+                rank = 1 if key == folded else 2 if canonical.startswith(folded) else 3
+            ranks[canonical] = min(rank, ranks.get(canonical, rank))
+        if ranks:
+            ranked = sorted(ranks, key=lambda canonical: (ranks[canonical], canonical))
+        else:
+            # Misspellings: closest word-start suffixes
+            close = get_close_matches(folded, self._unique_keys, n=limit * 4, cutoff=0.75)
+            ranked = list(dict.fromkeys(canonical for key in close
+                                        for canonical in self._canonicals(key)))
+        return [{"key": key, "name": self.display[key]} for key in ranked[:limit]]
+
+    def _canonicals(self, key):
+        index = bisect_left(self._entries, (key, ""))
+        while index < len(self._entries) and self._entries[index][0] == key:
+            yield self._entries[index][1]
+            index += 1
+
+
+# Vocabulary loaded on first use
+_names = None
+
+
+# Function: Get the species vocabulary, loading it on first use
+def species_names():
+    """
+    Returns:
+        SpeciesNames: Vocabulary, reused for the life of the container.
+    """
+    global _names
+    if _names is None:
+        _names = SpeciesNames.load()
+    return _names
+
+
+# Function: Canonical key of a species name
+def canonical_species(name):
+    return species_names().canonical(name)
+
+
+# Function: Display name of a species name
+def display_species(name):
+    return species_names().display_name(name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Write the class map of a YOLO model for the species vocabulary.")
+    parser.add_argument("model", help="model.pt (ultralytics) or model.onnx")
+    parser.add_argument("--output", default="yolo_classes.json")
+    args = parser.parse_args()
+
+    if args.model.endswith(".onnx"):
+        import onnxruntime as ort
+        metadata = ort.InferenceSession(args.model).get_modelmeta().custom_metadata_map
+        names = ast.literal_eval(metadata["names"])
+    else:
+        from ultralytics import YOLO
+        names = YOLO(args.model).names
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump([names[i] for i in sorted(names)], f, indent=2)
@@ -0,0 +1,92 @@
+# Import libraries
+import argparse
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+
+from media_index import (PENDING_ATTRIBUTE, SPECIES_INDEX_TABLE, bump_version, canonical_tags,
+                         species_counts, species_table, update_postings)
+
+
+# Function: Iterate over every item of the media index
+def scan_media(table, page_size):
+    kwargs = {
+        'ProjectionExpression': 'file_id, file_type, tags, #pending',
+        'ExpressionAttributeNames': {'#pending': PENDING_ATTRIBUTE},
+        'Limit': page_size,
+    }
+    while True:
+        response = table.scan(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+# Function: Store a file's tags under their display names
+def merge_tags(table, item, tags):
+    """
+    Rewrite the tags of an item written before names were normalized
+    ('crow': 2, 'Crow': 5 -> 'Crow': 7). Counts per species are unchanged,
+    so the statistics stay as they are.
+
+    Returns:
+        bool: False if the tags were edited since the scan and were left alone.
+    """
+    try:
+        table.update_item(
+            Key={'file_id': item['file_id']},
+            UpdateExpression='SET #tags = :tags',
+            ConditionExpression='#tags = :old',
+            ExpressionAttributeNames={'#tags': 'tags'},
+            ExpressionAttributeValues={':tags': tags, ':old': item['tags']},
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=f"Build {SPECIES_INDEX_TABLE} from the existing media index and "
+                    "merge tags stored under older spellings of a species name. "
+                    "Safe to re-run: postings are overwritten, not duplicated.")
+    parser.add_argument("--table", default="BirdTagMediaIndex", help="Media index table")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Count the postings without writing them")
+    args = parser.parse_args()
+
+    table = boto3.resource('dynamodb').Table(args.table)
+    files = postings = merged = skipped = 0
+    species = set()
+    # One batch writer for the whole run, flushed 25 writes at a time
+    with species_table().batch_writer() as batch:
+        for item in scan_media(table, args.page_size):
+            counts = species_counts(item.get('tags'))
+            tags = canonical_tags(item.get('tags'))
+            if tags != item.get('tags', {}):
+                if args.dry_run or merge_tags(table, item, tags):
+                    merged += 1
+                else:
+                    skipped += 1
+            if not args.dry_run:
+                update_postings(item['file_id'], item.get('file_type'), tags, batch=batch)
+            files += 1
+            postings += len(counts)
+            species.update(counts)
+    if not args.dry_run:
+        bump_version()
+
+    print(json.dumps({
+        "files": files,
+        "postings": postings,
+        "species": len(species),
+        # Files whose tags were merged, and files edited while this ran
+        "merged": merged,
+        "skipped": skipped,
+        "dry_run": args.dry_run,
+    }))
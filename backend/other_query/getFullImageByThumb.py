@@ -1,7 +1,19 @@
 import json
 from urllib.parse import unquote_plus
 
+from metrics import Metrics
+
 def lambda_handler(event, context):
+    metrics = Metrics("getFullImageByThumb")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+def _handle(event, metrics):
     try:
         thumb_url = unquote_plus(event["queryStringParameters"]["thumb"])
         full_url = thumb_url.replace("Thumbnails/", "Images/")
@@ -1,104 +1,257 @@
 import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
-import urllib.parse
-import logging  
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+from media_index import bump_version, record_change
+from metrics import Metrics
+from species_names import canonical_species, display_species, fold
 
-# Configure logging
+# Configure logging (expressions are logged at DEBUG)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+TABLE_NAME = 'BirdTagMediaIndex'
+# Concurrent item updates, each on its own pooled connection
+TAG_EDIT_WORKERS = int(os.environ.get("TAG_EDIT_WORKERS", "16"))
+# Attempts per item when DynamoDB throttles or a request fails transiently,
+# with exponential backoff
+MAX_ATTEMPTS = int(os.environ.get("TAG_EDIT_MAX_ATTEMPTS", "6"))
+# Stop starting new updates this many seconds before API Gateway gives up
+API_TIMEOUT_SECONDS = 29.0
+DEADLINE_MARGIN_SECONDS = 2.0
 
-# Connect to DynamoDB table named "BirdTagMediaIndex"
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('BirdTagMediaIndex')
+# Low-level clients are thread-safe; retries are handled below so that
+# throttled items back off without holding up the rest of the batch
+dynamodb = boto3.client('dynamodb', config=Config(
+    max_pool_connections=TAG_EDIT_WORKERS,
+    retries={'total_max_attempts': 1},
+))
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+# Errors retried with backoff: throttling, and server-side failures that
+# botocore would otherwise have retried
+RETRYABLE_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'InternalServerError',
+    'ServiceUnavailable',
+}
+
+# Operations: legacy 1 (set) / 0 (remove), or their names; 'add' adds deltas
+OPERATIONS = {'1': 'set', '0': 'remove', 'set': 'set', 'add': 'add', 'remove': 'remove'}
 
 # Helper function to extract file_id from URL (currently just returns URL directly)
 def extract_file_id(url):
     return url
 
+# Parse "Crow,5" tag strings into (display name, count) pairs; a count of None
+# removes the tag. Tags are stored under their display names, but tags written
+# before names were normalized may use the name as typed or its lowercase key
+# ("crow"): removals and sets drop those too. Adds keep them, so their counts
+# are not lost; backfill_species_index.py merges them.
+def parse_tag_edit(operation, tag_pairs):
+    edits = {}
+    for pair in tag_pairs:
+        tag, _, value = pair.partition(",")
+        if not tag.strip():
+            raise ValueError(f"Invalid tag: {pair!r}")
+        display = display_species(tag)
+        if operation != 'add':
+            for name in (tag, tag.strip(), fold(tag), canonical_species(tag)):
+                if name != display:
+                    edits.setdefault(name, None)
+        edits[display] = None if operation == 'remove' else int(value)
+    if not edits:
+        raise ValueError("No tags given")
+    return list(edits.items())
+
+# Build the update request shared by every item of the edit
+def build_update(operation, edits):
+    names = {"#tags": "tags", "#file_id": "file_id"}
+    values = {}
+    sets, removes = [], []
+    for idx, (tag, value) in enumerate(edits):
+        names[f"#tg{idx}"] = tag                               # "#tg0" -> "Crow"
+        if value is None:
+            removes.append(f"#tags.#tg{idx}")
+            continue
+        values[f":v{idx}"] = {"N": str(value)}                 # ":v0" -> 5
+        if operation == 'add':
+            # Atomic delta on a map entry (ADD only works on top-level attributes)
+            values[":zero"] = {"N": "0"}
+            sets.append(f"#tags.#tg{idx} = if_not_exists(#tags.#tg{idx}, :zero) + :v{idx}")
+        else:
+            sets.append(f"#tags.#tg{idx} = :v{idx}")
+
+    clauses = []
+    if sets:
+        clauses.append("SET " + ", ".join(sets))
+    if removes:
+        clauses.append("REMOVE " + ", ".join(removes))
+    request = {
+        "TableName": TABLE_NAME,
+        "UpdateExpression": " ".join(clauses),
+        # Only edit files that are in the index
+        "ConditionExpression": "attribute_exists(#file_id)",
+        "ExpressionAttributeNames": names,
+        "ReturnValues": "ALL_OLD",
+    }
+    if values:
+        request["ExpressionAttributeValues"] = values
+    return request
+
+# Build the update for an item without a tags map, where nested paths under
+# #tags are invalid: the map is written whole, unless it appeared meanwhile
+def build_create(operation, edits):
+    tags = apply_tag_edit({}, operation, edits)['tags']
+    return {
+        "TableName": TABLE_NAME,
+        "UpdateExpression": "SET #tags = :tags",
+        "ConditionExpression": "attribute_exists(#file_id) AND attribute_not_exists(#tags)",
+        "ExpressionAttributeNames": {"#tags": "tags", "#file_id": "file_id"},
+        "ExpressionAttributeValues": {":tags": serializer.serialize(tags)},
+        "ReturnValues": "ALL_OLD",
+    }
+
+# Apply a tag edit to a copy of the item it was made on
+def apply_tag_edit(item, operation, edits):
+    tags = dict(item.get('tags', {}))
+    for tag, value in edits:
+        if value is None:
+            tags.pop(tag, None)
+        elif operation == 'add':
+            tags[tag] = tags.get(tag, 0) + value
+        else:
+            tags[tag] = value
+    return {**item, 'tags': tags}
+
+# Whether an update failed because the item has no tags map to update into
+def is_missing_map(error):
+    return (error.response["Error"]["Code"] == "ValidationException"
+            and "document path" in error.response["Error"].get("Message", ""))
+
+# Update one file, retrying throttled and transient failures with jittered
+# exponential backoff; returns the number of retries and whether the species
+# index and statistics were synced
+def update_file(file_id, operation, edits, request, deadline):
+    creating, original = False, request
+    for attempt in range(MAX_ATTEMPTS):
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError("Not attempted before the request deadline")
+        try:
+            response = dynamodb.update_item(Key={"file_id": {"S": file_id}}, **request)
+            break
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if not creating and is_missing_map(e):
+                # No tags map yet: write it whole instead
+                creating, request = True, build_create(operation, edits)
+                continue
+            if code == "ConditionalCheckFailedException":
+                if request is not original:
+                    # The map appeared since: edit it after all
+                    request = original
+                    continue
+                raise LookupError("File is not in the index")
+            if code not in RETRYABLE_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+        except (ConnectionError, HTTPClientError):
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+        time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 2.0)))
+
+    # Sync the species index and statistics with the edited item. The edit
+    # itself is applied by now, so a failure here must not report the file as
+    # failed (a retried 'add' would be applied twice); it is logged for
+    # reconcile_species_stats.py / backfill_species_index.py instead.
+    try:
+        old_item = {k: deserializer.deserialize(v)
+                    for k, v in response.get("Attributes", {}).items()}
+        record_change(file_id, old_item, apply_tag_edit(old_item, operation, edits), bump=False)
+    except Exception as e:
+        logger.error(f"Tags of {file_id} updated, but the species index sync failed: {e}")
+        return attempt, False
+    return attempt, True
+
 def lambda_handler(event, context):
+    metrics = Metrics("lambda_delete_by_tags")
+    # Leave time to report on items that could not be started
+    remaining = API_TIMEOUT_SECONDS
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        remaining = min(remaining, context.get_remaining_time_in_millis() / 1000)
+    deadline = time.monotonic() + remaining - DEADLINE_MARGIN_SECONDS
     try:
-        # Log the incoming event for debugging
-        logger.info(f"Received event: {event}")
+        response = _handle(event, metrics, deadline)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
 
-        # Parse JSON body from API Gateway
-        body = json.loads(event.get('body', '{}'))
-        logger.info(f"Parsed body: {body}")
 
+def _handle(event, metrics, deadline=None):
+    # Validate the whole request before writing anything
+    try:
+        body = json.loads(event.get('body') or '{}')
         urls = body.get('url', [])                      # List of file_ids to update
-        operation = int(body.get('operation', 1))       # Operation: 1 = add/update, 0 = remove
-        tag_pairs = body.get('tags', [])                # e.g., ["Crow,5", "Pigeon,2"]
-        logger.info(f"URLs: {urls}, operation: {operation}, tag_pairs: {tag_pairs}")
-        
-        # Convert tag strings into tuples e.g., ["Crow,5"] -> [("Crow", "5")]
-        tags_to_update = [tuple(t.split(",", 1)) for t in tag_pairs]
-        logger.info(f"tags_to_update: {tags_to_update}")
-
-        # Update DynamoDB entries per URL
-        for url in urls:
-            file_id = extract_file_id(url)
-            logger.info(f"Processing file_id: {file_id}")
-
-            if operation == 1:
-               # Prepare partial update for adding/updating tags
-                update_expr_parts = []
-                expr_names = {"#tags": "tags"}      
-                expr_vals = {}
-
-                for idx, (tag, val_str) in enumerate(tags_to_update):
-                    placeholder_name = f"#tg{idx}"   # e.g. "#tg0"
-                    placeholder_val  = f":v{idx}"    # e.g. ":v0"
-
-                    update_expr_parts.append(f"#tags.{placeholder_name} = {placeholder_val}")
-                    expr_names[placeholder_name] = tag   # "#tg0" -> "Crow"
-                    expr_vals[placeholder_val] = int(val_str)  # ":v0" -> 5
-
-                update_expression = "SET " + ", ".join(update_expr_parts)
-                logger.info(f"UpdateExpression (ADD/UPDATE): {update_expression}")
-                logger.info(f"ExpressionAttributeNames: {expr_names}")
-                logger.info(f"ExpressionAttributeValues: {expr_vals}")
-
-                # Perform the update
-                table.update_item(
-                    Key={'file_id': file_id},
-                    UpdateExpression=update_expression,
-                    ExpressionAttributeNames=expr_names,
-                    ExpressionAttributeValues=expr_vals
-                )
-                logger.info(f"Added/Updated tags for {file_id}")
-
-            # operation == 0, remove specified tags from map
-            else:  
-                remove_expr_parts = []
-                expr_names = {"#tags": "tags"}
-
-                for idx, (tag, _) in enumerate(tags_to_update):
-                    placeholder_name = f"#tg{idx}"    # e.g. "#tg0"
-                    remove_expr_parts.append(f"#tags.{placeholder_name}")
-                    expr_names[placeholder_name] = tag  # "#tg0" -> "Crow"
-
-                update_expression = "REMOVE " + ", ".join(remove_expr_parts)
-                logger.info(f"UpdateExpression (REMOVE): {update_expression}")
-                logger.info(f"ExpressionAttributeNames: {expr_names}")
-
-                # Perform the removal
-                table.update_item(
-                    Key={'file_id': file_id},
-                    UpdateExpression=update_expression,
-                    ExpressionAttributeNames=expr_names
-                )
-                logger.info(f"Removed tags from {file_id}")
-
-        # Successful response
-        logger.info("Done updating tags.")
-        return {
-            'statusCode': 200,
-            'body': json.dumps({'message': 'Tags updated successfully'})
-        }
-
+        operation = OPERATIONS[str(body.get('operation', 1)).lower()]
+        edits = parse_tag_edit(operation, body.get('tags', []))  # e.g. ["Crow,5", "Pigeon,2"]
+        if not isinstance(urls, list) or not urls:
+            raise ValueError("Please provide a non-empty list of URLs")
     except Exception as e:
-        # Log error with stack trace and return 500
-        logger.error("Error during tag update", exc_info=True)
+        logger.warning(f"Invalid tag edit request: {e}")
         return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
+            'statusCode': 400,
+            'body': json.dumps({'error': f"Invalid request: {e}"})
         }
+
+    request = build_update(operation, edits)
+    logger.info(f"Editing tags of {len(urls)} files: {operation} {edits}")
+    logger.debug(f"UpdateExpression: {request['UpdateExpression']}")
+    logger.debug(f"ExpressionAttributeNames: {request['ExpressionAttributeNames']}")
+    logger.debug(f"ExpressionAttributeValues: {request.get('ExpressionAttributeValues')}")
+
+    # Fan the updates out over a bounded pool
+    update_retries = index_sync_errors = 0
+    file_ids = list(dict.fromkeys(extract_file_id(url) for url in urls))
+    result = {"updated": [], "failed": []}
+    with metrics.timer("dynamodb_write"):
+        with ThreadPoolExecutor(max_workers=min(TAG_EDIT_WORKERS, len(file_ids))) as pool:
+            futures = [(file_id, pool.submit(update_file, file_id, operation, edits,
+                                             request, deadline))
+                       for file_id in file_ids]
+            for file_id, future in futures:
+                try:
+                    retries, synced = future.result()
+                    update_retries += retries
+                    index_sync_errors += not synced
+                    result["updated"].append(file_id)
+                except Exception as e:
+                    logger.warning(f"Tag edit failed for {file_id}: {e}")
+                    result["failed"].append({"url": file_id, "error": str(e)})
+        if result["updated"]:
+            bump_version()
+
+    metrics.add("items_updated", len(result["updated"]))
+    metrics.add("errors", len(result["failed"]))
+    metrics.add("update_retries", update_retries)
+    metrics.add("index_sync_errors", index_sync_errors)
+    logger.info(f"Updated {len(result['updated'])} files, {len(result['failed'])} failed")
+
+    # If everything succeeded, return 200; otherwise return 207 (Multi-Status)
+    result["message"] = ("Tags updated successfully" if not result["failed"]
+                         else "Some tag updates failed")
+    return {
+        'statusCode': 200 if not result["failed"] else 207,
+        'body': json.dumps(result)
+    }
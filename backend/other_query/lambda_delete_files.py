@@ -1,11 +1,15 @@
 import json
 import os
 import logging
+import time
 import urllib.parse
 
 import boto3
 from botocore.exceptions import ClientError
 
+from media_index import record_deletes
+from metrics import Metrics
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -13,10 +17,16 @@ logger.setLevel(logging.INFO)
 S3_BUCKET = os.environ.get("S3_BUCKET_NAME")
 DYNAMO_TABLE = os.environ.get("DYNAMO_TABLE_NAME")
 
+# Request size limits of DeleteObjects, BatchGetItem and BatchWriteItem
+S3_DELETE_CHUNK = 1000
+DYNAMO_GET_CHUNK = 100
+DYNAMO_WRITE_CHUNK = 25
+# Attempts per batch while DynamoDB leaves items unprocessed
+MAX_ATTEMPTS = 6
+
 # Initialize boto3 client/resource
 s3_client = boto3.client("s3")
 dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(DYNAMO_TABLE)
 
 
 def extract_s3_key_from_url(url: str) -> str:
@@ -41,35 +51,90 @@ def get_corresponding_thumbnail_key(key: str) -> str | None:
     return None
 
 
-def delete_s3_objects(bucket: str, keys: list[str]):
+def delete_s3_objects(bucket: str, keys: list[str]) -> dict[str, str]:
     """
-    Batch-delete S3 objects. 'keys' is a list of object keys like "Images/crows_1.jpg".
+    Batch-delete S3 objects in requests of up to S3_DELETE_CHUNK keys.
+    'keys' is a list of object keys like "Images/crows_1.jpg".
+    Returns the keys that could not be deleted, mapped to the error message.
     """
-    if not keys:
-        return
-
-    delete_list = [{"Key": k} for k in keys]
-    try:
-        resp = s3_client.delete_objects(
-            Bucket=bucket,
-            Delete={"Objects": delete_list}
-        )
-        logger.info(f"[S3] delete_objects response: {resp}")
-    except ClientError as e:
-        logger.error(f"[S3] Failed to delete objects: {e}")
-        raise
-
-
-def delete_dynamo_item(file_url: str):
+    failed = {}
+    for start in range(0, len(keys), S3_DELETE_CHUNK):
+        chunk = keys[start:start + S3_DELETE_CHUNK]
+        try:
+            resp = s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True}
+            )
+        except ClientError as e:
+            logger.error(f"[S3] Failed to delete objects: {e}")
+            failed.update({k: str(e) for k in chunk})
+            continue
+        # Quiet mode only reports the keys that failed
+        for error in resp.get("Errors", []):
+            failed[error["Key"]] = f"{error.get('Code')}: {error.get('Message')}"
+    logger.info(f"[S3] Deleted {len(keys) - len(failed)} of {len(keys)} objects")
+    return failed
+
+
+def get_dynamo_items(file_urls: list[str]) -> list[dict]:
     """
-    Delete the item from DynamoDB whose partition key 'file_id' matches the full URL.
+    Read the items about to be deleted (BatchGetItem, 100 keys per request),
+    so the species index and statistics can be updated afterwards.
+    Items that cannot be read are still deleted; reconciliation repairs the
+    statistics.
     """
-    try:
-        table.delete_item(Key={"file_id": file_url})
-        logger.info(f"[DynamoDB] Deleted item with file_id = {file_url}")
-    except ClientError as e:
-        logger.error(f"[DynamoDB] Failed to delete record (file_id={file_url}): {e}")
-        raise
+    items = []
+    for start in range(0, len(file_urls), DYNAMO_GET_CHUNK):
+        request = {DYNAMO_TABLE: {
+            "Keys": [{"file_id": url} for url in file_urls[start:start + DYNAMO_GET_CHUNK]],
+            "ProjectionExpression": "file_id, file_type, tags",
+        }}
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                if attempt:
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+                resp = dynamodb.batch_get_item(RequestItems=request)
+                items.extend(resp["Responses"].get(DYNAMO_TABLE, []))
+                request = resp.get("UnprocessedKeys")
+                if not request:
+                    break
+        except ClientError as e:
+            logger.error(f"[DynamoDB] Failed to read records before deletion: {e}")
+            continue
+        if request:
+            logger.warning("[DynamoDB] Some items could not be read before deletion: "
+                           f"{[key['file_id'] for key in request[DYNAMO_TABLE]['Keys']]}")
+    return items
+
+
+def delete_dynamo_items(file_urls: list[str]) -> dict[str, str]:
+    """
+    Delete the items whose partition key 'file_id' matches the full URLs, with
+    BatchWriteItem requests of up to 25 deletes, retrying unprocessed items
+    with backoff.
+    Returns the URLs that could not be deleted, mapped to the error message.
+    """
+    failed = {}
+    for start in range(0, len(file_urls), DYNAMO_WRITE_CHUNK):
+        chunk = file_urls[start:start + DYNAMO_WRITE_CHUNK]
+        request = {DYNAMO_TABLE: [{"DeleteRequest": {"Key": {"file_id": url}}} for url in chunk]}
+        error = "Not deleted after retries (throttled)"
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                if attempt:
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+                resp = dynamodb.batch_write_item(RequestItems=request)
+                request = resp.get("UnprocessedItems")
+                if not request:
+                    break
+        except ClientError as e:
+            # Items processed by earlier attempts are gone; only the rest failed
+            logger.error(f"[DynamoDB] Failed to delete records: {e}")
+            error = str(e)
+        for entry in (request or {}).get(DYNAMO_TABLE, []):
+            failed[entry["DeleteRequest"]["Key"]["file_id"]] = error
+    logger.info(f"[DynamoDB] Deleted {len(file_urls) - len(failed)} of {len(file_urls)} records")
+    return failed
 
 
 def lambda_handler(event, context):
@@ -85,6 +150,19 @@ def lambda_handler(event, context):
       ]
     }
     """
+    metrics = Metrics("lambda_delete_files")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+def _handle(event, metrics):
+    """
+    Delete the files listed in the request body, recording stage timings.
+    """
     logger.info(f"Received event: {json.dumps(event)}")
 
     try:
@@ -104,31 +182,52 @@ def lambda_handler(event, context):
             }
 
         result = {"deleted": [], "failed": []}
-
-        for url in urls:
+        failed = {}
+
+        # 1) Extract the S3 keys; images also lose their thumbnail
+        keys_by_url = {}
+        for url in dict.fromkeys(urls):
+            key = extract_s3_key_from_url(url)
+            if not key:
+                failed[url] = f"Cannot extract key from URL: {url}"
+                continue
+            thumb_key = get_corresponding_thumbnail_key(key)
+            keys_by_url[url] = [key, thumb_key] if thumb_key else [key]
+
+        # 2) Delete every object in as few requests as possible
+        with metrics.timer("s3_delete"):
+            failed_keys = delete_s3_objects(
+                S3_BUCKET, [k for keys in keys_by_url.values() for k in keys])
+        for url, keys in keys_by_url.items():
+            errors = [failed_keys[k] for k in keys if k in failed_keys]
+            if errors:
+                failed[url] = "; ".join(errors)
+
+        # 3) Delete the records of files whose objects are gone, keeping the
+        #    old items for the species index and statistics
+        remaining = [url for url in keys_by_url if url not in failed]
+        with metrics.timer("dynamodb_read"):
+            old_items = get_dynamo_items(remaining)
+        with metrics.timer("dynamodb_write"):
+            failed.update(delete_dynamo_items(remaining))
+            deleted_items = [item for item in old_items if item["file_id"] not in failed]
             try:
-                # 1) Extract the S3 key
-                key = extract_s3_key_from_url(url)
-                if not key:
-                    raise ValueError(f"Cannot extract key from URL: {url}")
-
-                # 2) If it's an image, attempt to delete its thumbnail as well
-                thumb_key = get_corresponding_thumbnail_key(key)
-
-                # 3) Delete the original file and thumbnail (if exists) from S3
-                keys_to_delete = [key]
-                if thumb_key:
-                    keys_to_delete.append(thumb_key)
-                delete_s3_objects(S3_BUCKET, keys_to_delete)
-
-                # 4) Delete the record from DynamoDB (partition key is the full URL)
-                delete_dynamo_item(url)
-
+                record_deletes(deleted_items)
+            except Exception as e:
+                # The files are deleted either way; reconcile_species_stats.py
+                # and backfill_species_index.py repair the index
+                logger.error("[DynamoDB] Species index not updated for deleted files "
+                             f"{[item['file_id'] for item in deleted_items]}: {e}")
+
+        for url in dict.fromkeys(urls):
+            if url in failed:
+                logger.error(f"Error during deletion: {url} → {failed[url]}")
+                result["failed"].append({"url": url, "error": failed[url]})
+            else:
                 result["deleted"].append(url)
 
-            except Exception as e:
-                logger.exception(f"Error during deletion: {url} → {e}")
-                result["failed"].append({"url": url, "error": str(e)})
+        metrics.add("items_deleted", len(result["deleted"]))
+        metrics.add("errors", len(result["failed"]))
 
         # If everything succeeded, return 200; otherwise return 207 (Multi-Status)
         status_code = 200 if not result["failed"] else 207
@@ -1,20 +1,38 @@
 import json
-import boto3
 import logging
 import os
 
+from media_index import normalize_species, query_species
+from metrics import Metrics
+from query_cache import QueryCache
+
 # Set logging level from environment variable (default to INFO)
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 logger = logging.getLogger()
 logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 
+# Results of recent searches, kept for the life of the container
+query_cache = QueryCache()
+
 
 def lambda_handler(event, context):
+    metrics = Metrics("lambda_query_species")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+def _handle(event, metrics):
     logger.info("Lambda started")
 
     # Extract 'species' parameter from query string
     try:
-        species = event["queryStringParameters"]["species"].lower()  
+        species = normalize_species(event["queryStringParameters"]["species"])
+        if not species:
+            raise ValueError("empty species")
         logger.info(f"Searching for species: {species}")
     except Exception as e:
         # Return error if 'species' parameter is missing or invalid
@@ -23,30 +41,28 @@ def lambda_handler(event, context):
             "body": json.dumps({"error": "Missing or invalid 'species' parameter"})
         }
 
-    dynamodb = boto3.resource("dynamodb")
-    table = dynamodb.Table("BirdTagMediaIndex")
-
-    # Scan entire table
-    all_items = []
-    response = table.scan()
-    all_items.extend(response.get("Items", []))
-
-    # Handle pagination (continue scanning if there are more items)
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        all_items.extend(response.get("Items", []))
+    # Serve repeated searches from memory
+    with metrics.timer("cache_lookup"):
+        cached = query_cache.get(("species", species))
+    if cached is not None:
+        metrics.add("cache_hit", 1)
+        return {
+            "statusCode": 200,
+            "body": cached
+        }
 
-    matched = []
+    # Read the postings of the species from the inverted index
+    with metrics.timer("dynamodb_read"):
+        postings = query_species(species)
+    matched = [posting["file_id"] for posting in postings]  # file_id is a URL
 
-    # Filter items based on the presence of the species tag
-    for item in all_items:
-        tags = item.get("tags", {})
-        lower_tags = {k.lower(): v for k, v in tags.items()}
-        if species in lower_tags:  # Check if species tag exists
-            matched.append(item["file_id"])  # file_id is a URL
+    metrics.add("items_matched", len(matched))
 
     # Return matched URLs
+    with metrics.timer("json_serialize"):
+        response_body = json.dumps({"links": matched})
+    query_cache.put(("species", species), response_body)
     return {
         "statusCode": 200,
-        "body": json.dumps({"links": matched})
+        "body": response_body
     }
@@ -1,27 +1,159 @@
+import base64
+import heapq
 import json
-import boto3
 import logging
 import os
+from itertools import islice
+
+from media_index import PostingList, get_postings, normalize_species
+from metrics import Metrics
+from query_cache import QueryCache
 
 # Configure logging based on environment variable, default to INFO
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 logger = logging.getLogger()
 logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 
+# Candidate files checked per round of BatchGetItem probes
+PROBE_CHUNK = 100
+# Largest page a request may ask for
+MAX_LIMIT = 1000
+
+# Results of recent searches, kept for the life of the container
+query_cache = QueryCache()
+
+
 def lambda_handler(event, context):
+    metrics = Metrics("lambda_query_tags")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+# Parse {"crow": 2, ...} or ["crow", ...] into normalized species -> min count
+def parse_conditions(conditions, default_count):
+    if isinstance(conditions, list):
+        conditions = {tag: default_count for tag in conditions}
+    parsed = {}
+    for tag, min_count in conditions.items():
+        species = normalize_species(tag)
+        if not species:
+            raise ValueError(f"Invalid tag: {tag!r}")
+        # The same species written twice keeps the stricter condition
+        parsed[species] = max(int(min_count), parsed.get(species, 0))
+    return parsed
+
+
+# Parse the request body. The legacy form is the tag map itself; the
+# extended form puts it under "tags" next to the query options.
+def parse_query(body):
+    if "tags" not in body:
+        body = {"tags": body}
+    query = {
+        "tags": parse_conditions(body["tags"], 1),
+        "operator": str(body.get("operator", "and")).lower(),
+        "exclude": parse_conditions(body.get("exclude", {}), 1),
+        "file_type": body.get("file_type"),
+        "limit": body.get("limit"),
+        "after": decode_cursor(body["cursor"]) if body.get("cursor") else None,
+    }
+    if not query["tags"]:
+        raise ValueError("At least one tag is required")
+    if query["operator"] not in ("and", "or"):
+        raise ValueError(f"Unknown operator: {query['operator']}")
+    if query["limit"] is not None:
+        query["limit"] = max(1, min(int(query["limit"]), MAX_LIMIT))
+    return query
+
+
+# Opaque continuation token: the last file_id returned
+def encode_cursor(file_id):
+    return base64.urlsafe_b64encode(json.dumps({"after": file_id}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))["after"]
+
+
+# Posting passes a min-count condition
+def _passes(posting, min_count):
+    return posting is not None and posting["count"] >= min_count
+
+
+# Read the lists a page at a time, in turn, until one is exhausted; that
+# list is the most selective and drives the intersection
+def _most_selective(lists):
+    while True:
+        for posting_list in lists:
+            posting_list.fetch()
+            if posting_list.done:
+                return posting_list
+
+
+# AND: walk the most selective list and check each file against the
+# others, from pages already read where possible, otherwise by BatchGetItem
+def and_candidates(lists, conditions, stats):
+    driver = _most_selective(lists)
+    others = [posting_list for posting_list in lists if posting_list is not driver]
+    file_ids = iter(sorted(driver.postings))
+    while True:
+        chunk = list(islice(file_ids, PROBE_CHUNK))
+        if not chunk:
+            return
+        probe = [(posting_list.species, file_id) for posting_list in others
+                 for file_id in chunk if not posting_list.covers(file_id)]
+        found = get_postings(probe)
+        stats["postings_probed"] += len(probe)
+        for file_id in chunk:
+            if all(file_id in posting_list.postings if posting_list.covers(file_id)
+                   else _passes(found.get((posting_list.species, file_id)),
+                                conditions[posting_list.species])
+                   for posting_list in others):
+                yield file_id
+
+
+# OR: merge the sorted lists, dropping duplicates
+def or_candidates(lists):
+    last = None
+    for file_id in heapq.merge(*[(posting["file_id"] for posting in posting_list)
+                                 for posting_list in lists]):
+        if file_id != last:
+            last = file_id
+            yield file_id
+
+
+# Take up to `limit` candidates, dropping files that match an excluded tag
+def collect(candidates, exclude, limit, stats):
+    links = []
+    while limit is None or len(links) < limit:
+        size = PROBE_CHUNK if limit is None else min(PROBE_CHUNK, limit - len(links))
+        chunk = list(islice(candidates, size))
+        if not chunk:
+            break
+        if exclude:
+            probe = [(species, file_id) for species in exclude for file_id in chunk]
+            found = get_postings(probe)
+            stats["postings_probed"] += len(probe)
+            chunk = [file_id for file_id in chunk
+                     if not any(_passes(found.get((species, file_id)), min_count)
+                                for species, min_count in exclude.items())]
+        links.extend(chunk)
+    return links
+
+
+def _handle(event, metrics):
     logger.info("Lambda started")
 
-    print(f"event['body']: {event.get('body')}")
+    logger.debug(f"Request body: {event.get('body')}")
 
     # Parse the request body
     try:
-        print(event)
         body = json.loads(event["body"])
-        if "tags" in body:
-            tag_conditions = body["tags"]
-        else:
-            tag_conditions = body
-        logger.info(f"Received tags: {tag_conditions}")
+        query = parse_query(body)
+        logger.info(f"Received query: {query}")
     except Exception as e:
         logger.error(f"Failed to parse request body: {str(e)}")
         return {
@@ -29,57 +161,44 @@ def lambda_handler(event, context):
             "body": json.dumps({"error": "Invalid request format"})
         }
 
-    # Initialize DynamoDB connection and access the BirdTagMediaIndex table
-    dynamodb = boto3.resource("dynamodb")
-    table = dynamodb.Table("BirdTagMediaIndex")
-
-    # Scan the entire table
-    all_items = []
-    response = table.scan()
-    all_items.extend(response.get("Items", []))
-    matched_links = []
-
-    # Continue scanning if there are more items (pagination)
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        all_items.extend(response.get("Items", []))
-
-    # Evaluate each item against provided tag conditions
-    for item in all_items:
-        tags = item.get("tags", {})
-        print(f"[DEBUG] tags: {tags}")
-        logger.debug(f"Checking item: {item['file_id']} with tags: {tags}")
-
-        match = True
-        for tag, min_count in tag_conditions.items():
-            # If the tag is not present in the item's tags, or the value is insufficient, mark as no match
-            if tag not in tags:
-                match = False
-                break
-            try:
-                # Handle Decimal or DynamoDB number types
-                tag_value = tags[tag]
-                if isinstance(tag_value, dict) and "N" in tag_value:
-                    tag_value = int(tag_value["N"])
-                else:
-                    tag_value = int(tag_value)
-                if tag_value < min_count:
-                    match = False
-                    break
-            except Exception as e:
-                logger.warning(f"Tag value error for {tag}: {tags.get(tag)} - {e}")
-                match = False
-                break
-
-
-        if match:
-            matched_links.append(item["file_id"])  # file_id is an S3 URLL
+    # Serve repeated searches from memory
+    cache_key = ("tags", json.dumps(query, sort_keys=True))
+    with metrics.timer("cache_lookup"):
+        cached = query_cache.get(cache_key)
+    if cached is not None:
+        metrics.add("cache_hit", 1)
+        return {
+            "statusCode": 200,
+            "body": cached
+        }
+
+    # One posting list per tag, filtered by min count and file type
+    conditions = query["tags"]
+    lists = [PostingList(species, min_count, query["file_type"], query["after"])
+             for species, min_count in conditions.items()]
+    stats = {"postings_probed": 0}
 
+    with metrics.timer("dynamodb_read"):
+        if query["operator"] == "and" and len(lists) > 1:
+            candidates = and_candidates(lists, conditions, stats)
+        else:
+            # OR, or a single tag: merge the lists lazily
+            candidates = or_candidates(lists)
+        matched_links = collect(candidates, query["exclude"], query["limit"], stats)
+    metrics.add("postings_read", sum(len(posting_list.postings) for posting_list in lists))
+    metrics.add("postings_probed", stats["postings_probed"])
 
     logger.info(f"Final response: {matched_links}")
+    metrics.add("items_matched", len(matched_links))
 
-    # Return matched file URLs
+    # Return matched file URLs, with a cursor while pages come back full
+    response = {"links": matched_links}
+    if query["limit"] is not None and len(matched_links) == query["limit"]:
+        response["cursor"] = encode_cursor(matched_links[-1])
+    with metrics.timer("json_serialize"):
+        response_body = json.dumps(response)
+    query_cache.put(cache_key, response_body)
     return {
         "statusCode": 200,
-        "body": json.dumps({"links": matched_links})
+        "body": response_body
     }
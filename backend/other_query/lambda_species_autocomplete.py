@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from media_index import stats_table
+from metrics import Metrics
+from species_names import SpeciesNames
+
+# Set logging level from environment variable (default to INFO)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logger = logging.getLogger()
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+# Suggestions returned by default, and the most a request may ask for
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Seconds before the species in the index are read again
+VOCABULARY_TTL_SECONDS = float(os.environ.get("VOCABULARY_TTL_SECONDS", "3600"))
+
+# Vocabulary and the monotonic time it was built, kept for the container
+_vocabulary = None
+_built_at = 0.0
+
+
+# Species keys in the statistics table, so names the detectors store (YOLO
+# classes, tags entered by hand) are suggested along with the labels
+def stored_species():
+    table = stats_table()
+    if table is None:
+        return set()
+    kwargs = {"ProjectionExpression": "species"}
+    species = set()
+    try:
+        while True:
+            response = table.scan(**kwargs)
+            species.update(row["species"] for row in response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return species
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except ClientError as e:
+        logger.warning(f"Could not read the stored species: {e}")
+        return species
+
+
+# Build the vocabulary on first use and again once it is older than the TTL
+def vocabulary():
+    global _vocabulary, _built_at
+    if _vocabulary is None or time.monotonic() - _built_at > VOCABULARY_TTL_SECONDS:
+        _vocabulary = SpeciesNames.load(species=stored_species())
+        _built_at = time.monotonic()
+    return _vocabulary
+
+
+def lambda_handler(event, context):
+    metrics = Metrics("lambda_species_autocomplete")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+def _handle(event, metrics):
+    # Extract 'q' (text typed so far) and optional 'limit' from the query string
+    try:
+        params = event.get("queryStringParameters") or {}
+        text = params.get("q", "")
+        limit = max(1, min(int(params.get("limit") or DEFAULT_LIMIT), MAX_LIMIT))
+    except Exception as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": f"Invalid autocomplete parameters: {e}"})
+        }
+
+    # The vocabulary is built on the first request of a container
+    with metrics.timer("vocabulary_load"):
+        names = vocabulary()
+    with metrics.timer("lookup"):
+        suggestions = names.complete(text, limit)
+    metrics.add("items_matched", len(suggestions))
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"suggestions": suggestions})
+    }
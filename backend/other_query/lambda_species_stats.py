@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+
+from boto3.dynamodb.conditions import Key
+
+from media_index import normalize_species, stats_table
+from metrics import Metrics
+from query_cache import QueryCache
+
+# Set logging level from environment variable (default to INFO)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logger = logging.getLogger()
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+# Results of recent requests, kept for the life of the container
+query_cache = QueryCache()
+
+
+def lambda_handler(event, context):
+    metrics = Metrics("lambda_species_stats")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+# Read the statistics rows of one species, or of every species
+def read_rows(species=None):
+    if species:
+        kwargs = {"KeyConditionExpression": Key("species").eq(species)}
+        read = stats_table().query
+    else:
+        kwargs = {}
+        read = stats_table().scan
+    rows = []
+    while True:
+        response = read(**kwargs)
+        rows.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return rows
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+# Group rows into per-species files/birds counts by file type
+def summarize(rows, file_type=None):
+    summary = {}
+    totals = {"files": 0, "birds": 0}
+    for row in rows:
+        if file_type and row["file_type"] != file_type:
+            continue
+        files, birds = int(row.get("files", 0)), int(row.get("birds", 0))
+        # Rows decremented to zero stay until the next reconciliation
+        if files <= 0:
+            continue
+        entry = summary.setdefault(row["species"], {
+            "species": row["species"], "files": 0, "birds": 0, "by_type": {}})
+        entry["files"] += files
+        entry["birds"] += birds
+        entry["by_type"][row["file_type"]] = {"files": files, "birds": birds}
+        totals["files"] += files
+        totals["birds"] += birds
+    species = sorted(summary.values(), key=lambda entry: (-entry["files"], entry["species"]))
+    return {"species": species, "totals": totals}
+
+
+def _handle(event, metrics):
+    # Optional filters: species=<name>, file_type=image|video|audio
+    params = event.get("queryStringParameters") or {}
+    species = normalize_species(params.get("species", ""))
+    file_type = params.get("file_type")
+
+    cache_key = ("stats", species, file_type)
+    with metrics.timer("cache_lookup"):
+        cached = query_cache.get(cache_key)
+    if cached is not None:
+        metrics.add("cache_hit", 1)
+        return {
+            "statusCode": 200,
+            "body": cached
+        }
+
+    try:
+        with metrics.timer("dynamodb_read"):
+            rows = read_rows(species)
+        metrics.add("items_scanned", len(rows))
+    except Exception as e:
+        logger.error(f"Failed to read species statistics: {e}", exc_info=True)
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
+
+    with metrics.timer("json_serialize"):
+        response_body = json.dumps(summarize(rows, file_type))
+    query_cache.put(cache_key, response_body)
+    return {
+        "statusCode": 200,
+        "body": response_body
+    }
@@ -0,0 +1,110 @@
+# Import libraries
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from media_index import read_version
+
+# Set up the logger
+logger = logging.getLogger()
+
+# Bounds of the per-container result cache
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_BYTES = int(os.environ.get("QUERY_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Seconds a cached result may be served at most
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "60"))
+# Seconds between reads of the index version counter
+QUERY_CACHE_VERSION_INTERVAL = float(os.environ.get("QUERY_CACHE_VERSION_INTERVAL", "5"))
+
+
+# Read-through cache of serialized query results
+class QueryCache:
+    """
+    LRU of response bodies keyed by normalized query, bounded by entry
+    count and total size, with a TTL per entry.
+
+    The whole cache is dropped when the index version counter, which every
+    ingest, tag edit and delete bumps, has moved. The counter is read at
+    most every `version_interval` seconds, so a write shows up within that
+    interval (or the TTL if the counter is unavailable).
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, max_bytes=QUERY_CACHE_BYTES,
+                 ttl=QUERY_CACHE_TTL, version_interval=QUERY_CACHE_VERSION_INTERVAL):
+        """
+        Args:
+            max_entries (int): Most results kept, 0 to disable the cache.
+            max_bytes (int): Most characters of results kept.
+            ttl (float): Seconds a result is served for.
+            version_interval (float): Seconds between version checks.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.version = None
+        self._checked_at = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _check_version(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.version_interval:
+            return
+        self._checked_at = now
+        try:
+            version = read_version()
+        except Exception as e:
+            # Fall back to the TTL alone
+            logger.warning(f"Index version read failed: {e}")
+            return
+        if version != self.version:
+            if self._entries:
+                logger.info(f"Index version {self.version} -> {version}, dropping query cache")
+            self.clear()
+            self.version = version
+
+    def _drop(self, key):
+        _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def get(self, key):
+        """
+        Args:
+            key (tuple): Normalized query.
+
+        Returns:
+            str: Cached response body, or None on a miss.
+        """
+        if self.max_entries <= 0:
+            return None
+        self._check_version()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, body = entry
+        if time.monotonic() >= expires_at:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return body
+
+    def put(self, key, body):
+        """
+        Args:
+            key (tuple): Normalized query.
+            body (str): Serialized response body.
+        """
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, body)
+        self._bytes += len(body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
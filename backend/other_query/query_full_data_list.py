@@ -1,47 +1,131 @@
+import base64
 import json
+import os
+
 import boto3
-from decimal import Decimal
 
-# Initialize DynamoDB resource and reference the table
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('BirdTagMediaIndex')
+from metrics import Metrics
+from query_cache import QueryCache
+
+# Low-level client: items come back as typed attribute values, which are
+# converted straight to JSON types instead of going through Decimal
+dynamodb = boto3.client('dynamodb')
+TABLE_NAME = 'BirdTagMediaIndex'
+
+# Items read per page by default, and the most a request may ask for
+DEFAULT_LIMIT = int(os.environ.get("LIST_PAGE_SIZE", "50"))
+MAX_LIMIT = 500
+
+# Recently served pages, kept for the life of the container
+query_cache = QueryCache()
+
+# Convert a DynamoDB attribute value ({"S": ...}, {"N": ...}, {"M": ...}) to JSON types
+def plain_value(value):
+    (kind, data), = value.items()
+    if kind == "N":
+        return int(data) if data.lstrip("-").isdigit() else float(data)
+    if kind == "M":
+        return {k: plain_value(v) for k, v in data.items()}
+    if kind == "L":
+        return [plain_value(v) for v in data]
+    if kind == "NULL":
+        return None
+    return data
 
-# Custom converter to handle Decimal values in DynamoDB (for JSON serialization)
-def default_converter(o):
-    if isinstance(o, Decimal):
-        return float(o)
-    raise TypeError(f"Object of type {type(o)} is not JSON serializable")
+# Opaque continuation token wrapping the scan's LastEvaluatedKey
+def encode_token(last_key):
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+def decode_token(token):
+    return json.loads(base64.urlsafe_b64decode(token.encode()))
+
+# Build the Scan request of one page
+def scan_request(params):
+    limit = int(params.get("limit") or DEFAULT_LIMIT)
+    request = {
+        "TableName": TABLE_NAME,
+        "Limit": max(1, min(limit, MAX_LIMIT)),
+        "ProjectionExpression": "file_id, file_type, tags",
+    }
+    filters, values = [], {}
+    if params.get("file_type"):
+        filters.append("file_type = :file_type")
+        values[":file_type"] = {"S": params["file_type"]}
+    if params.get("prefix"):
+        filters.append("begins_with(file_id, :prefix)")
+        values[":prefix"] = {"S": params["prefix"]}
+    if filters:
+        request["FilterExpression"] = " AND ".join(filters)
+        request["ExpressionAttributeValues"] = values
+    if params.get("next_token"):
+        request["ExclusiveStartKey"] = decode_token(params["next_token"])
+    return request
+
+# HTTP 200 response carrying a serialized page
+def _page_response(response_body):
+    return {
+        'statusCode': 200,
+        'headers': {
+            "Access-Control-Allow-Origin": "*",
+            "Content-Type": "application/json"
+        },
+        'body': response_body
+    }
 
 def lambda_handler(event, context):
+    metrics = Metrics("query_full_data_list")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+def _handle(event, metrics):
+    # Query string: limit, next_token, file_type, prefix. Non-proxy
+    # integrations must map them under "queryStringParameters" as well.
+    params = event.get("queryStringParameters") or {}
+
     try:
-        items = []
-        # Initial scan of the table (returns up to 1MB of data)
-        response = table.scan()
-        items.extend(response.get('Items', []))
-
-        # Continue scanning if more data exists (pagination)
-        while 'LastEvaluatedKey' in response:
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-            items.extend(response.get('Items', []))
-
-        # Extract and reformat only the needed fields from each item
-        cleaned_items = []
-        for item in items:
-            cleaned_items.append({
-                "file_id": item.get("file_id"),
-                "file_type": item.get("file_type"),
-                "tags": item.get("tags")
-            })
-
-        # Return HTTP 200 with the cleaned data
+        request = scan_request(params)
+    except Exception as e:
         return {
-            'statusCode': 200,
-            'headers': {
-                "Access-Control-Allow-Origin": "*",
-                "Content-Type": "application/json"
-            },
-            'body': json.dumps(cleaned_items, default=default_converter)
+            'statusCode': 400,
+            'body': json.dumps({'error': f"Invalid paging parameters: {e}"})
+        }
+
+    try:
+        # Serve repeated page requests from memory
+        cache_key = ("list", json.dumps(request, sort_keys=True))
+        with metrics.timer("cache_lookup"):
+            response_body = query_cache.get(cache_key)
+        if response_body is not None:
+            metrics.add("cache_hit", 1)
+            return _page_response(response_body)
+
+        # Read one page (at most `limit` items before filtering)
+        with metrics.timer("dynamodb_read"):
+            response = dynamodb.scan(**request)
+        metrics.add("items_scanned", response.get("ScannedCount", 0))
+
+        page = {
+            "items": [{k: plain_value(v) for k, v in item.items()}
+                      for item in response.get("Items", [])],
+            "next_token": None,
         }
+        if "LastEvaluatedKey" in response:
+            page["next_token"] = encode_token(response["LastEvaluatedKey"])
+        metrics.add("items_matched", len(page["items"]))
+
+        # Serialize before building the response so it can be timed
+        with metrics.timer("json_serialize"):
+            response_body = json.dumps(page)
+        metrics.add("response_bytes", len(response_body), "Bytes")
+        query_cache.put(cache_key, response_body)
+
+        # Return HTTP 200 with the page of items
+        return _page_response(response_body)
 
     except Exception as e:
         # Return HTTP 500 if an error occurs
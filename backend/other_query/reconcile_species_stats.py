@@ -0,0 +1,85 @@
+# Import libraries
+import argparse
+import json
+
+import boto3
+
+from backfill_species_index import scan_media
+from media_index import (PENDING_ATTRIBUTE, SPECIES_STATS_TABLE, bump_version, species_counts,
+                         stats_table, stats_type)
+
+
+# Function: Recompute the statistics rows from the media index; also
+# returns the files marked with a pending sync by write_media
+def compute_stats(table, page_size):
+    stats = {}
+    pending = []
+    for item in scan_media(table, page_size):
+        if PENDING_ATTRIBUTE in item:
+            pending.append(item['file_id'])
+        file_type = stats_type(item.get('file_type'))
+        for species, count in species_counts(item.get('tags')).items():
+            row = stats.setdefault((species, file_type), {'files': 0, 'birds': 0})
+            row['files'] += 1
+            row['birds'] += count
+    return stats, pending
+
+
+# Function: Clear pending-sync markers once the statistics are recomputed
+def clear_pending(table, file_ids):
+    for file_id in file_ids:
+        table.update_item(Key={'file_id': file_id}, UpdateExpression='REMOVE #pending',
+                          ExpressionAttributeNames={'#pending': PENDING_ATTRIBUTE})
+
+
+# Function: Read the statistics rows as they are
+def read_stats():
+    stats = {}
+    kwargs = {}
+    while True:
+        response = stats_table().scan(**kwargs)
+        for row in response.get('Items', []):
+            stats[(row['species'], row['file_type'])] = {
+                'files': int(row.get('files', 0)), 'birds': int(row.get('birds', 0))}
+        if 'LastEvaluatedKey' not in response:
+            return stats
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=f"Recompute {SPECIES_STATS_TABLE} from the media index and "
+                    "overwrite rows that drifted. Counters updated while it runs "
+                    "may be overwritten, so run it when uploads are quiet.")
+    parser.add_argument("--table", default="BirdTagMediaIndex", help="Media index table")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report the drift without writing")
+    args = parser.parse_args()
+
+    table = boto3.resource('dynamodb').Table(args.table)
+    expected, pending = compute_stats(table, args.page_size)
+    current = read_stats()
+    # Rows that are wrong, and rows no file accounts for any more
+    drifted = {key: row for key, row in expected.items() if current.get(key) != row}
+    stale = [key for key in current if key not in expected]
+
+    if not args.dry_run and (drifted or stale):
+        with stats_table().batch_writer() as batch:
+            for (species, file_type), row in drifted.items():
+                batch.put_item(Item={'species': species, 'file_type': file_type, **row})
+            for species, file_type in stale:
+                batch.delete_item(Key={'species': species, 'file_type': file_type})
+        bump_version()
+    # The statistics now match every file, so marked deltas must not be
+    # applied again by the next write
+    if not args.dry_run:
+        clear_pending(table, pending)
+
+    print(json.dumps({
+        "rows": len(expected),
+        "drifted": [f"{species}/{file_type}" for species, file_type in drifted],
+        "stale": [f"{species}/{file_type}" for species, file_type in stale],
+        "pending": len(pending),
+        "dry_run": args.dry_run,
+    }))
@@ -0,0 +1,529 @@
+# Import libraries
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import wait
+
+import numpy as np
+
+# BirdNET input: 3-second windows of mono audio at 48 kHz
+SAMPLE_RATE = 48000
+WINDOW_SECONDS = 3.0
+WINDOW_SAMPLES = int(SAMPLE_RATE * WINDOW_SECONDS)
+# A trailing window shorter than this is dropped, a longer one zero-padded
+MIN_WINDOW_SECONDS = 1.5
+# Windows stacked into one interpreter invocation
+BATCH_SIZE = int(os.environ.get("BIRDNET_BATCH_SIZE", "16"))
+# Interpreter threads (0 uses every available CPU)
+THREADS = int(os.environ.get("BIRDNET_THREADS", "0"))
+# Run float ops through the XNNPACK delegate
+USE_XNNPACK = os.environ.get("BIRDNET_XNNPACK", "1") != "0"
+# Worker processes of the parallel engine
+WORKERS = int(os.environ.get("AUDIO_WORKERS", str(os.cpu_count() or 1)))
+# Shards queued per worker, so decoding stays ahead of inference
+SHARDS_IN_FLIGHT = 2
+# Seconds of source audio decoded per block when streaming
+BLOCK_SECONDS = float(os.environ.get("AUDIO_BLOCK_SECONDS", "30"))
+
+# Activity gate: 'off', 'on' (skip inactive windows) or 'validate' (score
+# every window and report detections the gate would have dropped)
+GATE_MODE = os.environ.get("AUDIO_GATE", "off")
+# A window is inactive if its bird-band level is below this (dBFS) ...
+GATE_ENERGY_DB = float(os.environ.get("AUDIO_GATE_ENERGY_DB", "-60"))
+# ... or its mean normalized spectral flux is below this (0-1)
+GATE_FLUX = float(os.environ.get("AUDIO_GATE_FLUX", "0.05"))
+# Frequency band most bird vocalizations fall in
+GATE_BAND_HZ = (1000, 10000)
+# FFT frame length and number of sub-bands the band is summed into
+GATE_FRAME = 1024
+GATE_SUBBANDS = 16
+
+
+# Function: Load the TFLite interpreter class
+def _interpreter_module():
+    """
+    Prefer the standalone tflite-runtime and fall back to TensorFlow, as
+    birdnetlib does.
+    """
+    try:
+        import tflite_runtime.interpreter as tflite
+    except ImportError:
+        from tensorflow import lite as tflite
+    return tflite
+
+
+# Function: Split a signal into BirdNET windows
+def split_windows(signal, start_index=0):
+    """
+    Cut a signal into consecutive 3-second windows the way birdnetlib does:
+    a short tail is zero-padded, or dropped if under MIN_WINDOW_SECONDS.
+
+    Args:
+        signal (ndarray): Mono float32 samples at SAMPLE_RATE.
+        start_index (int): Index of the first window, for its timestamps.
+
+    Yields:
+        tuple: (window index, float32 array of WINDOW_SAMPLES samples).
+    """
+    min_samples = int(MIN_WINDOW_SECONDS * SAMPLE_RATE)
+    for offset in range(0, len(signal), WINDOW_SAMPLES):
+        window = signal[offset:offset + WINDOW_SAMPLES]
+        if len(window) < min_samples:
+            break
+        if len(window) < WINDOW_SAMPLES:
+            window = np.pad(window, (0, WINDOW_SAMPLES - len(window)))
+        yield start_index + offset // WINDOW_SAMPLES, window
+
+
+# Function: Decode and resample an audio file block by block into windows
+def stream_windows(source, block_seconds=BLOCK_SECONDS, stats=None):
+    """
+    Decode an audio file incrementally and yield BirdNET windows as soon as
+    enough resampled audio is available.
+
+    Blocks of `block_seconds` are read with soundfile, mixed down to mono
+    and resampled to SAMPLE_RATE with a streaming soxr resampler, whose
+    filter state carries across block boundaries. Samples left over after
+    the last full window are kept for the next block, so memory is bounded
+    by one block plus one window whatever the file length. The tail is
+    handled as in split_windows.
+
+    Args:
+        source (str or file): Path or binary file object soundfile can read
+            (WAV, FLAC, OGG, and MP3 with libsndfile >= 1.1).
+        block_seconds (float): Source audio decoded per block.
+        stats (dict): Optional dict; "decode_time" is incremented with the
+            time spent reading and resampling.
+
+    Yields:
+        tuple: (window index, float32 array of WINDOW_SAMPLES samples).
+    """
+    import soundfile as sf
+    import soxr
+
+    decode_time = 0.0
+    start = time.perf_counter()
+    with sf.SoundFile(source) as audio:
+        resampler = None
+        if audio.samplerate != SAMPLE_RATE:
+            resampler = soxr.ResampleStream(audio.samplerate, SAMPLE_RATE, 1,
+                                            dtype="float32", quality="HQ")
+        blocksize = max(1, int(block_seconds * audio.samplerate))
+        pending = np.zeros(0, dtype=np.float32)
+        index = 0
+        finished = False
+        while not finished:
+            block = audio.read(blocksize, dtype="float32", always_2d=True)
+            finished = len(block) < blocksize
+            mono = block.mean(axis=1, dtype=np.float32)
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=finished)
+            pending = np.concatenate([pending, mono])
+
+            # Emit every complete window, keep the remainder
+            complete = len(pending) // WINDOW_SAMPLES
+            decode_time += time.perf_counter() - start
+            for i in range(complete):
+                yield index, pending[i * WINDOW_SAMPLES:(i + 1) * WINDOW_SAMPLES]
+                index += 1
+            start = time.perf_counter()
+            pending = pending[complete * WINDOW_SAMPLES:].copy()
+
+    decode_time += time.perf_counter() - start
+    if stats is not None:
+        stats["decode_time"] = stats.get("decode_time", 0.0) + decode_time
+    # Short tail: padded or dropped like birdnetlib
+    yield from split_windows(pending, start_index=index)
+
+
+# Function: Measure the bird-band activity of a window
+def window_activity(window):
+    """
+    Compute the level and spectral flux of a window in GATE_BAND_HZ.
+
+    The window is cut into non-overlapping Hann-weighted frames of
+    GATE_FRAME samples. Band power gives the RMS level; flux is the
+    positive frame-to-frame change of GATE_SUBBANDS sub-band magnitudes,
+    normalized by their total, so steady noise (wind, hum, rain) scores
+    low even when loud.
+
+    Args:
+        window (ndarray): WINDOW_SAMPLES float32 samples.
+
+    Returns:
+        tuple: (band level in dBFS, mean normalized flux).
+    """
+    frames = window[:len(window) // GATE_FRAME * GATE_FRAME].reshape(-1, GATE_FRAME)
+    taper = np.hanning(GATE_FRAME).astype(np.float32)
+    spectrum = np.abs(np.fft.rfft(frames * taper, axis=1))
+
+    low, high = (int(hz * GATE_FRAME / SAMPLE_RATE) for hz in GATE_BAND_HZ)
+    band = spectrum[:, low:high]
+
+    # Parseval: one-sided band power per frame as a mean square
+    power = 2 * (band ** 2).sum(axis=1) / (GATE_FRAME * (taper ** 2).sum())
+    level_db = 10 * np.log10(power.mean() + 1e-12)
+
+    edges = np.linspace(0, band.shape[1], GATE_SUBBANDS + 1).astype(int)[:-1]
+    subbands = np.add.reduceat(band, edges, axis=1)
+    rise = np.maximum(subbands[1:] - subbands[:-1], 0).sum(axis=1)
+    flux = (rise / (subbands[1:].sum(axis=1) + 1e-9)).mean() if len(subbands) > 1 else 0.0
+    return float(level_db), float(flux)
+
+
+# Function: Mark or drop windows without bird-band activity
+def gate_windows(windows, mode=GATE_MODE, energy_db=GATE_ENERGY_DB, flux=GATE_FLUX,
+                 stats=None):
+    """
+    Pass (index, window) pairs through the activity gate.
+
+    Args:
+        windows (iterable): (window index, samples) pairs.
+        mode (str): 'on' drops inactive windows, 'validate' keeps them and
+            only records them, 'off' passes everything through untouched.
+        energy_db (float): Minimum bird-band level in dBFS.
+        flux (float): Minimum mean normalized spectral flux.
+        stats (dict): Optional dict; "windows_skipped" and "gate_time" are
+            incremented and "inactive_windows" collects the indices of
+            inactive windows.
+
+    Yields:
+        tuple: (window index, samples) of the windows to score.
+    """
+    if mode == "off":
+        yield from windows
+        return
+
+    for index, window in windows:
+        start = time.perf_counter()
+        level_db, window_flux = window_activity(window)
+        if stats is not None:
+            stats["gate_time"] = stats.get("gate_time", 0.0) + time.perf_counter() - start
+        if level_db < energy_db or window_flux < flux:
+            if stats is not None:
+                stats["windows_skipped"] = stats.get("windows_skipped", 0) + 1
+                stats.setdefault("inactive_windows", set()).add(index)
+            if mode == "on":
+                continue
+        yield index, window
+
+
+# Batched BirdNET inference on a dedicated TFLite interpreter
+class BirdNetEngine:
+    """
+    Runs the BirdNET TFLite model over batches of 3-second windows.
+
+    Windows are copied into a preallocated (batch, samples) buffer and the
+    interpreter input is only resized when the batch size changes, so a long
+    recording costs one invocation per BATCH_SIZE windows. Detections match
+    birdnetlib's Recording.detections: sigmoid scores per window, species at
+    or above `min_conf`, highest confidence first.
+    """
+
+    def __init__(self, model_path, labels_path, threads=THREADS,
+                 batch_size=BATCH_SIZE, use_xnnpack=USE_XNNPACK):
+        """
+        Args:
+            model_path (str): Path to the BirdNET .tflite model.
+            labels_path (str): Path to the "Scientific_Common" label list.
+            threads (int): Interpreter threads, 0 for every available CPU.
+            batch_size (int): Maximum windows per invocation.
+            use_xnnpack (bool): Apply the default XNNPACK delegate.
+        """
+        tflite = _interpreter_module()
+        options = {"num_threads": threads or os.cpu_count() or 1}
+        if not use_xnnpack:
+            options["experimental_op_resolver_type"] = \
+                tflite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = tflite.Interpreter(model_path=model_path, **options)
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.batch_size = max(1, int(batch_size))
+        self._allocated = None
+
+        # Labels are "Scientific name_Common name"
+        with open(labels_path, encoding="utf-8") as f:
+            labels = [line.strip() for line in f if line.strip()]
+        self.scientific_names = [label.split("_", 1)[0] for label in labels]
+        self.common_names = [label.split("_", 1)[-1] for label in labels]
+        self.labels = labels
+
+        # Reused window matrix
+        self._buffer = np.zeros((self.batch_size, WINDOW_SAMPLES), dtype=np.float32)
+
+    def _resize(self, rows):
+        """
+        Resize the input tensor to `rows` windows unless it already is.
+        """
+        if self._allocated != rows:
+            self.interpreter.resize_tensor_input(self.input_index, [rows, WINDOW_SAMPLES])
+            self.interpreter.allocate_tensors()
+            self._allocated = rows
+
+    def predict(self, rows):
+        """
+        Score the first `rows` windows of the buffer.
+
+        Returns:
+            ndarray: (rows, species) sigmoid confidences.
+        """
+        self._resize(rows)
+        self.interpreter.set_tensor(self.input_index, self._buffer[:rows])
+        self.interpreter.invoke()
+        logits = self.interpreter.get_tensor(self.output_index)
+        return 1.0 / (1.0 + np.exp(-np.clip(logits, -15, 15)))
+
+    def _detections(self, indices, scores, min_conf):
+        """
+        Build birdnetlib-style detections for scored windows.
+        """
+        detections = []
+        for index, row in zip(indices, scores):
+            hits = np.flatnonzero(row >= min_conf)
+            for species in hits[np.argsort(-row[hits], kind="stable")]:
+                detections.append({
+                    "common_name": self.common_names[species],
+                    "scientific_name": self.scientific_names[species],
+                    "label": self.labels[species],
+                    "start_time": index * WINDOW_SECONDS,
+                    "end_time": (index + 1) * WINDOW_SECONDS,
+                    "confidence": float(row[species]),
+                })
+        return detections
+
+    def iter_detections(self, windows, min_conf, stats=None):
+        """
+        Run the model over (index, window) pairs in batches, yielding the
+        detections of each batch as soon as it has been scored.
+
+        Args:
+            windows (iterable): (window index, samples) pairs, e.g. from
+                split_windows or stream_windows.
+            min_conf (float): Minimum confidence of a detection.
+            stats (dict): Optional dict; "windows" and "inference_time"
+                are incremented.
+
+        Yields:
+            dict: Detections in window order.
+        """
+        indices = []
+        count = 0
+        inference_time = 0.0
+        try:
+            for index, window in windows:
+                self._buffer[len(indices)] = window
+                indices.append(index)
+                count += 1
+                if len(indices) == self.batch_size:
+                    start = time.perf_counter()
+                    scores = self.predict(len(indices))
+                    inference_time += time.perf_counter() - start
+                    yield from self._detections(indices, scores, min_conf)
+                    indices = []
+            if indices:
+                start = time.perf_counter()
+                scores = self.predict(len(indices))
+                inference_time += time.perf_counter() - start
+                yield from self._detections(indices, scores, min_conf)
+        finally:
+            if stats is not None:
+                stats["windows"] = stats.get("windows", 0) + count
+                stats["inference_time"] = stats.get("inference_time", 0.0) + inference_time
+
+    def analyze_windows(self, windows, min_conf, stats=None):
+        """
+        Run the model over (index, window) pairs in batches.
+
+        Returns:
+            list: Detections in window order, see iter_detections.
+        """
+        return list(self.iter_detections(windows, min_conf, stats))
+
+    def analyze(self, signal, min_conf, stats=None):
+        """
+        Run the model over a whole decoded signal.
+
+        Args:
+            signal (ndarray): Mono float32 samples at SAMPLE_RATE.
+            min_conf (float): Minimum confidence of a detection.
+            stats (dict): Optional dict, see analyze_windows.
+
+        Returns:
+            list: Detections in window order.
+        """
+        return self.analyze_windows(split_windows(signal), min_conf, stats)
+
+
+# Function: Worker process of the parallel engine
+def _engine_worker(conn, model_path, labels_path, threads, batch_size, use_xnnpack):
+    """
+    Load one BirdNetEngine and score the shards received on `conn` until a
+    None message arrives.
+
+    Messages are (shard id, window indices, (n, samples) array, min_conf);
+    replies are (shard id, detections, inference seconds, error or None).
+    """
+    engine = BirdNetEngine(model_path, labels_path, threads=threads,
+                           batch_size=batch_size, use_xnnpack=use_xnnpack)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        shard, indices, windows, min_conf = message
+        try:
+            stats = {}
+            detections = engine.analyze_windows(zip(indices, windows), min_conf, stats)
+            conn.send((shard, detections, stats["inference_time"], None))
+        except Exception as e:
+            conn.send((shard, None, 0.0, repr(e)))
+    conn.close()
+
+
+# BirdNET inference spread over worker processes
+class ParallelEngine:
+    """
+    Same interface as BirdNetEngine, backed by a pool of worker processes
+    that each hold their own interpreter, loaded once.
+
+    The parent groups consecutive windows into shards of one batch each and
+    sends them to the least busy worker over a Pipe (Lambda has no
+    /dev/shm, so multiprocessing queues and pools are unavailable).
+    Results are yielded in shard order, so the merged detections are
+    exactly those of a serial BirdNetEngine with the same batch size.
+    """
+
+    def __init__(self, model_path, labels_path, workers=WORKERS, threads=THREADS,
+                 batch_size=BATCH_SIZE, use_xnnpack=USE_XNNPACK):
+        """
+        Args:
+            model_path (str): Path to the BirdNET .tflite model.
+            labels_path (str): Path to the label list.
+            workers (int): Number of worker processes.
+            threads (int): Interpreter threads per worker, 0 to split the
+                CPUs evenly between workers.
+            batch_size (int): Windows per shard (and per invocation).
+            use_xnnpack (bool): Apply the default XNNPACK delegate.
+        """
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+
+        self._conns = []
+        self._processes = []
+        for _ in range(self.workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_engine_worker,
+                args=(child_conn, model_path, labels_path, threads,
+                      self.batch_size, use_xnnpack),
+                daemon=True)
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+    def _shards(self, windows):
+        """
+        Group (index, window) pairs into shards of batch_size windows.
+
+        Yields:
+            tuple: (list of window indices, (n, samples) float32 array).
+        """
+        indices, batch = [], []
+        for index, window in windows:
+            indices.append(index)
+            batch.append(window)
+            if len(batch) == self.batch_size:
+                yield indices, np.stack(batch)
+                indices, batch = [], []
+        if batch:
+            yield indices, np.stack(batch)
+
+    def iter_detections(self, windows, min_conf, stats=None):
+        """
+        Score windows on the workers, yielding detections in window order.
+
+        Args:
+            windows (iterable): (window index, samples) pairs.
+            min_conf (float): Minimum confidence of a detection.
+            stats (dict): Optional dict; "windows" and "inference_time"
+                (summed over workers) are incremented.
+
+        Yields:
+            dict: Detections in window order.
+        """
+        shards = self._shards(windows)
+        in_flight = [0] * self.workers
+        results = {}
+        sent = 0
+        next_shard = 0
+        count = 0
+        inference_time = 0.0
+        exhausted = False
+        try:
+            while True:
+                # Keep every worker supplied with shards
+                while not exhausted and min(in_flight) < SHARDS_IN_FLIGHT:
+                    shard = next(shards, None)
+                    if shard is None:
+                        exhausted = True
+                        break
+                    worker = in_flight.index(min(in_flight))
+                    self._conns[worker].send((sent, shard[0], shard[1], min_conf))
+                    in_flight[worker] += 1
+                    sent += 1
+                    count += len(shard[0])
+                if exhausted and next_shard == sent:
+                    break
+
+                # Collect whatever has finished
+                busy = [conn for conn, n in zip(self._conns, in_flight) if n]
+                for conn in wait(busy):
+                    shard_id, detections, seconds, error = conn.recv()
+                    in_flight[self._conns.index(conn)] -= 1
+                    if error is not None:
+                        raise RuntimeError(f"BirdNET worker failed: {error}")
+                    results[shard_id] = detections
+                    inference_time += seconds
+
+                # Yield finished shards in order
+                while next_shard in results:
+                    yield from results.pop(next_shard)
+                    next_shard += 1
+        finally:
+            # Drain replies still owed so the next call starts clean
+            for conn, n in zip(self._conns, in_flight):
+                for _ in range(n):
+                    conn.recv()
+            if stats is not None:
+                stats["windows"] = stats.get("windows", 0) + count
+                stats["inference_time"] = stats.get("inference_time", 0.0) + inference_time
+
+    def analyze_windows(self, windows, min_conf, stats=None):
+        """
+        Returns:
+            list: Detections in window order, see iter_detections.
+        """
+        return list(self.iter_detections(windows, min_conf, stats))
+
+    def analyze(self, signal, min_conf, stats=None):
+        """
+        Run the workers over a whole decoded signal.
+
+        Returns:
+            list: Detections in window order.
+        """
+        return self.analyze_windows(split_windows(signal), min_conf, stats)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=5)
@@ -1,13 +1,14 @@
 
+import io
 import logging
 import os
 import json
 import base64
+import time
 from collections import Counter
-from datetime import datetime
 
-from birdnetlib import Recording
-from birdnetlib.analyzer import Analyzer
+from detection_cache import DetectionCache, content_hash
+from metrics import Metrics
 
 # Set up logger
 logger = logging.getLogger()
@@ -23,22 +24,179 @@ AUDIO_EXTENSIONS = [".wav", ".mp3", ".ogg", ".flac"]
 # BirdNET model paths
 MODEL_PATH = "./BirdNET_GLOBAL_6K_V2.4_Model_FP32.tflite"
 LABEL_PATH = "./BirdNET_GLOBAL_6K_V2.4_Labels.txt"
+# Minimum confidence score for predictions
+MIN_CONFIDENCE = 0.5
 
-# BirdNET prediction function
-def audio_prediction(audio_path, min_conf=0.5):
-    try:
+# BirdNET input: 3-second windows at 48 kHz, used for the warm-up pass
+SAMPLE_RATE = 48000
+WARMUP_SECONDS = 3.0
+# Inference engine: 'birdnetlib' (Recording.analyze), 'batched' (birdnet_engine)
+# or 'parallel' (batched, spread over AUDIO_WORKERS processes). birdnetlib stays
+# the default until compare_engines.py shows parity on real uploads.
+AUDIO_ENGINE = os.environ.get("AUDIO_ENGINE", "birdnetlib")
+
+# Detection results keyed by content hash and model version
+detection_cache = DetectionCache()
+
+# BirdNET analyzer shared by warm invocations
+_analyzer = None
+
+# Load the BirdNET model and labels once per container, then warm it up
+def get_analyzer():
+    global _analyzer
+    if _analyzer is not None:
+        return _analyzer
+
+    # BirdNET pulls in the TFLite runtime and NumPy; import on first use
+    import numpy as np
+
+    start = time.perf_counter()
+    if AUDIO_ENGINE == "batched":
+        from birdnet_engine import BirdNetEngine
+        analyzer = BirdNetEngine(MODEL_PATH, LABEL_PATH)
+    elif AUDIO_ENGINE == "parallel":
+        from birdnet_engine import ParallelEngine
+        analyzer = ParallelEngine(MODEL_PATH, LABEL_PATH)
+    else:
+        from birdnetlib.analyzer import Analyzer
         analyzer = Analyzer(classifier_model_path=MODEL_PATH,
                             classifier_labels_path=LABEL_PATH)
-        recording = Recording(analyzer, audio_path, min_conf=min_conf)
-        recording.analyze()
+    load_time = time.perf_counter() - start
+
+    # Analyze a few seconds of silence so the first request is not slower
+    start = time.perf_counter()
+    silence = np.zeros(int(SAMPLE_RATE * WARMUP_SECONDS), dtype=np.float32)
+    if AUDIO_ENGINE != "birdnetlib":
+        analyzer.analyze(silence, MIN_CONFIDENCE)
+    else:
+        from birdnetlib import RecordingBuffer
+        RecordingBuffer(analyzer, silence, SAMPLE_RATE, min_conf=MIN_CONFIDENCE).analyze()
+    warmup_time = time.perf_counter() - start
+
+    _analyzer = analyzer
+    logger.info(f"Loaded BirdNET ({AUDIO_ENGINE}) in {load_time:.3f}s, "
+                f"warm-up {warmup_time:.3f}s")
+    return _analyzer
+
+# Decode and resample audio bytes to mono float32 at SAMPLE_RATE
+def decode_audio(audio_bytes):
+    import librosa
+
+    signal, _ = librosa.load(io.BytesIO(audio_bytes), sr=SAMPLE_RATE, mono=True,
+                             res_type="kaiser_fast")
+    return signal.astype("float32", copy=False)
+
+# Stream audio bytes through the batched engine, decoding block by block;
+# formats libsndfile cannot read are decoded whole with librosa instead.
+# Windows pass through the activity gate (AUDIO_GATE) before inference.
+def _run_engine(analyzer, audio_bytes, min_conf):
+    from birdnet_engine import (GATE_MODE, WINDOW_SECONDS, gate_windows,
+                                split_windows, stream_windows)
+
+    start = time.perf_counter()
+    engine_stats = {}
+    detections = []
+    try:
+        windows = gate_windows(stream_windows(io.BytesIO(audio_bytes), stats=engine_stats),
+                               stats=engine_stats)
+        for detection in analyzer.iter_detections(windows, min_conf, engine_stats):
+            if not detections:
+                engine_stats["first_detection_time"] = time.perf_counter() - start
+            detections.append(detection)
+    except Exception as e:
+        # Only fall back if nothing was analyzed yet
+        if engine_stats.get("windows"):
+            raise
+        logger.info(f"Streaming decode unavailable ({e}), decoding whole file")
+        engine_stats = {}
+        decode_start = time.perf_counter()
+        signal = decode_audio(audio_bytes)
+        engine_stats["decode_time"] = time.perf_counter() - decode_start
+        windows = gate_windows(split_windows(signal), stats=engine_stats)
+        detections = analyzer.analyze_windows(windows, min_conf, stats=engine_stats)
+
+    # Validate mode: detections in windows the gate marked inactive
+    inactive = engine_stats.get("inactive_windows", set())
+    missed = [det for det in detections
+              if int(det["start_time"] // WINDOW_SECONDS) in inactive]
+    if missed and GATE_MODE == "validate":
+        logger.warning(f"Activity gate would have missed {len(missed)} detections: "
+                       f"{sorted({det['common_name'] for det in missed})}")
+
+    run_stats = {
+        "segments": engine_stats["windows"],
+        "decode_time": engine_stats.get("decode_time", 0.0),
+        "inference_time": engine_stats["inference_time"],
+        "gate_time": engine_stats.get("gate_time", 0.0),
+        "windows_skipped": engine_stats.get("windows_skipped", 0),
+        "gate_missed": len(missed),
+    }
+    if "first_detection_time" in engine_stats:
+        run_stats["first_detection_time"] = engine_stats["first_detection_time"]
+    return detections, run_stats
+
+# BirdNET prediction function
+def audio_prediction(audio_bytes, min_conf=MIN_CONFIDENCE, stats=None):
+    try:
+        # Shared analyzer (slow only on a cold container)
+        start = time.perf_counter()
+        analyzer = get_analyzer()
+        model_load_time = time.perf_counter() - start
 
-        return [det["common_name"] for det in recording.detections]
+        if AUDIO_ENGINE != "birdnetlib":
+            # Decode block by block while earlier windows are being scored
+            detections, run_stats = _run_engine(analyzer, audio_bytes, min_conf)
+        else:
+            from birdnetlib import RecordingFileObject
+
+            # Decode from an in-memory buffer instead of a /tmp file
+            recording = RecordingFileObject(analyzer, io.BytesIO(audio_bytes),
+                                            min_conf=min_conf)
+            start = time.perf_counter()
+            recording.analyze()
+            detections = recording.detections
+            run_stats = {
+                "segments": len(getattr(recording, "chunks", [])),
+                "analysis_time": time.perf_counter() - start,
+            }
+
+        labels = [det["common_name"] for det in detections]
+        if stats is not None:
+            stats.update({
+                "detections": len(labels),
+                "model_load_time": model_load_time,
+                **run_stats,
+            })
+        return labels
     except Exception as e:
         logger.error(f"Audio prediction failed: {e}")
         return []
 
+# Version label of cached results (same as the ingest handler)
+def _cache_version():
+    version = f"audio:{os.path.basename(MODEL_PATH)}:{MIN_CONFIDENCE}"
+    # The batched engines resample differently from birdnetlib, so their
+    # results are kept apart
+    if AUDIO_ENGINE != "birdnetlib":
+        version += ":batched"
+    # Skipping windows can change results; validate mode scores them all
+    if AUDIO_ENGINE != "birdnetlib" and os.environ.get("AUDIO_GATE") == "on":
+        from birdnet_engine import GATE_ENERGY_DB, GATE_FLUX
+        version += f":gate:{GATE_ENERGY_DB}:{GATE_FLUX}"
+    return version
+
 # Lambda handler
 def handler(event, context):
+    metrics = Metrics("query_birds_audio_detection", file_type="audio")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+# Detect birds in the audio of a query request
+def _handle(event, metrics):
     logger.info("Received event")
 
     try:
@@ -55,25 +213,49 @@ def handler(event, context):
         if file_type.lower() not in AUDIO_EXTENSIONS:
             return {"statusCode": 400, "body": f"Unsupported audio type: {file_type}"}
 
-        # Decode and save audio file to /tmp
-        file_bytes = base64.b64decode(file_base64)
-        file_name = datetime.now().strftime("%Y%m%d_%H%M%S") + file_type
-        local_path = f"/tmp/{file_name}"
-
-        with open(local_path, "wb") as f:
-            f.write(file_bytes)
+        with metrics.timer("request_decode"):
+            file_bytes = base64.b64decode(file_base64)
+        metrics.add("object_bytes", len(file_bytes), "Bytes")
 
-        logger.info(f"Saved temporary audio file: {local_path}")
+        # Reuse the result of identical content seen before
+        digest = content_hash(file_bytes)
+        with metrics.timer("dynamodb_read"):
+            cached = detection_cache.get(digest, _cache_version())
+        if cached is not None:
+            logger.info(f"Detection cache hit: {cached['tags']}")
+            metrics.add("cache_hit", 1)
+            with metrics.timer("json_serialize"):
+                response_body = json.dumps(cached["tags"])
+            return {
+                "statusCode": 200,
+                "body": response_body
+            }
 
         # Predict tags
-        tags = audio_prediction(local_path)
+        audio_stats = {}
+        tags = audio_prediction(file_bytes, stats=audio_stats)
         tag_summary = dict(Counter(tags))
+        metrics.add("segments", audio_stats.get("segments", 0))
+        metrics.add("detections", len(tags))
+        metrics.add("windows_skipped", audio_stats.get("windows_skipped", 0))
+        metrics.add("gate_missed", audio_stats.get("gate_missed", 0))
+        for stage in ("model_load", "decode", "gate", "inference", "analysis", "first_detection"):
+            if f"{stage}_time" in audio_stats:
+                metrics.add_time(stage, audio_stats[f"{stage}_time"])
 
         logger.info(f"Audio tag summary: {tag_summary}")
+        if audio_stats:
+            with metrics.timer("dynamodb_write"):
+                detection_cache.put(digest, _cache_version(),
+                                    {"file_type": "audio", "tags": tag_summary})
+        else:
+            metrics.add("errors", 1)
 
+        with metrics.timer("json_serialize"):
+            response_body = json.dumps(tag_summary)
         return {
             "statusCode": 200,
-            "body": json.dumps(tag_summary)
+            "body": response_body
         }
 
     except Exception as e:
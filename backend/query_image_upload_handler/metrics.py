@@ -0,0 +1,159 @@
+# Import libraries
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# CloudWatch namespace of the emitted metrics
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "BirdTag")
+# Where metric lines go: "stdout" (picked up by CloudWatch Logs) or "off"
+METRICS_SINK = os.environ.get("METRICS_SINK", "stdout")
+
+
+# Collects metric lines in memory instead of printing them
+class ListSink:
+    """
+    Local sink for tests and benchmarks: keeps every emitted line.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def __call__(self, line):
+        self.lines.append(line)
+
+    def records(self):
+        """
+        Returns:
+            list: Emitted metric records as dicts.
+        """
+        return [json.loads(line) for line in self.lines]
+
+
+# Function: Write a metric line to stdout
+def _stdout_sink(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+# Sink used by Metrics.flush(), replaced with set_sink()
+_sink = None if METRICS_SINK == "off" else _stdout_sink
+
+
+# Function: Replace the sink metric lines are written to
+def set_sink(sink):
+    """
+    Args:
+        sink (callable): Called with each metric line (str), None to drop them.
+
+    Returns:
+        callable: The previous sink.
+    """
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+# Stage timings and counters of one unit of work, emitted as one EMF line
+class Metrics:
+    """
+    Per-stage timings, sizes and counts of one record (or one invocation),
+    written as a CloudWatch Embedded Metric Format line on flush().
+
+    Stage times are accumulated, so timing the same stage twice (e.g. two
+    DynamoDB writes) reports their sum as `<stage>_ms`. Peak RSS and the CPU
+    time used since the object was created are added on flush.
+    """
+
+    def __init__(self, function, **properties):
+        """
+        Args:
+            function (str): Handler name, used as the metric dimension.
+            **properties: Extra fields logged with the metrics (e.g.
+                object_key, file_type); they are not metrics themselves.
+        """
+        self.function = function
+        self.properties = dict(properties)
+        self.values = {}
+        self.units = {}
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def add(self, name, value, unit="Count"):
+        """
+        Add to a metric, creating it at zero.
+
+        Args:
+            name (str): Metric name.
+            value (float): Amount to add.
+            unit (str): CloudWatch unit (Count, Bytes, Milliseconds, ...).
+        """
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    def add_time(self, stage, seconds):
+        """
+        Add a duration measured elsewhere to a stage.
+
+        Args:
+            stage (str): Stage name, reported as `<stage>_ms`.
+            seconds (float): Duration in seconds.
+        """
+        self.add(f"{stage}_ms", seconds * 1000, "Milliseconds")
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Time the body of a `with` block as a stage, including when it raises.
+
+        Args:
+            stage (str): Stage name, reported as `<stage>_ms`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def set_property(self, name, value):
+        """
+        Attach a non-metric field to the record.
+        """
+        self.properties[name] = value
+
+    def flush(self):
+        """
+        Emit the record as one EMF line and reset the collected metrics.
+
+        Returns:
+            dict: The emitted record.
+        """
+        self.add_time("total", time.perf_counter() - self._start)
+        self.add("cpu_ms", (time.process_time() - self._cpu_start) * 1000, "Milliseconds")
+        # ru_maxrss is in kilobytes on Linux
+        self.values["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.units["max_rss_mb"] = "Megabytes"
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["function"]],
+                    "Metrics": [{"Name": name, "Unit": unit}
+                                for name, unit in self.units.items()],
+                }],
+            },
+            "function": self.function,
+            **self.properties,
+            **{name: round(value, 3) for name, value in self.values.items()},
+        }
+        if _sink is not None:
+            _sink(json.dumps(record, default=str))
+
+        self.values, self.units = {}, {}
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return record
@@ -0,0 +1,145 @@
+# Import libraries
+import ast
+
+import cv2 as cv
+import numpy as np
+import onnxruntime as ort
+import supervision as sv
+
+# Detection thresholds (same as the ultralytics predict defaults)
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+# Model input size used when the exported graph has dynamic axes
+DEFAULT_INPUT_SIZE = 640
+# Padding colour used by ultralytics letterboxing
+LETTERBOX_COLOR = (114, 114, 114)
+
+
+# Function: Resize and pad an image to the model input size
+def letterbox(image, input_size):
+    """
+    Resize an image keeping aspect ratio and pad it to the model input,
+    matching the ultralytics preprocessing.
+
+    Args:
+        image (ndarray): Decoded BGR image.
+        input_size (tuple): Model input (height, width).
+
+    Returns:
+        tuple: (CHW float32 RGB blob scaled to 0-1, resize ratio, (pad_x, pad_y)).
+    """
+    height, width = image.shape[:2]
+    ratio = min(input_size[0] / height, input_size[1] / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    if (new_width, new_height) != (width, height):
+        image = cv.resize(image, (new_width, new_height), interpolation=cv.INTER_LINEAR)
+
+    # Split the padding evenly between both sides
+    pad_x = (input_size[1] - new_width) / 2
+    pad_y = (input_size[0] - new_height) / 2
+    top, bottom = round(pad_y - 0.1), round(pad_y + 0.1)
+    left, right = round(pad_x - 0.1), round(pad_x + 0.1)
+    image = cv.copyMakeBorder(image, top, bottom, left, right,
+                              cv.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+
+    # BGR HWC uint8 -> RGB CHW float32
+    blob = image[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+    return np.ascontiguousarray(blob), ratio, (left, top)
+
+
+# YOLO detector running an exported ONNX model through onnxruntime
+class OnnxDetector:
+    """
+    Bird detector backed by onnxruntime.
+
+    Loads a YOLO model exported by export_onnx.py (FP32 or INT8) and returns
+    the same class mapping (`names`) as the ultralytics model it came from.
+    """
+
+    def __init__(self, model_path, threads=0):
+        """
+        Args:
+            model_path (str): Path to the .onnx model.
+            threads (int): Intra-op threads, 0 lets onnxruntime decide.
+        """
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+
+        # Input name, size and whether it accepts a batch dimension
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        height, width = model_input.shape[2:]
+        self.input_size = (height if isinstance(height, int) else DEFAULT_INPUT_SIZE,
+                           width if isinstance(width, int) else DEFAULT_INPUT_SIZE)
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+
+        # Class ID to bird name mapping stored by the ultralytics exporter
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"])
+
+    def detect(self, images, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD):
+        """
+        Run detection on decoded images.
+
+        Args:
+            images (list): Decoded BGR images.
+            conf (float): Minimum score kept before NMS.
+            iou (float): IoU threshold for NMS.
+
+        Returns:
+            list: One sv.Detections per image, in input image coordinates.
+        """
+        prepared = [letterbox(image, self.input_size) for image in images]
+        blobs = [blob for blob, _, _ in prepared]
+
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: np.stack(blobs)})[0]
+        else:
+            outputs = np.concatenate([
+                self.session.run(None, {self.input_name: blob[None]})[0]
+                for blob in blobs
+            ])
+
+        return [
+            self._postprocess(output, ratio, pad, conf, iou)
+            for output, (_, ratio, pad) in zip(outputs, prepared)
+        ]
+
+    def _postprocess(self, output, ratio, pad, conf, iou):
+        """
+        Decode one raw YOLO output of shape (4 + classes, anchors).
+
+        Returns:
+            sv.Detections: Boxes after per-class NMS.
+        """
+        predictions = output.T
+        class_scores = predictions[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+
+        keep = scores > conf
+        if not keep.any():
+            return sv.Detections.empty()
+        boxes, scores, class_ids = predictions[keep, :4], scores[keep], class_ids[keep]
+
+        # Centre/size -> top-left/size for OpenCV NMS
+        xywh = boxes.copy()
+        xywh[:, :2] -= xywh[:, 2:] / 2
+        indices = cv.dnn.NMSBoxesBatched(xywh.tolist(), scores.tolist(),
+                                         class_ids.tolist(), conf, iou)
+        indices = np.array(indices, dtype=int).flatten()[:MAX_DETECTIONS]
+
+        # Undo letterbox padding and scaling
+        xyxy = np.concatenate([xywh[indices, :2], xywh[indices, :2] + xywh[indices, 2:]], axis=1)
+        xyxy -= np.array([pad[0], pad[1], pad[0], pad[1]], dtype=np.float32)
+        xyxy /= ratio
+
+        return sv.Detections(xyxy=xyxy.astype(np.float32),
+                             confidence=scores[indices].astype(np.float32),
+                             class_id=class_ids[indices].astype(int))
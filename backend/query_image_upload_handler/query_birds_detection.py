@@ -1,46 +1,288 @@
 # Import libraries
+import json
 import logging
 import os
+import queue
+import tempfile
+import threading
+import time
 from collections import Counter
-from urllib.parse import unquote_plus
 
-import boto3
-import cv2 as cv
-import supervision as sv
-from botocore.exceptions import ClientError
-from ultralytics import YOLO
 import base64
-from datetime import datetime
 
-# Initialize S3 and DynamoDB clients
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('BirdTagMediaIndex')
+from detection_cache import DetectionCache, content_hash, file_hash
+from metrics import Metrics
+
+# Detection results keyed by content hash and model version
+detection_cache = DetectionCache()
+
+# Heavy libraries, imported on first use by _import_libraries()
+cv = None
+np = None
+sv = None
 
 # Set up the logger to log at the INFO level
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Inference backend: 'torch' (ultralytics) or 'onnx' (onnxruntime)
+DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "torch")
+# Default model path and optional version label
+MODEL_PATH = os.environ.get(
+    "MODEL_PATH", "./model.onnx" if DETECTOR_BACKEND == "onnx" else "./model.pt")
+MODEL_VERSION = os.environ.get("MODEL_VERSION", "")
+# Intra-op threads for onnxruntime (0 lets onnxruntime decide)
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", "0"))
+# Input size used for the warm-up inference
+WARMUP_IMAGE_SIZE = 640
+# Images are decoded at reduced scale down to this longest side (model input)
+DECODE_MIN_SIDE = 640
+# Bytes read to find the JPEG frame header (EXIF blocks may precede it)
+JPEG_HEADER_BYTES = 256 * 1024
+
+# Video frame sampling mode: 'all', 'stride' or 'adaptive'
+VIDEO_SAMPLE_MODE = os.environ.get("VIDEO_SAMPLE_MODE", "all")
+# Infer every Nth frame in 'stride' and 'adaptive' modes
+VIDEO_FRAME_STRIDE = int(os.environ.get("VIDEO_FRAME_STRIDE", "1"))
+# Mean grey-level difference (0-255) that counts as a scene change
+VIDEO_SCENE_THRESHOLD = float(os.environ.get("VIDEO_SCENE_THRESHOLD", "6.0"))
+# Side length of the greyscale signature used for scene-change scoring
+SCENE_SIGNATURE_SIZE = 64
+# Decoded frames buffered between the decoder thread and inference
+VIDEO_QUEUE_DEPTH = int(os.environ.get("VIDEO_QUEUE_DEPTH", "8"))
+# Frames per YOLO forward pass for video
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", "4"))
+# Longest side frames are downscaled to before queueing (0 keeps full size)
+VIDEO_RESIZE_MAX_SIDE = int(os.environ.get("VIDEO_RESIZE_MAX_SIDE", "0"))
+
+# Loaded models keyed by (path, version), reused across warm invocations
+_model_registry = {}
+
+
+# Function: Import the image processing libraries on first use
+def _import_libraries():
+    """
+    Import OpenCV, NumPy and supervision into the module globals.
+
+    Deferred so that loading the handler stays cheap and requests served
+    from the detection cache never pay for these imports.
+    """
+    global cv, np, sv
+    if sv is None:
+        import cv2 as cv
+        import numpy as np
+        import supervision as sv
+
+
+# Function: Resolve the version label of a model file
+def _model_version(model_path):
+    """
+    Get the version label used to key a model in the registry.
+
+    Args:
+        model_path (str): Path to the model file.
+
+    Returns:
+        str: MODEL_VERSION if set, otherwise a hash of the file's content,
+        so the ingest and query images share cache entries for one model.
+    """
+    if MODEL_VERSION:
+        return MODEL_VERSION
+    return file_hash(model_path)[:16]
+
+
+# Function: Get a loaded and warmed-up detector
+def get_model(model_path=MODEL_PATH):
+    """
+    Return the detector for a path, loading it on first use.
+
+    `.onnx` files run through onnxruntime (OnnxDetector), anything else
+    through ultralytics YOLO. The first call for a given path/version loads
+    the weights and runs a warm-up inference on a blank image so that layer
+    fusion and memory allocation happen outside the first real prediction.
+
+    Args:
+        model_path (str): Path to the model file.
+
+    Returns:
+        YOLO or OnnxDetector: The loaded model.
+    """
+    _import_libraries()
+    key = (os.path.abspath(model_path), _model_version(model_path))
+    entry = _model_registry.get(key)
+    if entry is not None:
+        return entry["model"]
+
+    # Load model weights
+    start = time.perf_counter()
+    if model_path.endswith(".onnx"):
+        from onnx_detector import OnnxDetector
+        model = OnnxDetector(model_path, threads=ONNX_THREADS)
+    else:
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+    load_time = time.perf_counter() - start
+
+    # Warm up on a blank frame
+    start = time.perf_counter()
+    blank = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+    _detect(model, [blank])
+    warmup_time = time.perf_counter() - start
+
+    _model_registry[key] = {
+        "model": model,
+        "path": key[0],
+        "version": key[1],
+        "load_time": load_time,
+        "warmup_time": warmup_time,
+    }
+    logger.info(f"Loaded model {key[0]} (version {key[1]}) "
+                f"in {load_time:.3f}s, warm-up {warmup_time:.3f}s")
+    return model
+
+
+# Function: Report load statistics of the models in the registry
+def model_load_stats():
+    """
+    Get load and warm-up timings of every model loaded in this container.
+
+    Returns:
+        list: One dict per model with path, version, load_time and warmup_time.
+    """
+    return [
+        {k: v for k, v in entry.items() if k != "model"}
+        for entry in _model_registry.values()
+    ]
+
+
+# Function: Run a detector on a list of images
+def _detect(model, images):
+    """
+    Run either backend on decoded images.
+
+    Args:
+        model (YOLO or OnnxDetector): Model returned by get_model.
+        images (list): Decoded BGR images.
+
+    Returns:
+        list: One sv.Detections per image.
+    """
+    if hasattr(model, "detect"):
+        return model.detect(images)
+    return [sv.Detections.from_ultralytics(r) for r in model(images, verbose=False)]
+
+
+# Function: Read the pixel size of a JPEG from its header
+def _jpeg_size(header):
+    """
+    Parse the frame header of a JPEG without decoding it.
+
+    Args:
+        header (bytes): Leading bytes of the file.
+
+    Returns:
+        tuple: (width, height), or None if not a JPEG or not found.
+    """
+    if header[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(header):
+        if header[i] != 0xFF:
+            return None
+        marker = header[i + 1]
+        # Fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        # Start-of-frame markers (excluding DHT, JPG and DAC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(header[i + 5:i + 7], "big")
+            width = int.from_bytes(header[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(header[i + 2:i + 4], "big")
+    return None
+
+
+# Function: Pick the OpenCV decode flag for an image
+def _decode_flag(header, min_side=DECODE_MIN_SIDE):
+    """
+    Choose the largest JPEG reduction whose longest side still covers
+    `min_side`; other formats decode at full size.
+
+    Args:
+        header (bytes): Leading bytes of the file.
+        min_side (int): Smallest acceptable longest side after decoding.
+
+    Returns:
+        int: cv.IMREAD_* flag.
+    """
+    size = _jpeg_size(header)
+    if size is not None:
+        longest = max(size)
+        for factor, flag in ((8, cv.IMREAD_REDUCED_COLOR_8),
+                             (4, cv.IMREAD_REDUCED_COLOR_4),
+                             (2, cv.IMREAD_REDUCED_COLOR_2)):
+            if longest // factor >= min_side:
+                return flag
+    return cv.IMREAD_COLOR
+
+
+# Function: Decode an image once for every consumer
+def decode_image(source, min_side=DECODE_MIN_SIDE):
+    """
+    Decode an image at the smallest scale that still covers the model input.
+
+    Large JPEGs use OpenCV's reduced-scale decoding, so a 20 MP photo is
+    never held at full resolution. EXIF orientation is applied by OpenCV.
+
+    Args:
+        source (str or bytes): Path to the image file, or its encoded bytes.
+        min_side (int): Smallest acceptable longest side after decoding.
+
+    Returns:
+        ndarray: Decoded BGR image, or None if decoding failed.
+    """
+    _import_libraries()
+    # Decode straight from memory
+    if isinstance(source, (bytes, bytearray)):
+        flag = _decode_flag(source[:JPEG_HEADER_BYTES], min_side)
+        return cv.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+
+    with open(source, "rb") as f:
+        header = f.read(JPEG_HEADER_BYTES)
+    return cv.imread(source, _decode_flag(header, min_side))
+
 
 # Function: Predict bird species in an image
-def image_prediction(image_path, confidence=0.5, model="./model.pt"):
+def image_prediction(image_path, confidence=0.5, model=MODEL_PATH, stats=None):
     """
     Run bird detection on an image using a YOLO model.
 
     Args:
-        image_path (str): Path to the image file.
+        image_path (str or ndarray): Path to the image file, or an image
+            already decoded with decode_image.
         confidence (float): Minimum confidence threshold for detection.
         model (str): Path to the model file.
+        stats (dict): Optional dict filled with model load and inference times.
 
     Returns:
         list: List of detected bird class names.
     """
-    # Load the YOLO model
-    model = YOLO(model)
+    _import_libraries()
+    # Get the cached detector
+    start = time.perf_counter()
+    model = get_model(model)
+    model_load_time = time.perf_counter() - start
     # Dictionary of class ID to bird names
     class_dict = model.names
-    # Load the image from local path
-    img = cv.imread(image_path)
+    # Decode the image unless the caller already did
+    if isinstance(image_path, np.ndarray):
+        img = image_path
+    else:
+        img = decode_image(image_path)
 
     # If image loading failed
     if img is None:
@@ -48,9 +290,13 @@ def image_prediction(image_path, confidence=0.5, model="./model.pt"):
         return []
 
     # Run prediction, get first output
-    result = model(img)[0]
-    # Convert to supervision format
-    detections = sv.Detections.from_ultralytics(result)
+    start = time.perf_counter()
+    detections = _detect(model, [img])[0]
+    inference_time = time.perf_counter() - start
+    logger.info(f"Image inference took {inference_time:.3f}s")
+    if stats is not None:
+        stats.update({"model_load_time": model_load_time,
+                      "inference_time": inference_time})
 
     # If any detections exist
     if detections.class_id is not None:
@@ -64,28 +310,225 @@ def image_prediction(image_path, confidence=0.5, model="./model.pt"):
     return []
 
 
+# Function: Reduce a frame to a small greyscale signature
+def _scene_signature(frame):
+    """
+    Downscale a frame to a small greyscale image for scene-change scoring.
+
+    Args:
+        frame (ndarray): Decoded BGR frame.
+
+    Returns:
+        ndarray: SCENE_SIGNATURE_SIZE x SCENE_SIGNATURE_SIZE greyscale image.
+    """
+    small = cv.resize(frame, (SCENE_SIGNATURE_SIZE, SCENE_SIGNATURE_SIZE),
+                      interpolation=cv.INTER_AREA)
+    return cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+
+
+# Streaming per-track summary of tracked detections
+class TrackAggregator:
+    """
+    Aggregate tracked detections per ByteTrack tracker_id.
+
+    Each track keeps a vote counter over class IDs and its peak confidence,
+    so memory is bounded by the number of tracks rather than video length.
+    """
+
+    def __init__(self, class_dict):
+        """
+        Args:
+            class_dict (dict): Class ID to bird name mapping.
+        """
+        self.class_dict = class_dict
+        # tracker_id -> {"votes": Counter of class IDs, "peak_confidence": float}
+        self._tracks = {}
+
+    def update(self, detections):
+        """
+        Add the tracked detections of one frame.
+
+        Args:
+            detections (sv.Detections): Detections with tracker IDs.
+        """
+        for tracker_id, class_id, score in zip(detections.tracker_id,
+                                               detections.class_id,
+                                               detections.confidence):
+            track = self._tracks.setdefault(
+                int(tracker_id), {"votes": Counter(), "peak_confidence": 0.0})
+            track["votes"][int(class_id)] += 1
+            track["peak_confidence"] = max(track["peak_confidence"], float(score))
+
+    def tracks(self):
+        """
+        Summarise every track.
+
+        Returns:
+            dict: tracker_id -> species (majority class), peak_confidence
+                and number of frames it was detected in.
+        """
+        return {
+            tracker_id: {
+                "species": self.class_dict[track["votes"].most_common(1)[0][0]],
+                "peak_confidence": track["peak_confidence"],
+                "frames": sum(track["votes"].values()),
+            }
+            for tracker_id, track in self._tracks.items()
+        }
+
+    def labels(self):
+        """
+        Get one species name per distinct tracked bird.
+
+        Returns:
+            list: Majority species of each track.
+        """
+        return [track["species"] for track in self.tracks().values()]
+
+
+# Function: Put an item on a bounded queue unless the pipeline is stopping
+def _put_frame(frame_queue, item, stop_event):
+    """
+    Block until the item is queued or the pipeline is stopped.
+
+    Returns:
+        bool: True if the item was queued.
+    """
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+# Function: Decoder thread of the video pipeline
+def _decode_frames(cap, frame_queue, stop_event, counters, stride,
+                   sample_mode, scene_threshold, resize_max_side):
+    """
+    Decode and sample frames from a video and push them onto a bounded queue.
+
+    Frames between samples are skipped with `cap.grab()`. In adaptive mode
+    a sampled frame is dropped unless it differs enough from the last
+    queued frame. A None sentinel marks the end of the stream.
+
+    Args:
+        cap (VideoCapture): Opened video capture.
+        frame_queue (Queue): Bounded queue feeding the inference stage.
+        stop_event (Event): Set by the consumer to abort decoding.
+        counters (dict): Frame counters and decode time, updated in place.
+        stride (int): Frame step between samples.
+        sample_mode (str): 'all', 'stride' or 'adaptive'.
+        scene_threshold (float): Scene-change score (0-255) for 'adaptive'.
+        resize_max_side (int): Downscale frames to this longest side, 0 to keep.
+    """
+    # Signature of the last queued frame (adaptive mode)
+    last_signature = None
+    try:
+        while not stop_event.is_set():
+            # Skip frames between samples without decoding them
+            start = time.perf_counter()
+            if counters["frames_total"] % stride:
+                grabbed = cap.grab()
+                counters["decode_time"] += time.perf_counter() - start
+                if not grabbed:
+                    break
+                counters["frames_total"] += 1
+                continue
+
+            ret, frame = cap.read()
+            counters["decode_time"] += time.perf_counter() - start
+            if not ret:
+                break
+            counters["frames_total"] += 1
+            counters["frames_decoded"] += 1
+
+            # Only queue frames where the scene has changed enough
+            if sample_mode == "adaptive":
+                signature = _scene_signature(frame)
+                if last_signature is not None:
+                    score = float(cv.absdiff(signature, last_signature).mean())
+                    if score < scene_threshold:
+                        continue
+                last_signature = signature
+
+            # Shrink large frames before they are queued
+            height, width = frame.shape[:2]
+            if resize_max_side and max(height, width) > resize_max_side:
+                scale = resize_max_side / max(height, width)
+                frame = cv.resize(frame, (round(width * scale), round(height * scale)),
+                                  interpolation=cv.INTER_AREA)
+
+            if not _put_frame(frame_queue, frame, stop_event):
+                break
+    except Exception as e:
+        counters["error"] = e
+    finally:
+        # Signal end of stream
+        _put_frame(frame_queue, None, stop_event)
+
+
 # Function: Predict bird species in a video
-def video_prediction(video_path, confidence=0.5, model="./model.pt"):
+def video_prediction(video_path, confidence=0.5, model=MODEL_PATH,
+                     sample_mode=VIDEO_SAMPLE_MODE,
+                     frame_stride=VIDEO_FRAME_STRIDE,
+                     scene_threshold=VIDEO_SCENE_THRESHOLD,
+                     queue_depth=VIDEO_QUEUE_DEPTH,
+                     batch_size=VIDEO_BATCH_SIZE,
+                     resize_max_side=VIDEO_RESIZE_MAX_SIDE,
+                     stats=None):
     """
     Run bird detection on a video using YOLO and ByteTrack.
 
+    Decoding runs on a separate thread that fills a queue of at most
+    `queue_depth` frames; the calling thread drains it in batches of up to
+    `batch_size` frames for YOLO and updates the tracker in frame order.
+
+    Sampling modes:
+        all:      run inference on every frame.
+        stride:   run inference on every `frame_stride`-th frame; frames in
+                  between are skipped with `cap.grab()` and never decoded.
+        adaptive: as stride, but a sampled frame is only inferred when its
+                  mean absolute difference from the last inferred frame
+                  (on a small greyscale signature) reaches `scene_threshold`.
+
     Args:
         video_path (str): Path to the video file.
         confidence (float): Confidence threshold for predictions.
         model (str): Path to the YOLO model.
+        sample_mode (str): 'all', 'stride' or 'adaptive'.
+        frame_stride (int): Frame step used by 'stride' and 'adaptive'.
+        scene_threshold (float): Scene-change score (0-255) for 'adaptive'.
+        queue_depth (int): Maximum number of decoded frames held in memory.
+        batch_size (int): Maximum number of frames per forward pass.
+        resize_max_side (int): Downscale frames to this longest side, 0 to keep.
+        stats (dict): Optional dict filled with frame counts, stage timings
+            and per-track summaries.
 
     Returns:
-        list: List of bird species detected across video frames.
+        list: One bird species name per distinct tracked bird.
     """
+    _import_libraries()
+    if sample_mode not in ("all", "stride", "adaptive"):
+        raise ValueError(f"Unknown video sample mode: {sample_mode}")
+    # Every frame is sampled in 'all' mode
+    stride = 1 if sample_mode == "all" else max(1, int(frame_stride))
+
+    cap = None
+    decoder = None
+    stop_event = threading.Event()
     try:
         # Extract video info
         video_info = sv.VideoInfo.from_video_path(video_path=video_path)
         # Extract frames per second
         fps = int(video_info.fps)
-        # Load YOLO model
-        model = YOLO(model)
-        # Initialize tracker for object tracking
-        tracker = sv.ByteTrack(frame_rate=fps)
+        # Get the cached detector (slow only on a cold container)
+        start = time.perf_counter()
+        model = get_model(model)
+        model_load_time = time.perf_counter() - start
+        # Initialize tracker at the rate frames are actually sampled
+        tracker = sv.ByteTrack(frame_rate=max(1, round(fps / stride)))
         # Get bird name dictionary
         class_dict = model.names
 
@@ -95,47 +538,127 @@ def video_prediction(video_path, confidence=0.5, model="./model.pt"):
         if not cap.isOpened():
             raise Exception("Failed to open video.")
 
-        # List to collect detected labels
-        labels = []
-        # Process the video frame by frame
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret: 
+        # Start the decoder thread
+        frame_queue = queue.Queue(maxsize=max(1, int(queue_depth)))
+        counters = {"frames_total": 0, "frames_decoded": 0, "decode_time": 0.0}
+        decoder = threading.Thread(
+            target=_decode_frames,
+            args=(cap, frame_queue, stop_event, counters, stride,
+                  sample_mode, scene_threshold, resize_max_side),
+            daemon=True)
+        decoder.start()
+
+        # Per-track aggregation of detections
+        aggregator = TrackAggregator(class_dict)
+        # Total time spent in model inference and tracking
+        inference_time = 0.0
+        tracking_time = 0.0
+        frames_inferred = 0
+        # Drain the queue in batches until the end-of-stream sentinel
+        finished = False
+        while not finished:
+            frame = frame_queue.get()
+            if frame is None:
                 break
-
-            # Run YOLO on current frame
-            result = model(frame)[0]
-            # Parse results
-            detections = sv.Detections.from_ultralytics(result)
-            # Apply tracking
-            detections = tracker.update_with_detections(detections)
-
-            # Filter detections based on confidence
-            if detections.tracker_id is not None:
-                detections = detections[detections.confidence > confidence]
-                labels += [
-                    class_dict[cls_id] for cls_id in detections.class_id
-                ]
-
-        # Return all detected bird names
-        return labels
+            batch = [frame]
+            while len(batch) < batch_size:
+                try:
+                    frame = frame_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is None:
+                    finished = True
+                    break
+                batch.append(frame)
+
+            # Run the detector on the batch of frames
+            start = time.perf_counter()
+            batch_detections = _detect(model, batch)
+            inference_time += time.perf_counter() - start
+            frames_inferred += len(batch)
+
+            start = time.perf_counter()
+            for detections in batch_detections:
+                # Apply tracking
+                detections = tracker.update_with_detections(detections)
+
+                # Filter detections based on confidence
+                if detections.tracker_id is not None:
+                    detections = detections[detections.confidence > confidence]
+                    aggregator.update(detections)
+            tracking_time += time.perf_counter() - start
+
+        decoder.join()
+        if "error" in counters:
+            raise counters["error"]
+
+        logger.info(f"Video ({sample_mode}, stride {stride}): "
+                    f"{counters['frames_total']} frames, "
+                    f"{counters['frames_decoded']} decoded, "
+                    f"{frames_inferred} inferred in {inference_time:.3f}s")
+        if stats is not None:
+            stats.update({
+                "frames_total": counters["frames_total"],
+                "frames_decoded": counters["frames_decoded"],
+                "frames_inferred": frames_inferred,
+                "decode_time": counters["decode_time"],
+                "model_load_time": model_load_time,
+                "inference_time": inference_time,
+                "tracking_time": tracking_time,
+                "tracks": aggregator.tracks(),
+            })
+        # Return one bird name per tracked bird
+        return aggregator.labels()
 
     except Exception as e:
         print(f"Video prediction failed: {e}")  # Log failure
         return []
 
     finally:
-        cap.release()
+        # Stop the decoder before releasing the capture it reads from
+        stop_event.set()
+        if decoder is not None:
+            decoder.join()
+        if cap is not None:
+            cap.release()
         print("Released video resources.")
 
 
+# Function: Version label of detection results for the cache
+def _cache_version(file_type):
+    """
+    Identify the model and settings that produced a result, so cached
+    results are never reused across model or sampling changes.
+
+    Args:
+        file_type (str): 'image' or 'video'.
+
+    Returns:
+        str: Version label.
+    """
+    version = f"{file_type}:{os.path.basename(MODEL_PATH)}:{_model_version(MODEL_PATH)}"
+    if file_type == "video":
+        version += f":{VIDEO_SAMPLE_MODE}:{VIDEO_FRAME_STRIDE}:{VIDEO_SCENE_THRESHOLD}"
+    return version
+
+
 # Lambda handler function
 def handler(event, context):
+    metrics = Metrics("query_birds_detection")
+    try:
+        response = _handle(event, metrics)
+        metrics.set_property("status_code", response["statusCode"])
+        return response
+    finally:
+        metrics.flush()
+
+
+# Function: Detect birds in the file of a query request
+def _handle(event, metrics):
     logger.info(f"Received event: {event}")
 
     body = event.get("body")
     if isinstance(body, str):
-        import json
         body = json.loads(body)
     logger.info(f"Parsed body: {body}")
 
@@ -147,14 +670,10 @@ def handler(event, context):
         return {"statusCode": 400, "body": "Missing file_bytes"}
 
     try:
-        file_bytes = base64.b64decode(file_base64)
-        file_name = datetime.now().strftime("%Y%m%d_%H%M%S") + file_type
-        local_path = f"/tmp/{file_name}"
-        logger.info(f"Saving file to: {local_path}")
-
-        with open(local_path, "wb") as f:
-            f.write(file_bytes)
-        logger.info(f"Saved file: {file_name} ({len(file_bytes)} bytes)")
+        with metrics.timer("request_decode"):
+            file_bytes = base64.b64decode(file_base64)
+        metrics.add("object_bytes", len(file_bytes), "Bytes")
+        logger.info(f"Received file ({len(file_bytes)} bytes)")
 
         tags = []
         file_type = file_type.lower()
@@ -163,31 +682,84 @@ def handler(event, context):
         video_exts = [".mp4", ".mov", ".avi", ".mkv", ".webm"]
 
         if file_type in image_exts:
+            media_type = "image"
+        elif file_type in video_exts:
+            media_type = "video"
+        else:
+            logger.warning(f"Unsupported file_type: {file_type}")
+            return {"statusCode": 400, "body": f"Unsupported file type: {file_type}"}
+
+        metrics.set_property("file_type", media_type)
+
+        # Reuse the result of identical content seen before
+        digest = content_hash(file_bytes)
+        with metrics.timer("dynamodb_read"):
+            cached = detection_cache.get(digest, _cache_version(media_type))
+        if cached is not None:
+            logger.info(f"Detection cache hit: {cached['tags']}")
+            metrics.add("cache_hit", 1)
+            with metrics.timer("json_serialize"):
+                response_body = json.dumps(cached["tags"])
+            return {
+                "statusCode": 200,
+                "body": response_body
+            }
+
+        # Set once a complete result is available for caching
+        completed = False
+        if media_type == "image":
             try:
                 logger.info("Processing as image")
-                tags = image_prediction(local_path)
+                # Decode straight from the request bytes
+                with metrics.timer("decode"):
+                    image = decode_image(file_bytes)
+                if image is not None:
+                    image_stats = {}
+                    tags = image_prediction(image, stats=image_stats)
+                    metrics.add_time("model_load", image_stats.get("model_load_time", 0.0))
+                    metrics.add_time("inference", image_stats.get("inference_time", 0.0))
+                    completed = True
                 logger.info(f"Image tags: {tags}")
             except Exception as e:
                 logger.warning(f"Image processing failed: {e}")
                 tags = []
-        elif file_type in video_exts:
+        else:
+            # OpenCV needs a file to read video from
+            fd, local_path = tempfile.mkstemp(suffix=file_type)
             try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(file_bytes)
                 logger.info("Processing as video")
-                tags = video_prediction(local_path)
+                video_stats = {}
+                tags = video_prediction(local_path, stats=video_stats)
+                completed = bool(video_stats)
+                for name in ("frames_total", "frames_decoded", "frames_inferred"):
+                    metrics.add(name, video_stats.get(name, 0))
+                metrics.add("tracks", len(video_stats.get("tracks", [])))
+                for stage in ("decode", "model_load", "inference", "tracking"):
+                    metrics.add_time(stage, video_stats.get(f"{stage}_time", 0.0))
                 logger.info(f"Video tags: {tags}")
             except Exception as e:
                 logger.warning(f"Video processing failed: {e}")
                 tags = []
-        else:
-            logger.warning(f"Unsupported file_type: {file_type}")
-            return {"statusCode": 400, "body": f"Unsupported file type: {file_type}"}
+            finally:
+                os.remove(local_path)
 
         tag_summary = dict(Counter(tags))
         logger.info(f"Final tag summary: {tag_summary}")
+        metrics.add("detections", sum(tag_summary.values()))
+        if completed:
+            with metrics.timer("dynamodb_write"):
+                detection_cache.put(digest, _cache_version(media_type),
+                                    {"file_type": media_type, "tags": tag_summary})
+        else:
+            metrics.add("errors", 1)
 
+        with metrics.timer("json_serialize"):
+            response_body = json.dumps(tag_summary)
         return {
             "statusCode": 200,
-            "body": json.dumps(tag_summary)
+            "body": response_body
         }
 
     except Exception as e:
@@ -0,0 +1,71 @@
+# Tag edits against a moto DynamoDB table: python -m pytest backend/tests
+import json
+import os
+import sys
+
+import pytest
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+# Keep the species index, statistics and version counter out of the way
+os.environ.update({
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "SPECIES_INDEX_TABLE": "",
+    "SPECIES_STATS_TABLE": "",
+    "INDEX_VERSION_TABLE": "",
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "other_query"))
+
+
+@pytest.fixture
+def handler():
+    with moto.mock_aws():
+        import lambda_delete_by_tags
+
+        client = boto3.client("dynamodb")
+        client.create_table(
+            TableName="BirdTagMediaIndex",
+            KeySchema=[{"AttributeName": "file_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "file_id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        lambda_delete_by_tags.dynamodb = client
+        yield lambda_delete_by_tags, client
+
+
+def edit(handler, operation, tags, urls):
+    module, _ = handler
+    body = {"url": urls, "operation": operation, "tags": tags}
+    response = module.lambda_handler({"body": json.dumps(body)}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def stored_tags(handler, file_id):
+    _, client = handler
+    item = client.get_item(TableName="BirdTagMediaIndex", Key={"file_id": {"S": file_id}})["Item"]
+    return {tag: int(value["N"]) for tag, value in item.get("tags", {}).get("M", {}).items()}
+
+
+@pytest.mark.parametrize("operation, tags, expected", [
+    ("set", ["crow,5"], {"Crow": 5}),
+    ("add", ["crow,2"], {"Crow": 2}),
+    ("remove", ["crow"], {}),
+])
+def test_item_without_tags_map(handler, operation, tags, expected):
+    handler[1].put_item(TableName="BirdTagMediaIndex", Item={"file_id": {"S": "a.jpg"}})
+
+    status, body = edit(handler, operation, tags, ["a.jpg"])
+
+    assert status == 200
+    assert body["updated"] == ["a.jpg"]
+    assert stored_tags(handler, "a.jpg") == expected
+
+
+def test_missing_file_is_reported(handler):
+    status, body = edit(handler, "set", ["crow,5"], ["missing.jpg"])
+
+    assert status == 207
+    assert body["failed"][0]["url"] == "missing.jpg"